@@ -0,0 +1,66 @@
+#-*- coding: utf-8 -*-
+"""
+Export throughput of parallel_dump by number of workers, against a
+file-backed SQLite database.
+
+.. code-block:: console
+
+    $> python benchmarks/bench_parallel_dump.py [rows]
+"""
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from sqla_helpers.base_model import BaseModel
+from sqla_helpers.tests.class_test import Treatment, Status, metadata
+
+ROWS = 100000
+
+
+def populate(session, engine, rows):
+    metadata.create_all(engine)
+    status = [Status(u'ok'), Status(u'ko')]
+    session.add_all(status)
+    session.flush()
+    Treatment.bulk_upsert({'name': u'test {0}'.format(i),
+                           'status_id': status[i % 2].id}
+                          for i in xrange(rows))
+    session.commit()
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else ROWS
+    directory = tempfile.mkdtemp()
+    try:
+        engine = create_engine('sqlite:///' +
+                               os.path.join(directory, 'bench.db'))
+        session = sessionmaker(bind=engine)()
+        BaseModel.register_sessionmaker(session, force=True)
+        populate(session, engine, rows)
+
+        print '{0:<10} {1:>12} {2:>12} {3:>10}'.format(
+            'workers', 'seconds', 'rows/s', 'speedup')
+        reference = None
+        workers = 1
+        while workers <= multiprocessing.cpu_count():
+            start = time.time()
+            count = sum(1 for _ in Treatment.parallel_dump(workers=workers))
+            duration = time.time() - start
+            assert count == rows
+            if reference is None:
+                reference = duration
+            print '{0:<10} {1:>12.2f} {2:>12.0f} {3:>10.2f}'.format(
+                workers, duration, rows / duration, reference / duration)
+            workers *= 2
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+#-*- coding: utf-8 -*-
+"""
+Per-call overhead of query operations, with and without baked statements.
+
+.. code-block:: console
+
+    $> python benchmarks/bench_shapes.py
+"""
+import timeit
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from sqla_helpers.base_model import BaseModel
+from sqla_helpers.logical import Q
+from sqla_helpers.tests.class_test import Treatment, Status, metadata
+
+CALLS = 2000
+
+
+def populate(session, engine):
+    metadata.create_all(engine)
+    status = [Status(u'ok'), Status(u'ko')]
+    session.add_all(status)
+    for i in xrange(100):
+        session.add(Treatment(u'test {0}'.format(i), status[i % 2]))
+    session.commit()
+
+
+def operations():
+    # Les valeurs changent à chaque appel, la forme reste la même
+    values = iter(xrange(1 << 30))
+    return [
+        ('get(id=...)', lambda: Treatment.one(id=next(values) % 100 + 1)),
+        ('filter(status__name=..., id__lt=...)',
+         lambda: Treatment.filter(status__name=u'ok', id__lt=next(values) % 100)),
+        ('count(Q | Q)',
+         lambda: Treatment.count(Q(id=next(values) % 100) | Q(status__name=u'ko'))),
+    ]
+
+
+def main():
+    engine = create_engine('sqlite://')
+    session = sessionmaker(bind=engine)()
+    BaseModel.register_sessionmaker(session, force=True)
+    populate(session, engine)
+
+    print '{0:<40} {1:>12} {2:>12}'.format('operation', 'search (us)',
+                                           'baked (us)')
+    for name, operation in operations():
+        timings = []
+        for bake_queries in (False, True):
+            BaseModel.bake_queries = bake_queries
+            operation()
+            duration = timeit.timeit(operation, number=CALLS)
+            timings.append(duration / CALLS * 1e6)
+        print '{0:<40} {1:>12.1f} {2:>12.1f}'.format(name, *timings)
+
+
+if __name__ == '__main__':
+    main()
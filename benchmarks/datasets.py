@@ -0,0 +1,150 @@
+#-*- coding: utf-8 -*-
+"""
+Synthetic datasets of the benchmark suite, in file-backed SQLite databases.
+
+A dataset has the `Treatment` / `Status` models of the tests and a deeper
+chain of relations: `Task` -> `Employee` -> `Department` -> `Company`.
+`rows` is the number of treatments and of tasks.
+
+Databases are generated once per number of rows and seed, and reused by
+following runs.
+
+.. code-block:: console
+
+    $> python benchmarks/datasets.py 100000
+    /tmp/sqla_helpers_bench/bench-100000-0.sqlite
+"""
+import os
+import random
+import sys
+import tempfile
+
+from sqlalchemy import Column, ForeignKey, Integer, String, Text, \
+        create_engine
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import deferred, relationship
+
+from sqla_helpers.base_model import BaseModel
+from sqla_helpers.tests.class_test import Treatment, Status, metadata
+
+Base = declarative_base(cls=BaseModel)
+
+STATUSES = [u'ok', u'ko', u'pending', u'cancelled']
+COMPANIES = 10
+DEPARTMENTS_PER_COMPANY = 10
+EMPLOYEES_PER_DEPARTMENT = 10
+CHUNK_SIZE = 10000
+
+
+class Company(Base):
+    __tablename__ = 'company'
+    id = Column('id', Integer, primary_key=True)
+    name = Column('name', String)
+
+
+class Department(Base):
+    __tablename__ = 'department'
+    id = Column('id', Integer, primary_key=True)
+    name = Column('name', String)
+    company_id = Column('company_id', ForeignKey('company.id'), index=True)
+    company = relationship('Company', backref='departments')
+
+
+class Employee(Base):
+    __tablename__ = 'employee'
+    id = Column('id', Integer, primary_key=True)
+    name = Column('name', String)
+    department_id = Column('department_id', ForeignKey('department.id'),
+                           index=True)
+    department = relationship('Department', backref='employees')
+
+
+class Task(Base):
+    __tablename__ = 'task'
+    id = Column('id', Integer, primary_key=True)
+    title = Column('title', String)
+    amount = Column('amount', Integer)
+    description = deferred(Column('description', Text))
+    employee_id = Column('employee_id', ForeignKey('employee.id'), index=True)
+    employee = relationship('Employee', backref='tasks')
+
+
+def default_directory():
+    return os.path.join(tempfile.gettempdir(), 'sqla_helpers_bench')
+
+
+def path(rows, seed=0, directory=None):
+    """
+    Returns the path of the database of `rows` rows generated with `seed`.
+    """
+    return os.path.join(directory or default_directory(),
+                        'bench-{0}-{1}.sqlite'.format(rows, seed))
+
+
+def _insert(connection, table, rows):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == CHUNK_SIZE:
+            connection.execute(table.insert(), chunk)
+            chunk = []
+    if chunk:
+        connection.execute(table.insert(), chunk)
+
+
+def generate(rows, seed=0, directory=None):
+    """
+    Generates the database of `rows` rows if it doesn't exist yet, and
+    returns its path.
+    """
+    filename = path(rows, seed, directory)
+    if os.path.exists(filename):
+        return filename
+    if not os.path.isdir(os.path.dirname(filename)):
+        os.makedirs(os.path.dirname(filename))
+
+    rng = random.Random(seed)
+    # Base écrite sous un autre nom puis renommée : une génération
+    # interrompue ne laisse pas de base incomplète.
+    partial = filename + '.partial'
+    if os.path.exists(partial):
+        os.remove(partial)
+    engine = create_engine('sqlite:///' + partial)
+    metadata.create_all(engine)
+    Base.metadata.create_all(engine)
+
+    departments = COMPANIES * DEPARTMENTS_PER_COMPANY
+    employees = departments * EMPLOYEES_PER_DEPARTMENT
+    with engine.begin() as connection:
+        _insert(connection, Status.__table__,
+                ({'id': i, 'name': name}
+                 for i, name in enumerate(STATUSES, 1)))
+        _insert(connection, Treatment.__table__,
+                ({'id': i, 'name': u'treatment {0}'.format(i),
+                  'status_id': rng.randint(1, len(STATUSES))}
+                 for i in xrange(1, rows + 1)))
+        _insert(connection, Company.__table__,
+                ({'id': i, 'name': u'company {0}'.format(i)}
+                 for i in xrange(1, COMPANIES + 1)))
+        _insert(connection, Department.__table__,
+                ({'id': i, 'name': u'department {0}'.format(i),
+                  'company_id': (i - 1) // DEPARTMENTS_PER_COMPANY + 1}
+                 for i in xrange(1, departments + 1)))
+        _insert(connection, Employee.__table__,
+                ({'id': i, 'name': u'employee {0}'.format(i),
+                  'department_id': (i - 1) // EMPLOYEES_PER_DEPARTMENT + 1}
+                 for i in xrange(1, employees + 1)))
+        _insert(connection, Task.__table__,
+                ({'id': i, 'title': u'task {0}'.format(i),
+                  'amount': rng.randint(1, 100000),
+                  'description': u'lorem ipsum ' * 50,
+                  'employee_id': rng.randint(1, employees)}
+                 for i in xrange(1, rows + 1)))
+        connection.execute('ANALYZE')
+    engine.dispose()
+    os.rename(partial, filename)
+    return filename
+
+
+if __name__ == '__main__':
+    print generate(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
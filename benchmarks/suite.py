@@ -0,0 +1,346 @@
+#-*- coding: utf-8 -*-
+"""
+Benchmark suite of the query, dump and load hot paths.
+
+Each operation runs in its own process, on a database generated by
+:mod:`datasets`, and reports:
+
+* `ops/s`: calls per second,
+* `p50` and `p99`: latency percentiles of a call, in milliseconds,
+* `sql/op`: statements executed per call,
+* `peak MB`: growth of the peak resident memory of the process while
+  running the operation, warm-up included.
+
+Results can be saved in a JSON file, and compared to a saved baseline: the
+command fails when an operation is slower than the baseline by more than
+the threshold.
+
+.. code-block:: console
+
+    $> python benchmarks/suite.py run --rows 100000 --save baseline.json
+    $> python benchmarks/suite.py run --rows 100000 --compare baseline.json
+    $> python benchmarks/suite.py compare baseline.json current.json --threshold 10
+    $> python benchmarks/suite.py list
+"""
+import argparse
+import json
+import multiprocessing
+import random
+import resource
+import sys
+import timeit
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from sqla_helpers.base_model import BaseModel
+from sqla_helpers.logical import Q
+from sqla_helpers.process import process_params
+from sqla_helpers.tests.class_test import Treatment
+
+import datasets
+from datasets import Task
+
+OPERATIONS = []
+
+
+def operation(calls=200, name=None):
+    """
+    Registers a benchmark operation, named as the decorated function unless
+    `name` is given. The decorated function gets a context (number of rows,
+    random generator) and returns the function to time, called `calls`
+    times.
+    """
+    def register(function):
+        OPERATIONS.append((name or function.__name__, function, calls))
+        return function
+    return register
+
+
+def _id(context, span=1):
+    return context['random'].randint(1, context['rows'] - span)
+
+
+@operation(calls=5000, name='process_params')
+def parse_criterions(context):
+    return lambda: process_params(Treatment, [], status__name=u'ok',
+                                  id__lt=_id(context), name__like=u't%')
+
+
+@operation(calls=5000)
+def q_evaluate(context):
+    def run():
+        node = (Q(id=_id(context)) | Q(status__name=u'ko')) & ~Q(name=u'x')
+        return node(Treatment, [])
+    return run
+
+
+@operation(calls=2000)
+def search_build(context):
+    return lambda: Treatment.search(Q(id__lt=_id(context)) |
+                                    Q(status__name=u'ko'), name__like=u't%')
+
+
+@operation(calls=2000)
+def get(context):
+    return lambda: Treatment.get(id=_id(context))
+
+
+@operation(calls=2000)
+def one(context):
+    return lambda: Treatment.one(id=_id(context))
+
+
+@operation(calls=500)
+def filter_100(context):
+    def run():
+        first = _id(context, 100)
+        return Treatment.filter(id__ge=first, id__lt=first + 100,
+                                status__name=u'ok')
+    return run
+
+
+@operation(calls=500)
+def filter_deep_chain(context):
+    def run():
+        first = _id(context, 1000)
+        return Task.filter(employee__department__company__name=u'company 1',
+                           id__ge=first, id__lt=first + 1000)
+    return run
+
+
+@operation(calls=200)
+def count(context):
+    return lambda: Treatment.count(status__name=u'ok', id__gt=_id(context))
+
+
+@operation(calls=2000)
+def exists(context):
+    return lambda: Treatment.exists(status__name=u'ko', id__gt=_id(context))
+
+
+@operation(calls=200)
+def values_1000(context):
+    def run():
+        first = _id(context, 1000)
+        return Task.values(fields=['id', 'title', 'employee__name'],
+                           id__ge=first, id__lt=first + 1000)
+    return run
+
+
+@operation(calls=200)
+def dump_100(context):
+    def run():
+        first = _id(context, 100)
+        objects = Treatment.filter(id__ge=first, id__lt=first + 100)
+        return [o.dump() for o in objects]
+    return run
+
+
+@operation(calls=200)
+def dump_many_100(context):
+    def run():
+        first = _id(context, 100)
+        return Treatment.dump_many(Treatment.search(id__ge=first,
+                                                    id__lt=first + 100))
+    return run
+
+
+@operation(calls=50)
+def iter_dump_1000(context):
+    def run():
+        first = _id(context, 1000)
+        return sum(1 for _ in Task.iter_dump(id__ge=first, id__lt=first + 1000,
+                                             depth=2, chunk_size=500))
+    return run
+
+
+@operation(calls=200)
+def load_many_100(context):
+    def run():
+        first = _id(context, 100)
+        res = Treatment.load_many([{'id': i, 'name': u'loaded {0}'.format(i),
+                                    'status': {'id': i % 4 + 1}}
+                                   for i in xrange(first, first + 100)])
+        Treatment.session.rollback()
+        return res
+    return run
+
+
+def percentile(timings, rank):
+    """
+    Returns the `rank` percentile of sorted `timings`.
+    """
+    index = int(round(rank / 100. * (len(timings) - 1)))
+    return timings[index]
+
+
+def _measure(database, rows, name, factory, calls, seed, pipe):
+    """
+    Runs an operation in a child process and sends its results in `pipe`.
+    """
+    # `ru_maxrss` ne fait que croître : la référence est lue avant toute
+    # allocation de l'opération, sinon l'échauffement a déjà atteint le pic
+    memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    engine = create_engine('sqlite:///' + database)
+    session = sessionmaker(bind=engine)()
+    BaseModel.register_sessionmaker(session, force=True)
+    statements = [0]
+
+    def before(conn, cursor, statement, parameters, context, executemany):
+        statements[0] += 1
+    event.listen(engine, 'before_cursor_execute', before)
+
+    context = {'rows': rows, 'random': random.Random(seed)}
+    function = factory(context)
+    # Échauffement : mappers configurés, requêtes compilées
+    for _ in xrange(min(10, calls)):
+        function()
+        session.expunge_all()
+    statements[0] = 0
+
+    clock = timeit.default_timer
+    timings = []
+    start = clock()
+    for _ in xrange(calls):
+        before_call = clock()
+        function()
+        timings.append(clock() - before_call)
+        session.expunge_all()
+    total = clock() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - memory
+
+    timings.sort()
+    pipe.send({
+        'calls': calls,
+        'ops_per_sec': calls / total,
+        'p50_ms': percentile(timings, 50) * 1000,
+        'p99_ms': percentile(timings, 99) * 1000,
+        'statements_per_op': statements[0] / float(calls),
+        # `ru_maxrss` est en kilo-octets sous Linux
+        'peak_mb': peak / 1024.,
+    })
+    pipe.close()
+
+
+def run(rows, seed=0, names=None, directory=None, scale=1.0):
+    """
+    Runs operations (all of them without `names`) on the dataset of `rows`
+    rows, and returns results by operation name.
+    """
+    database = datasets.generate(rows, seed, directory)
+    results = {}
+    print HEADER
+    for name, factory, calls in OPERATIONS:
+        if names and name not in names:
+            continue
+        calls = max(1, int(calls * scale))
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        process = multiprocessing.Process(
+            target=_measure,
+            args=(database, rows, name, factory, calls, seed, sender))
+        process.start()
+        sender.close()
+        results[name] = receiver.recv()
+        process.join()
+        print_result(name, results[name])
+    return results
+
+
+HEADER = '{0:<20} {1:>10} {2:>9} {3:>9} {4:>7} {5:>8}'.format(
+    'operation', 'ops/s', 'p50 ms', 'p99 ms', 'sql/op', 'peak MB')
+
+
+def print_result(name, result):
+    print '{0:<20} {1:>10.1f} {2:>9.3f} {3:>9.3f} {4:>7.1f} {5:>8.1f}'.format(
+        name, result['ops_per_sec'], result['p50_ms'], result['p99_ms'],
+        result['statements_per_op'], result['peak_mb'])
+
+
+def compare(baseline, current, threshold=10.0):
+    """
+    Prints the change of each operation from `baseline` to `current`
+    results, and returns the names of operations whose throughput dropped
+    by more than `threshold` percents.
+    """
+    print '{0:<20} {1:>10} {2:>10} {3:>8} {4:>9} {5:>9}'.format(
+        'operation', 'base ops/s', 'ops/s', 'change', 'base p99', 'p99')
+    regressions = []
+    for name in sorted(set(baseline) & set(current)):
+        before, after = baseline[name], current[name]
+        change = (after['ops_per_sec'] / before['ops_per_sec'] - 1) * 100
+        flag = ''
+        if change < -threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        elif after['statements_per_op'] > before['statements_per_op']:
+            flag = '  more SQL'
+        print '{0:<20} {1:>10.1f} {2:>10.1f} {3:>+7.1f}% {4:>9.3f} ' \
+              '{5:>9.3f}{6}'.format(name, before['ops_per_sec'],
+                                    after['ops_per_sec'], change,
+                                    before['p99_ms'], after['p99_ms'], flag)
+    for name in sorted(set(baseline) ^ set(current)):
+        print '{0:<20} only in {1}'.format(
+            name, 'baseline' if name in baseline else 'current results')
+    return regressions
+
+
+def _load(filename):
+    with open(filename) as stream:
+        return json.load(stream)['results']
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    commands = parser.add_subparsers(dest='command')
+
+    run_parser = commands.add_parser('run', help='run operations')
+    run_parser.add_argument('--rows', type=int, default=10000,
+                            help='rows of the dataset (10k to 1M)')
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--data-dir', default=None,
+                            help='directory of generated databases')
+    run_parser.add_argument('--scale', type=float, default=1.0,
+                            help='multiplier of the number of calls')
+    run_parser.add_argument('--only', action='append', default=[],
+                            help='operation to run, can be repeated')
+    run_parser.add_argument('--save', help='write results in a JSON file')
+    run_parser.add_argument('--compare', metavar='BASELINE',
+                            help='compare results to a saved baseline')
+    run_parser.add_argument('--threshold', type=float, default=10.0,
+                            help='allowed throughput drop, in percents')
+
+    compare_parser = commands.add_parser('compare',
+                                         help='compare two saved results')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=10.0,
+                                help='allowed throughput drop, in percents')
+
+    commands.add_parser('list', help='list operations')
+
+    args = parser.parse_args(argv)
+    if args.command == 'list':
+        for name, _, calls in OPERATIONS:
+            print '{0:<20} {1:>6} calls'.format(name, calls)
+        return 0
+
+    if args.command == 'compare':
+        regressions = compare(_load(args.baseline), _load(args.current),
+                              args.threshold)
+        return 1 if regressions else 0
+
+    results = run(args.rows, args.seed, args.only, args.data_dir, args.scale)
+    if args.save:
+        with open(args.save, 'w') as stream:
+            json.dump({'rows': args.rows, 'seed': args.seed,
+                       'results': results}, stream, indent=2, sort_keys=True)
+    if args.compare:
+        print
+        regressions = compare(_load(args.compare), results, args.threshold)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,90 @@
+#-*- coding: utf-8 -*-
+"""
+Aggregation
+===========
+
+:meth:`sqla_helpers.base_model.BaseModel.aggregate` computes aggregates in
+the database, grouped by attributes. Grouping and aggregated attributes are
+given in :mod:`sqla_helpers` syntax (`status__name`). Relations crossed by
+criterions are joined as usual, relations only crossed by grouping or
+aggregated attributes are joined with a `LEFT OUTER JOIN`: objects without
+related object are grouped under `None`.
+
+Each row has an attribute per grouping attribute, named as the attribute,
+and an attribute per aggregate, named as the attribute followed by the
+function (`id__count`, `amount__sum`).
+
+.. code-block:: python
+
+    >>> rows = Treatment.aggregate(group_by=['status__name'], count='id',
+    ...                            max=['id', 'name'])
+    >>> rows[0].status__name, rows[0].id__count, rows[0].id__max
+    (u'ko', 8, 18)
+    >>> rows[0]._asdict()
+    {'status__name': u'ko', 'id__count': 8, 'id__max': 18, 'name__max': u'test_ko 7'}
+
+Aggregates are computed over the rows of the join: through a relation to a
+list of objects, an object is counted once per related object.
+
+.. autodata:: FUNCTIONS
+
+.. autofunction:: aggregate
+"""
+from collections import OrderedDict
+
+from sqlalchemy import func
+
+FUNCTIONS = OrderedDict([
+    ('count', func.count),
+    ('sum', func.sum),
+    ('avg', func.avg),
+    ('min', func.min),
+    ('max', func.max),
+])
+"""
+Aggregate functions, by name of keyword argument.
+"""
+
+
+def _paths(value):
+    """
+    Returns a list of attribute paths from a path or a list of them.
+    """
+    if isinstance(value, basestring):
+        return [value]
+    return list(value)
+
+
+def aggregate(cls, operators, criterions, group_by=(), aggregates=None):
+    """
+    Returns rows of aggregates of objects of `cls` matching `operators` and
+    `criterions`, grouped by attributes `group_by`.
+
+    `aggregates` is a dictionary of function name (see :data:`FUNCTIONS`) ->
+    attribute path or list of attribute paths.
+    """
+    aggregates = aggregates or {}
+    joined_class, clauses = cls._criteria(operators, criterions)
+    # Les classes ajoutées par les regroupements et agrégats seulement sont
+    # jointes à gauche
+    fields_class = list(joined_class)
+
+    groups = [cls.process_path(fields_class, path)
+              for path in _paths(group_by)]
+    columns = [group.label(path)
+               for group, path in zip(groups, _paths(group_by))]
+    for name, function in FUNCTIONS.iteritems():
+        for path in _paths(aggregates.get(name, ())):
+            attribute = cls.process_path(fields_class, path)
+            columns.append(function(attribute)
+                           .label('{0}__{1}'.format(path, name)))
+    if not columns:
+        raise ValueError('Nothing to aggregate')
+
+    query = cls.session.query(*columns).select_from(cls)
+    query = query.join(*joined_class)
+    query = query.outerjoin(*fields_class[len(joined_class):])
+    query = query.filter(*clauses)
+    if groups:
+        query = query.group_by(*groups).order_by(*groups)
+    return query.all()
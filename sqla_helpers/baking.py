@@ -0,0 +1,196 @@
+#-*- coding: utf-8 -*-
+"""
+Statement shapes
+================
+
+Query operations (`get`, `filter`, `count` ...) of
+:class:`sqla_helpers.base_model.BaseModel` are run through `SQLAlchemy` baked
+queries.
+
+A call is reduced to its *shape*: the class, the criterions keys and the
+structure of :class:`sqla_helpers.logical.Q` operators. Values are sent as
+bind parameters. The query of a shape is built and its SQL
+compiled once, then reused by every call with the same shape whatever the
+values.
+
+.. code-block:: python
+
+    >>> key, values = shape(Treatment, [Q(id=1) | Q(status__name=u'ko')],
+    ...                     {'name': u'a', 'status_id__in': [1, 2]})
+    >>> values
+    [1, u'ko', u'a', [1, 2]]
+
+A call can't be baked when:
+
+* an operator isn't a :class:`sqla_helpers.logical.Q` object,
+* a criterion compares a relation (`status=status`) or isn't a column,
+* a value is a SQL expression, or an `in` value isn't a list.
+
+Such calls are run as regular queries.
+
+.. autofunction:: shape
+
+.. autofunction:: baked_query
+"""
+import itertools
+
+from sqlalchemy import bindparam
+from sqlalchemy.ext import baked
+from sqlalchemy.orm.properties import ColumnProperty
+from sqlalchemy.sql.expression import ClauseElement
+
+from sqla_helpers.logical import Q, walk, postorder
+from sqla_helpers.process import lookup_cache
+
+bakery = baked.bakery(size=500)
+"""
+Cache of baked queries, shared by all models.
+"""
+
+BIND = 'v'
+EXPANDING = 'e'
+LITERAL_NONE = 'n'
+
+
+class Unbakeable(Exception):
+    """
+    Raised when a call can't be reduced to a shape.
+    """
+
+
+def _criterions_shape(cls, criterions, values):
+    """
+    Returns the shape of `criterions` and appends their values in `values`.
+    """
+    res = []
+    for key in sorted(criterions):
+        value = criterions[key]
+        try:
+            plan = lookup_cache.get(cls, key)
+        except AttributeError:
+            # Le chemin classique lèvera l'erreur, ou connait ce paramètre
+            # (`dump_depth` ...)
+            raise Unbakeable()
+        if not isinstance(getattr(plan.attribute, 'property', None),
+                          ColumnProperty):
+            raise Unbakeable()
+
+        if value is None:
+            # `== None` devient `IS NULL`, ça ne peut pas être un paramètre
+            res.append((key, LITERAL_NONE))
+            continue
+        if isinstance(value, ClauseElement) or \
+           hasattr(value, '__clause_element__'):
+            raise Unbakeable()
+
+        if plan.operator == 'in_':
+            if not isinstance(value, (list, tuple, set, frozenset)):
+                raise Unbakeable()
+            res.append((key, EXPANDING))
+            values.append(list(value))
+        else:
+            res.append((key, BIND))
+            values.append(value)
+    return tuple(res)
+
+
+def _ast_shape(cls, node, values):
+    """
+    Returns the shape of an AST node and appends its values in `values`.
+    """
+    # Le parcours en profondeur et le nombre d'enfants de chaque noeud
+    # suffisent à décrire l'arbre ; les valeurs sont dans l'ordre des feuilles.
+    return tuple((current.__class__,
+                  _criterions_shape(cls, current.operand, values),
+                  len(current.children))
+                 for current in walk(node))
+
+
+def shape(cls, operators, criterions):
+    """
+    Returns a (shape, values) couple for a call on `cls`, or `None` if the
+    call can't be baked. `values` are given in the order of bind parameters
+    of the shape.
+    """
+    values = []
+    try:
+        operators_shape = []
+        for operator in operators:
+            if not isinstance(operator, Q):
+                raise Unbakeable()
+            # Forme de l'arbre optimisé : `Q(id=1) | Q(id=2) | ...` devient un
+            # seul paramètre `in`, quel que soit le nombre de valeurs.
+            operators_shape.append(_ast_shape(cls, operator.optimized(cls),
+                                              values))
+        return ((cls, tuple(operators_shape),
+                 _criterions_shape(cls, criterions, values)), values)
+    except Unbakeable:
+        return None
+
+
+def _parameters(criterions_shape, counter):
+    """
+    Returns criterions of a shape, with bind parameters as values.
+    """
+    criterions = {}
+    for key, kind in criterions_shape:
+        if kind == LITERAL_NONE:
+            criterions[key] = None
+        else:
+            criterions[key] = bindparam('p{0}'.format(next(counter)),
+                                        expanding=kind == EXPANDING)
+    return criterions
+
+
+def _parametrized_ast(node, node_shape, counter):
+    """
+    Returns a copy of `node` whose values are bind parameters.
+    """
+    # Seules les feuilles ont des critères, et elles sont visitées dans le
+    # même ordre (de gauche à droite) par `walk` et `postorder`.
+    leaves_shape = iter(operand_shape for _, operand_shape, _ in node_shape
+                        if operand_shape)
+
+    def visit(current, children):
+        if current.operand:
+            return current.__class__(
+                **_parameters(next(leaves_shape), counter))
+        return current.__class__(*children)
+
+    return postorder(node, visit)
+
+
+def parameters(values):
+    """
+    Returns the dictionary of bind parameters of a shape.
+    """
+    return dict(('p{0}'.format(index), value)
+                for index, value in enumerate(values))
+
+
+def baked_query(cls, key, operators, operation=None, dialect=None):
+    """
+    Returns the baked query of shape `key`. `operators` are the operators of
+    the current call, used to build the query the first time the shape is
+    met.
+
+    With an `operation` (`count` or `exists`), the query selects its result
+    for the database `dialect`.
+    """
+    def build(session):
+        _, operators_shape, criterions_shape = key
+        counter = itertools.count()
+        parametrized = [Q(_parametrized_ast(operator.optimized(cls),
+                                            operator_shape, counter))
+                        for operator, operator_shape
+                        in zip(operators, operators_shape)]
+        criterions = _parameters(criterions_shape, counter)
+        if operation is not None:
+            return cls._scalar_query(session, operation, *parametrized,
+                                     **criterions)
+        return cls._filter_query(session.query(cls), *parametrized,
+                                 **criterions)
+
+    # La clef d'un baked query est le code des fonctions plus les arguments
+    # donnés : la forme, l'opération et la base en font partie.
+    return bakery(build, key, operation, dialect)
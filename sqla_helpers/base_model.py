@@ -9,11 +9,18 @@
     :members:
 """
 from functools import wraps
-from sqlalchemy.orm.properties import RelationshipProperty
-from sqlalchemy.orm.collections import InstrumentedList
-
-from sqla_helpers import loading
-from sqla_helpers.process import process_params
+from sqlalchemy import func, literal_column, tuple_
+from sqlalchemy.ext import baked
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import instance_state
+from sqlalchemy.orm.query import Query
+from sqlalchemy.orm.util import identity_key
+
+from sqla_helpers import aggregation, baking, bulk, cache, counting, \
+        encoding, lazyloads, loading, pagination, parallel, projection, \
+        scoping
+from sqla_helpers.instrumentation import instrumented, keys_shape, no_shape
+from sqla_helpers.process import process_params, process_path
 from sqla_helpers.utils import call_if_callable
 
 class SessionMakerExists(Exception):
@@ -41,6 +48,14 @@ def query_operation(decorated_method=None, operation_name=None):
     Then, the operation_name operation is called on the query. If operation_name is not set
     the operation_name is taken from the decorated method
 
+    If the class has a `result_cache` (see :mod:`sqla_helpers.cache`), results
+    are looked up in it first.
+
+    When `bake_queries` is True on the class (default), the query of a call
+    is built and compiled once per shape of call (see :mod:`sqla_helpers.baking`).
+
+    Calls emit instrumentation events (see :mod:`sqla_helpers.instrumentation`).
+
     .. code-block:: python
 
         @query_operation
@@ -66,12 +81,39 @@ def query_operation(decorated_method=None, operation_name=None):
     def _wrapper(decorated_method):
 
         @classmethod
+        @instrumented(decorated_method.__name__.lstrip('_'))
         @wraps(decorated_method)
         def _decorator(querying_class, *operators, **criterions):
 
-            query = querying_class.search(*operators, **criterions)
-            method = query.__getattribute__(operation_name)
-            return method()
+            # Si un cache de résultats est en place, on le consulte avant de
+            # construire la requête.
+            result_cache = querying_class.result_cache
+            key = None
+            if result_cache is not None:
+                key = cache.make_key(querying_class, operation_name,
+                                     operators, criterions)
+            if key is not None:
+                found, result = result_cache.get(key, querying_class.session)
+                if found:
+                    return _copy_result(result)
+
+            query = querying_class._operation_query(operation_name,
+                                                    operators, criterions)
+            if operation_name in _scalar_results:
+                # La requête sélectionne déjà le résultat
+                result = _scalar_results[operation_name](query.scalar())
+            else:
+                method = query.__getattribute__(operation_name)
+                result = method()
+
+            if key is not None:
+                if isinstance(query, baked.Result):
+                    query = query.bq.to_query(query.session)\
+                                 .params(query._params)
+                result_cache.set(key, _copy_result(result),
+                                 cache.query_tables(query),
+                                 querying_class.session)
+            return result
 
         return _decorator
 
@@ -81,6 +123,32 @@ def query_operation(decorated_method=None, operation_name=None):
         return _wrapper
 
 
+# Opérations dont la requête sélectionne directement le résultat, avec la
+# conversion de la valeur lue.
+_scalar_results = {
+    'count': int,
+    'exists': bool,
+}
+
+
+def _copy_result(result):
+    """
+    Returns a copy of lists, so cached lists aren't modified by callers.
+    """
+    if isinstance(result, list):
+        return list(result)
+    return result
+
+
+def _expunge_new(session, known):
+    """
+    Expunges from `session` every object whose identity key isn't in `known`.
+    """
+    for key, instance in session.identity_map.items():
+        if key not in known:
+            session.expunge(instance)
+
+
 class BaseModel(object):
     """
     Base Model Class.
@@ -88,7 +156,11 @@ class BaseModel(object):
     """
 
     sessionmaker = None
+    result_cache = None
+    bake_queries = True
+    lazy_load_threshold = None
     process_params = classmethod(process_params)
+    process_path = classmethod(process_path)
 
 
     @classmethod
@@ -114,38 +186,416 @@ class BaseModel(object):
         Call :attr:`BaseModel.sessionmaker` and returns a new session.
 
         Don't forget to call  :attr:`BaseModel.sessionmaker_maker` in application's initialization.
+
+        In a :meth:`BaseModel.using` block, the session of the block is
+        returned.
         """
+        session = scoping.current_session(cls)
+        if session is not None:
+            return session
         return call_if_callable(cls.sessionmaker)
 
 
     @classmethod
+    def using(cls, session=None, close=None):
+        """
+        Returns a context manager in which the class and its subclasses use
+        `session`, in the current thread. Without `session`, one is got from
+        :attr:`BaseModel.sessionmaker` for the whole block, and closed at the
+        end of the block when it was made by a `sessionmaker`, or when
+        `close` is True (see :func:`sqla_helpers.scoping.using`).
+
+        The context manager yields a :class:`sqla_helpers.scoping.Scope`
+        which counts connection checkouts and statements of the block.
+
+        .. code-block:: python
+
+            >>> with BaseModel.using() as scope:
+            ...     treatment = Treatment.get(id=1)
+            ...     treatment.status = Status.get(name=u'ok')
+            ...     Treatment.session.commit()
+            >>> scope.checkouts  # One connection for the whole block
+            1
+        """
+        return scoping.using(cls, session, close)
+
+
+    @classmethod
+    def detect_lazy_loads(cls, threshold=None):
+        """
+        Returns a context manager counting relations lazy loaded in the
+        block, in the current thread, a
+        :class:`sqla_helpers.lazyloads.LazyLoadDetector`.
+
+        With `threshold`, an exception is raised when leaving the block if
+        a relation was lazy loaded more than `threshold` times.
+
+        .. code-block:: python
+
+            >>> with BaseModel.detect_lazy_loads() as detector:
+            ...     dumped = [s.dump() for s in Status.filter()]
+            >>> detector.report()
+            [<LazyLoad Status.treatments: 12 loads, selectinload(Status.treatments)>]
+        """
+        return lazyloads.LazyLoadDetector(threshold)
+
+
+    @classmethod
+    @instrumented('search')
     def search(cls, *operator, **criterion):
         """
         Object search with criterions given in arguments.
         Returns a :class:`sqlachemy.orm.query.Query` object.
 
         Filters can be chained.
+
+        If `dump_depth` is given, relations which will be needed by
+        :meth:`BaseModel.dump` with this depth are eagerly loaded by the query.
+
+        .. code-block:: python
+
+            >>> [t.dump() for t in Treatment.search(dump_depth=2)]
         """
+        dump_depth = criterion.pop('dump_depth', None)
         query = cls.session.query(cls)
+        if dump_depth is not None:
+            query = query.options(*loading.eager_options(cls, dump_depth))
+        return cls._filter_query(query, *operator, **criterion)
+
+
+    @classmethod
+    def _filter_query(cls, query, *operator, **criterion):
+        """
+        Returns `query` joined and filtered with criterions, as
+        :meth:`BaseModel.search` does.
+        """
+        joined_class, clauses = cls._criteria(operator, criterion)
+        query = query.join(*joined_class)
+        return query.filter(*clauses)
+
+
+    @classmethod
+    def _criteria(cls, operators, criterions):
+        """
+        Returns the classes to join and the clauses of criterions, as a
+        (classes, clauses) couple.
+        """
         # On maintient une liste des classes déjà jointes
         joined_class = []
         clauses = []
 
         # On itère sur tous les objets operator qu'on a reçu et on process les
         # objets
-        for operator in list(operator):
+        for operator in list(operators):
             clauses.append(operator(cls, joined_class))
 
         # On process les critéres qu'on nous passe directement
-        clauses.extend(cls.process_params(joined_class, **criterion))
-        query = query.join(*joined_class)
-        return query.filter(*clauses)
+        clauses.extend(cls.process_params(joined_class, **criterions))
+        return joined_class, clauses
+
+
+    @classmethod
+    def _count_query(cls, session, *operator, **criterion):
+        """
+        Returns the query of the number of objects matching criterions: a
+        `count(*)` over the joins and criterions of :meth:`BaseModel.search`,
+        see :mod:`sqla_helpers.counting`.
+        """
+        joined_class, clauses = cls._criteria(operator, criterion)
+        expression = counting.expression(cls, joined_class)
+        if expression is None:
+            keys = session.query(*cls.__mapper__.primary_key)\
+                          .join(*joined_class).filter(*clauses).distinct()
+            return session.query(func.count()).select_from(keys.subquery())
+        query = session.query(expression).select_from(cls)
+        return query.join(*joined_class).filter(*clauses)
+
+
+    @classmethod
+    def _exists_query(cls, session, *operator, **criterion):
+        """
+        Returns the query telling if an object matches criterions: a
+        `SELECT EXISTS (...)`, or a `LIMIT 1` query on databases which can't
+        select an `EXISTS` (see :mod:`sqla_helpers.counting`).
+        """
+        query = cls._filter_query(session.query(cls), *operator, **criterion)
+        dialect = session.get_bind(mapper=cls.__mapper__).dialect
+        if counting.selects_exists(dialect):
+            return session.query(query.exists())
+        return query.with_entities(literal_column('1')).limit(1)
+
 
+    @classmethod
+    def _scalar_query(cls, session, operation_name, *operators, **criterions):
+        """
+        Returns the query selecting the result of `operation_name`, one of
+        `count` or `exists`.
+        """
+        if operation_name == 'count':
+            return cls._count_query(session, *operators, **criterions)
+        return cls._exists_query(session, *operators, **criterions)
+
+
+    @classmethod
+    def _operation_query(cls, operation_name, operators, criterions):
+        """
+        Returns the query on which a query operation is called: a baked query
+        result if the call can be baked (see :mod:`sqla_helpers.baking`), the
+        result of :meth:`BaseModel.search` otherwise.
+
+        The query of `count` and `exists` selects their result.
+        """
+        scalar = operation_name in _scalar_results
+        if cls.bake_queries and (scalar or
+                                 hasattr(baked.Result, operation_name)):
+            shaped = baking.shape(cls, operators, criterions)
+            if shaped is not None:
+                session = cls.session
+                if isinstance(session, Session):
+                    key, values = shaped
+                    dialect = None
+                    if scalar:
+                        # La requête d'`exists` dépend de la base
+                        dialect = session.get_bind(mapper=cls.__mapper__)\
+                                         .dialect.name
+                    baked_query = baking.baked_query(
+                        cls, key, operators, operation_name if scalar else None,
+                        dialect)
+                    return baked_query(session).params(
+                        **baking.parameters(values))
+
+        if scalar:
+            return cls._scalar_query(cls.session, operation_name, *operators,
+                                     **criterions)
+        return cls.search(*operators, **criterions)
+
+
+    @classmethod
+    def iter_dump(cls, *operators, **criterions):
+        """
+        Generator of dictionaries, as :meth:`BaseModel.dump` returns, for
+        objects matching criterions.
+
+        Rows are streamed from database `chunk_size` at once (`yield_per`),
+        relations are eagerly loaded as in :meth:`BaseModel.dump_many` and
+        dumped objects are expunged from session after each chunk. Thus,
+        memory use doesn't depend on the number of exported rows.
+
+        `depth`, `excludes`, `includes` and `chunk_size` are given as keywords
+        arguments, others are criterions. Only exported columns are read.
+
+        .. code-block:: python
+
+            >>> for dumped in Treatment.iter_dump(status__name=u'ok', depth=1):
+            ...     print json.dumps(dumped)
+            {"status_id": 1, "id": 1, "name": "Great Treatment"}
+
+        .. warning::
+
+            Objects loaded by the export are expunged from session, don't keep
+            references on them.
+        """
+        depth = criterions.pop('depth', 2)
+        excludes = criterions.pop('excludes', [])
+        includes = criterions.pop('includes', None)
+        chunk_size = criterions.pop('chunk_size', 1000)
+
+        query = cls.search(*operators, **criterions)
+        for dumped in cls._iter_dump_query(query, depth, excludes, chunk_size,
+                                           includes):
+            yield dumped
+
+
+    @classmethod
+    def _iter_dump_query(cls, query, depth, excludes, chunk_size,
+                         includes=None):
+        """
+        Implementation of :meth:`BaseModel.iter_dump` on a query.
+        """
+        session = query.session
+        query = query.options(*loading.dump_options(cls, depth, excludes,
+                                                    includes))
+        # Les objets déjà présents dans la session ne sont pas ceux de
+        # l'export, on les y laisse.
+        known = set(session.identity_map.keys())
+
+        for position, instance in enumerate(query.yield_per(chunk_size), 1):
+            yield instance.dump(excludes=excludes, depth=depth,
+                                includes=includes)
+            if position % chunk_size == 0:
+                _expunge_new(session, known)
 
-    @query_operation(operation_name='one')
+        _expunge_new(session, known)
+
+
+    @classmethod
+    def parallel_dump(cls, *operators, **criterions):
+        """
+        Generator of dictionaries, as :meth:`BaseModel.iter_dump`, ordered by
+        primary key. Objects are dumped by a pool of `workers` processes.
+
+        Objects matching criterions are split in ranges of primary key. Each
+        range is dumped by a worker process with its own engine, built from
+        the URL of the engine of the class. Ranges are yielded in order, as
+        soon as they are dumped.
+
+        `workers` (default: number of CPUs), `depth`, `excludes`, `includes`
+        and `chunk_size` are given as keywords arguments, others are
+        criterions.
+        Operators must be :class:`sqla_helpers.logical.Q` objects, which are
+        sent to workers serialized. See :mod:`sqla_helpers.parallel`.
+
+        .. code-block:: python
+
+            >>> with open('treatments.ndjson', 'w') as stream:
+            ...     for dumped in Treatment.parallel_dump(status__name=u'ok', workers=4):
+            ...         stream.write(json.dumps(dumped) + '\\n')
+
+        .. warning::
+
+            Workers read the database with their own connections: they only
+            see committed data, and an in-memory SQLite database can't be
+            used.
+        """
+        workers = criterions.pop('workers', None)
+        depth = criterions.pop('depth', 2)
+        excludes = criterions.pop('excludes', [])
+        includes = criterions.pop('includes', None)
+        chunk_size = criterions.pop('chunk_size', 1000)
+        return parallel.dump(cls, operators, criterions, workers, depth,
+                             excludes, chunk_size, includes)
+
+
+    @classmethod
+    def paginate(cls, *operators, **criterions):
+        """
+        Returns a :class:`sqla_helpers.pagination.Page` of objects matching
+        criterions.
+
+        Objects are ordered by `order_by`, an attribute name or a list of them
+        (prefixed by `-` for a descending order), completed by the primary
+        key. Without `order_by`, objects are ordered by primary key.
+
+        The following page is read by giving the `next` cursor of a page as
+        `after` parameter. Pages are read with a seek on ordering columns,
+        so a deep page is as fast as the first one.
+
+        `after`, `per_page` (default 20) and `order_by` are given as keywords
+        arguments, others are criterions.
+
+        .. code-block:: python
+
+            >>> page = Treatment.paginate(status__name=u'ok', per_page=2)
+            >>> [t.id for t in page]
+            [1, 2]
+            >>> page = Treatment.paginate(status__name=u'ok', per_page=2,
+            ...                           after=page.next)
+            >>> [t.id for t in page]
+            [3, 4]
+
+        :exc:`sqla_helpers.pagination.InvalidCursor` is raised if `after`
+        isn't a cursor given by a page with the same ordering.
+        """
+        after = criterions.pop('after', None)
+        per_page = criterions.pop('per_page', 20)
+        order = pagination.ordering(cls, criterions.pop('order_by', None))
+
+        session = cls.session
+        joined_class, clauses = cls._criteria(operators, criterions)
+        query = session.query(cls)
+        if counting.joins_to_many(cls, joined_class):
+            # Une jointure vers une liste répète les objets, que la `Query`
+            # dédoublonne après le LIMIT : la page serait incomplète. Les
+            # objets sont choisis par clef primaire, sans jointure.
+            primary_key = cls.__mapper__.primary_key
+            matching = session.query(*primary_key).select_from(cls)\
+                              .join(*joined_class).filter(*clauses)
+            if len(primary_key) == 1:
+                query = query.filter(primary_key[0].in_(matching))
+            else:
+                query = query.filter(tuple_(*primary_key).in_(matching))
+        else:
+            query = query.join(*joined_class).filter(*clauses)
+
+        if after is not None:
+            values = pagination.decode_cursor(cls, after, order)
+            query = query.filter(pagination.seek_clause(cls, order, values))
+
+        query = query.order_by(*pagination.order_clauses(cls, order))
+        # Une ligne de plus indique s'il y a une page suivante
+        items = query.limit(per_page + 1).all()
+        next = None
+        if len(items) > per_page:
+            items = items[:per_page]
+            next = pagination.encode_cursor(items[-1], order)
+
+        return pagination.Page(items, next, per_page)
+
+
+    @classmethod
+    @instrumented('get')
     def get(cls, *operators, **criterions):
         """
         Returns an object with criterions given in parameters.
+
+        When criterions are exactly the primary key attributes, the object is
+        looked up in the session's identity map before querying the database.
+
+        .. code-block:: python
+
+            >>> t = Treatment.get(id=1)  # Query
+            >>> Treatment.get(id=1) is t  # From identity map, without query
+            True
+        """
+        identity = None
+        if not operators:
+            identity = loading.identity(cls, criterions)
+
+        if identity is not None:
+            instance = cls.session.identity_map.get(
+                identity_key(cls, identity))
+            if instance is not None:
+                state = instance_state(instance)
+                # Un objet expiré doit être relu, il a pu être supprimé
+                if state.mapper.isa(cls.__mapper__) and not state.expired:
+                    return instance
+
+        # Requête précompilée de `one`, plutôt qu'une `Query.get` construite
+        # à chaque appel
+        return cls.one(*operators, **criterions)
+
+
+    @query_operation
+    def one(cls, *operators, **criterions):
+        """
+        Returns the only object matching criterions, always with a query.
+        """
+
+    @query_operation
+    def first(cls, *operators, **criterions):
+        """
+        Returns the first object matching criterions, `None` if there is no
+        such object. Unlike :meth:`BaseModel.one`, several matching objects
+        don't raise, and only one row is read (`LIMIT 1`).
+
+        .. code-block:: python
+
+            >>> Treatment.first(status__name=u'ok')
+            <Treatment object at 0x2c19d90>
+            >>> Treatment.first(status__name=u'unknown') is None
+            True
+        """
+
+    @query_operation
+    def exists(cls, *operators, **criterions):
+        """
+        Returns `True` if an object matches criterions. The database stops at
+        the first matching row, where :meth:`BaseModel.count` counts them all.
+
+        .. code-block:: python
+
+            >>> Treatment.exists(status__name=u'ok')
+            True
         """
 
     @query_operation
@@ -154,25 +604,126 @@ class BaseModel(object):
         Returns all objects from the same class contained in database.
         """
 
-    @query_operation(operation_name='all')
+    @classmethod
+    @instrumented('filter')
+    @lazyloads.watched
     def filter(cls, *operators, **criterions):
         """
         Returns a list of objects from a class matching criterions given in parameters.
+
+        With `fields`, a list of attributes in :mod:`sqla_helpers` syntax,
+        rows of those attributes are returned instead of objects, as
+        :meth:`BaseModel.values` does.
+
+        .. code-block:: python
+
+            >>> Treatment.filter(status__name=u'ok', fields=['id', 'status__name'])
+            [Record(id=1, status__name=u'ok'), Record(id=2, status__name=u'ok')]
         """
+        fields = criterions.pop('fields', None)
+        if fields is not None:
+            return projection.values(cls, operators, criterions, fields)
+        return cls._filter(*operators, **criterions)
 
-    @query_operation
+    @query_operation(operation_name='all')
+    def _filter(cls, *operators, **criterions):
+        """
+        Returns a list of objects matching criterions.
+        """
+
+    @classmethod
+    def values(cls, *operators, **criterions):
+        """
+        Returns a list of rows of `fields` for objects matching criterions.
+        Only the columns of those fields are selected, and no object is
+        built: rows are tuples with an attribute per field, or plain tuples
+        with `named=False`.
+
+        `fields` is a list of attributes in :mod:`sqla_helpers` syntax
+        (default: the column attributes of the class). Relations only
+        crossed by fields are outer joined. `fields` and `named` are given as
+        keywords arguments, others are criterions. See
+        :mod:`sqla_helpers.projection`.
+
+        .. code-block:: python
+
+            >>> Treatment.values(fields=['id', 'status__name'], id__lt=3)
+            [Record(id=1, status__name=u'ok'), Record(id=2, status__name=u'ok')]
+            >>> Treatment.values(fields=['id', 'name'], id__lt=3, named=False)
+            [(1, u'test 0'), (2, u'test 1')]
+        """
+        fields = criterions.pop('fields', None)
+        named = criterions.pop('named', True)
+        return projection.values(cls, operators, criterions, fields, named)
+
+    @classmethod
+    @instrumented('count')
     def count(cls, *operators, **criterions):
         """
         Returns the number of objects matched by criterions
 
+        The count is a single `SELECT count(*)` over the joins of criterions,
+        a `count(DISTINCT primary key)` when a criterion goes through a
+        relation to a list of objects.
+
+        With `estimate=True`, the number is read from the statistics of the
+        database when it has some, see :mod:`sqla_helpers.counting`. An
+        estimate may be far from the exact count, it's meant for big tables
+        whose exact count is too slow (pagination totals ...).
+
         .. code-block:: python
 
            >>> Treatment.count(status=u'OK')
            8
+           >>> Treatment.count(estimate=True)
+           1000120
+        """
+        if criterions.pop('estimate', False):
+            estimated = counting.estimate(cls, operators, criterions)
+            if estimated is not None:
+                return estimated
+        return cls._count(*operators, **criterions)
+
+    @query_operation(operation_name='count')
+    def _count(cls, *operators, **criterions):
+        """
+        Returns the exact number of objects matched by criterions.
         """
 
 
     @classmethod
+    def aggregate(cls, *operators, **criterions):
+        """
+        Returns a list of rows of aggregates computed by the database on
+        objects matching criterions, grouped by attributes `group_by`.
+
+        Aggregates are given as keywords arguments `count`, `sum`, `avg`,
+        `min` and `max`, with an attribute or a list of attributes. Attributes
+        are given in :mod:`sqla_helpers` syntax, crossed relations are joined.
+        Other keywords arguments are criterions.
+
+        A row has an attribute for each grouping attribute, and for each
+        aggregate, named after the attribute and the function. Rows are
+        ordered by grouping attributes. See :mod:`sqla_helpers.aggregation`.
+
+        .. code-block:: python
+
+            >>> for row in Treatment.aggregate(group_by=['status__name'], count='id'):
+            ...     print row.status__name, row.id__count
+            ko 8
+            ok 10
+        """
+        group_by = criterions.pop('group_by', ())
+        aggregates = dict((name, criterions.pop(name))
+                          for name in aggregation.FUNCTIONS
+                          if name in criterions)
+        return aggregation.aggregate(cls, operators, criterions, group_by,
+                                     aggregates)
+
+
+    @classmethod
+    @instrumented('load', keys_shape)
+    @lazyloads.watched
     def load(cls, dictionary, hard=False):
         """
         Returns an object from class with attributes got in dictionary's parameters.
@@ -195,23 +746,115 @@ class BaseModel(object):
         If `hard` parameter is True, an exception is raised if a value isn't found
         in parameter's dictionary.
         """
+        return cls._load(dictionary, hard, None)
+
+
+    @classmethod
+    @instrumented('load_many', no_shape)
+    @lazyloads.watched
+    def load_many(cls, dictionaries, hard=False, chunk_size=500):
+        """
+        Returns a list of objects loaded from `dictionaries`, as
+        :meth:`BaseModel.load` called on each dictionary would do.
+
+        Primary keys of all the dictionaries, nested relations included, are
+        collected first. Existing objects are then fetched with a few `IN`
+        queries per class, `chunk_size` keys at once, instead of a query
+        per dictionary.
+
+        .. code-block:: python
 
+            >>> treatments = Treatment.load_many([
+            ...     {'id': 1, 'name': u'Awesome Treatment'},
+            ...     {'id': 2, 'status': {'id': 1}},
+            ...     {'name': u'New Treatment'},
+            ... ])
+            >>> [t.id for t in treatments]
+            [1, 2, None]
+        """
+        dictionaries = list(dictionaries)
+        keys = loading.collect_primary_keys(cls, dictionaries, {})
+
+        prefetched = {}
+        for klass, pks in keys.iteritems():
+            prefetched[klass] = klass._fetch_by_primary_keys(pks, chunk_size)
+
+        return [cls._load(dictionary, hard, prefetched)
+                for dictionary in dictionaries]
+
+
+    @classmethod
+    def bulk_upsert(cls, dictionaries, chunk_size=1000, on_conflict='update'):
+        """
+        Writes `dictionaries` in the table of the class, without building
+        objects, and returns the number of `inserted`, `updated` and `ignored`
+        rows.
+
+        Rows are sent `chunk_size` at once, with `executemany` statements.
+        Rows whose primary key exists are updated, or ignored if `on_conflict`
+        is `'ignore'`. Keys are names of column properties, relations are
+        ignored. See :mod:`sqla_helpers.bulk`.
+
+        .. code-block:: python
+
+            >>> Treatment.bulk_upsert([
+            ...     {'id': 1, 'name': u'Awesome Treatment'},
+            ...     {'name': u'New Treatment', 'status_id': 1},
+            ... ])
+            {'inserted': 1, 'updated': 1, 'ignored': 0}
+
+        Objects already in the session aren't refreshed, and changes aren't
+        committed.
+        """
+        return bulk.upsert(cls, cls.session, dictionaries, chunk_size,
+                           on_conflict)
+
+
+    @classmethod
+    def _fetch_by_primary_keys(cls, pks, chunk_size, options=()):
+        """
+        Returns a dictionary of primary key tuple -> object for objects found
+        in database. Loader `options` are applied to the queries.
+        """
+        mapper = cls.__mapper__
+        columns = mapper.primary_key
+        pks = list(pks)
+        query = cls.session.query(cls).options(*options)
+        found = {}
+        for start in xrange(0, len(pks), chunk_size):
+            clause = loading.primary_key_clause(
+                columns, pks[start:start + chunk_size])
+            for instance in query.filter(clause):
+                found[tuple(mapper.primary_key_from_instance(instance))] = instance
+
+        return found
+
+
+    @classmethod
+    def _load(cls, dictionary, hard, prefetched):
+        """
+        Implementation of :meth:`BaseModel.load`. `prefetched` is `None` or a
+        dictionary of class -> objects built by :meth:`BaseModel.load_many`.
+        """
         # On détermine si on doit charger l'instance depuis la base ou non.
         # La décision est prise si tous les attributs qui constitue la clef
         # primaire de l'objet sont trouvés dans le dico. Si oui, on charge
         # depuis la base, sinon on crée une nouvelle instance
-        from_db = False
-        loading_key = {}
-        for attr in cls.__mapper__.primary_key:
-            if not attr.key in dictionary:
-                from_db = False
-                break
-
-            loading_key[attr.key] = dictionary[attr.key]
-            from_db = True
-
-        if from_db:
-            instance = cls.get(**loading_key)
+        loading_key = loading.loading_key(cls, dictionary)
+
+        if loading_key is not None:
+            instance = None
+            if prefetched is not None:
+                pk = tuple(loading_key[name]
+                           for name in loading.model_plan(cls).primary_key)
+                try:
+                    instance = prefetched.get(cls, {}).get(pk)
+                except TypeError:
+                    pass
+            # L'objet n'a pas été pré-chargé : on laisse `get` faire la
+            # requête et lever l'exception si l'objet n'existe pas.
+            if instance is None:
+                instance = cls.get(**loading_key)
         else:
             instance = loading.instancied(cls)
 
@@ -220,42 +863,42 @@ class BaseModel(object):
         # Et on cherche dans le dictionnaire si elles apparaissent.
         # En mode `hard`, si un clef n'est pas spécifiée on léve une
         # exception, sinon on ignore l'erreur.
-        for attr_key, attr_type in cls.__mapper__._props.iteritems():
+        for prop in loading.model_plan(cls).properties:
             try:
-                attr_value = dictionary[attr_key]
+                attr_value = dictionary[prop.key]
             except KeyError:
                 # En mode soft, on ne relache pas l'erreur
                 # En mode hard, oui.
                 if hard:
                     raise
+                continue
+
+            # Si l'attribut sur lequel nous sommes, est une relation,
+            # On délégue son chargement à la classe à laquelle l'attrbut
+            # appartient.
+            # Sinon on se contente de mettre la valeur trouvée dans le
+            # dictionnaire, dans l'attribut de la nouvelle instance.
+            if prop.kind == loading.COLUMN:
+                setattr(instance, prop.key, attr_value)
+            elif prop.kind == loading.SCALAR:
+                setattr(instance, prop.key,
+                        prop.target._load(attr_value, False, prefetched))
             else:
-                instance_attr = getattr(instance, attr_key)
-                # Si l'attribut sur lequel nous sommes, est une relation,
-                # On délégue son chargement à la classe à laquelle l'attrbut
-                # appartient.
-                # Sinon on se contente de mettre la valeur trouvée dans le
-                # dictionnaire, dans l'attribut de la nouvelle instance.
-                if isinstance(attr_type, RelationshipProperty):
-                    attr_class = attr_type.mapper.class_
-                    if isinstance(instance_attr, InstrumentedList):
-                        # Si on est sur une liste, on s'attend à avoir une
-                        # liste de dico
-                        for obj_to_load in attr_value:
-                            instance_attr.append(attr_class.load(obj_to_load))
-                    else:
-                        instance_attr = attr_class.load(attr_value)
-
-                else:
-                    instance_attr = attr_value
-
-                setattr(instance, attr_key, instance_attr)
+                # Si on est sur une liste, on s'attend à avoir une
+                # liste de dico
+                instance_attr = getattr(instance, prop.key)
+                for obj_to_load in attr_value:
+                    instance_attr.append(
+                        prop.target._load(obj_to_load, False, prefetched))
 
         return instance
 
 
 
 
-    def dump(self, excludes=[], depth=2):
+    @instrumented('dump', no_shape)
+    @lazyloads.watched
+    def dump(self, excludes=[], depth=2, includes=None, deferred=False):
         """
         Returns object as dictionary with dependencies.
 
@@ -263,7 +906,14 @@ class BaseModel(object):
 
         IE : With depth set as 1, objects in relations aren't search.
 
-        `excludes` use to exclude unwanted attributes.
+        `excludes` use to exclude unwanted attributes. If `includes` is
+        given, only those attributes are exported.
+
+        Deferred columns which aren't loaded yet aren't exported, since
+        reading them would query the database for each object, unless
+        `deferred` is True or they are in `includes`. Queries dumped by
+        :meth:`BaseModel.dump_many` or :meth:`BaseModel.iter_dump` only load
+        exported columns (see :func:`sqla_helpers.loading.dump_options`).
 
         .. code-block:: python
 
@@ -297,30 +947,130 @@ class BaseModel(object):
 
         """
         res = {}
+        plan = loading.model_plan(self.__class__)
+        excludes = frozenset(excludes)
+        if includes is not None:
+            includes = frozenset(includes)
+        loaded = self.__dict__
+        deferred_keys = None
 
         # On itére sur les propriétés de classes pour récupérer seulement
         # les attributs déclarer en base pour ne pas exporter les autres attributs
         # Mais on récupère bien la valeur dans l'instance d'objet.
-        for attr, attr_type in self.__mapper__._props.iteritems():
-
+        for prop in plan.columns:
             # Si le champ est à exclure on passe au champ suivant
-            if attr in excludes:
+            if prop.key in excludes or \
+               (includes is not None and prop.key not in includes):
                 continue
-
-            # Récupération de la valeur effective de l'attribut
-            instance_attr = getattr(self, attr)
-            if isinstance(attr_type, RelationshipProperty):
-
-                # Si on est à la profondeur on ne fait rien
-                if depth - 1 <= 0:
+            if prop.key not in loaded and not deferred and includes is None:
+                # Une colonne différée non chargée coûterait une requête
+                if deferred_keys is None:
+                    deferred_keys = loading.deferred_keys(self)
+                if prop.key in deferred_keys:
                     continue
+            res[prop.key] = getattr(self, prop.key)
 
-                if isinstance(instance_attr, InstrumentedList):
-                    res[attr] = [ a.dump(depth=depth-1) for a in instance_attr]
-                else:
-                    res[attr] = instance_attr.dump(depth=depth-1)
+        # Si on est à la profondeur on ne fait rien, et surtout on ne
+        # charge pas les relations.
+        if depth - 1 <= 0:
+            return res
 
-            else:
-                res[attr] = instance_attr
+        for prop in plan.scalars:
+            if prop.key not in excludes and \
+               (includes is None or prop.key in includes):
+                res[prop.key] = getattr(self, prop.key)\
+                        .dump(depth=depth-1, deferred=deferred)
+
+        for prop in plan.collections:
+            if prop.key not in excludes and \
+               (includes is None or prop.key in includes):
+                res[prop.key] = [a.dump(depth=depth-1, deferred=deferred)
+                                 for a in getattr(self, prop.key)]
 
         return res
+
+
+    @classmethod
+    @instrumented('dump_many', no_shape)
+    @lazyloads.watched
+    def dump_many(cls, query_or_instances, depth=2, excludes=[],
+                  includes=None):
+        """
+        Returns a list of dictionaries, as :meth:`BaseModel.dump` called on each
+        object would do.
+
+        `query_or_instances` is a query on the class, or a list of objects.
+        Relations reached by `dump` are loaded beforehand, in a query per
+        relation level, instead of a query per object and per relation. A
+        query only loads exported columns.
+
+        .. code-block:: python
+
+            >>> Treatment.dump_many(Treatment.search(status__name=u'ok'))
+            [{'id': 1, 'name': u'Great Treatment', 'status_id': 1,
+              'status': {'id': 1, 'name': u'Ok'}}, ...]
+        """
+        options = loading.eager_options(cls, depth, excludes,
+                                        includes=includes)
+        if isinstance(query_or_instances, Query):
+            options = loading.column_options(cls, excludes, includes) + options
+            instances = query_or_instances.options(*options).all()
+        else:
+            instances = list(query_or_instances)
+            if options:
+                # Les objets sont rechargés avec les options : le chargement
+                # complète les relations non chargées des objets de
+                # l'identity map.
+                cls._fetch_by_primary_keys(
+                    [tuple(cls.__mapper__.primary_key_from_instance(i))
+                     for i in instances], 500, options)
+
+        return [instance.dump(excludes=excludes, depth=depth, includes=includes)
+                for instance in instances]
+
+
+    def dump_json(self, stream, depth=2, excludes=[], includes=None,
+                  deferred=False):
+        """
+        Writes object as JSON in `stream`, without building the dictionary
+        returned by :meth:`BaseModel.dump`.
+
+        Written JSON is the same as `json.dumps(self.dump(...))` with the same
+        arguments.
+        Dates, decimals and binary values are supported, see
+        :mod:`sqla_helpers.encoding`.
+
+        .. code-block:: python
+
+            >>> t = Treatment.get(id=1)
+            >>> t.dump_json(sys.stdout, depth=1)
+            {"status_id": 1, "id": 1, "name": "Great Treatment"}
+        """
+        encoding.write_json(self, stream, depth, excludes, includes, deferred)
+
+
+    @classmethod
+    def dump_json_many(cls, query_or_instances, stream, depth=2, excludes=[],
+                       ndjson=False, chunk_size=1000, includes=None):
+        """
+        Writes objects as a JSON list in `stream`, or one object per line if
+        `ndjson` is True. Returns the number of written objects.
+
+        As :meth:`BaseModel.dump_many`, relations are eagerly loaded and
+        only exported columns are read.
+        Queries are streamed with `yield_per` and `chunk_size`.
+
+        .. code-block:: python
+
+            >>> with open('treatments.json', 'w') as stream:
+            ...     Treatment.dump_json_many(Treatment.search(), stream, ndjson=True)
+            18
+        """
+        if isinstance(query_or_instances, Query):
+            options = loading.dump_options(cls, depth, excludes, includes)
+            instances = query_or_instances.options(*options)\
+                                          .yield_per(chunk_size)
+        else:
+            instances = query_or_instances
+        return encoding.write_json_many(instances, stream, depth, excludes,
+                                        ndjson, includes)
@@ -0,0 +1,241 @@
+#-*- coding: utf-8 -*-
+"""
+Bulk writes
+===========
+
+:meth:`sqla_helpers.base_model.BaseModel.bulk_upsert` writes dictionaries
+straight in the table of a model, with `executemany` statements, without
+building objects nor going through the session's unit of work.
+
+Rows are present with a native upsert on PostgreSQL (`ON CONFLICT`) and
+SQLite 3.24 or later. On other databases, rows whose primary key exists are
+sent in an `UPDATE`, the others in an `INSERT`.
+
+.. autofunction:: upsert
+"""
+from collections import OrderedDict
+
+from sqlalchemy import and_, bindparam, select, text
+from sqlalchemy.orm.properties import ColumnProperty
+
+from sqla_helpers import cache, loading
+
+UPDATE = 'update'
+IGNORE = 'ignore'
+
+
+def column_map(cls):
+    """
+    Returns a dictionary of property name -> column for the column properties
+    of `cls`.
+    """
+    mapper = cls.__mapper__
+    if len(mapper.tables) != 1:
+        raise ValueError('Bulk writes need a model mapped to a single table')
+
+    # Les propriétés calculées (`column_property` d'une expression) ne
+    # sont pas des colonnes de la table.
+    return dict((prop.key, prop.columns[0]) for prop in mapper.iterate_properties
+                if isinstance(prop, ColumnProperty)
+                and prop.columns[0].table is mapper.local_table)
+
+
+def _rows(cls, columns, dictionaries):
+    """
+    Returns dictionaries keyed by column keys. Relations are ignored, an
+    unknown key raises an `AttributeError`.
+    """
+    properties = loading.model_plan(cls).keys
+    res = []
+    for dictionary in dictionaries:
+        row = {}
+        for key, value in dictionary.iteritems():
+            try:
+                row[columns[key].key] = value
+            except KeyError:
+                if key not in properties:
+                    raise AttributeError(
+                        '{0} has no column {1}'.format(cls.__name__, key))
+        res.append(row)
+    return res
+
+
+def _native_statement(table, columns, primary_key, on_conflict, dialect):
+    """
+    Returns the upsert statement of `dialect` for rows with `columns`, `None`
+    if the dialect has no native upsert.
+    """
+    updated = [column for column in columns if not column.primary_key]
+
+    if dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+        statement = insert(table)
+        if on_conflict == IGNORE or not updated:
+            return statement.on_conflict_do_nothing(index_elements=primary_key)
+        return statement.on_conflict_do_update(
+            index_elements=primary_key,
+            set_=dict((column.name, statement.excluded[column.name])
+                      for column in updated))
+
+    sqlite_version = getattr(dialect.dbapi, 'sqlite_version_info', ())
+    if dialect.name == 'sqlite' and sqlite_version >= (3, 24):
+        # SQLAlchemy ne connait pas l'upsert SQLite : la requête est écrite à
+        # la main, les paramètres gardent le type des colonnes.
+        quote = dialect.identifier_preparer.quote
+        if on_conflict == IGNORE or not updated:
+            action = 'NOTHING'
+        else:
+            action = 'UPDATE SET ' + ', '.join(
+                '{0} = excluded.{0}'.format(quote(column.name))
+                for column in updated)
+        sql = 'INSERT INTO {0} ({1}) VALUES ({2}) ON CONFLICT ({3}) DO {4}'\
+                .format(dialect.identifier_preparer.format_table(table),
+                        ', '.join(quote(column.name) for column in columns),
+                        ', '.join(':' + column.key for column in columns),
+                        ', '.join(quote(column.name) for column in primary_key),
+                        action)
+        return text(sql).bindparams(*[bindparam(column.key, type_=column.type)
+                                      for column in columns])
+
+    return None
+
+
+def _write(session, table, columns, primary_key, rows, existing, on_conflict,
+           dialect):
+    """
+    Writes `rows`, which all have values for `columns`. `existing` tells for
+    each row if its primary key is found in database.
+    """
+    statement = _native_statement(table, columns, primary_key, on_conflict,
+                                  dialect)
+    if statement is not None:
+        session.execute(statement, rows)
+        return
+
+    inserted = [row for row, found in zip(rows, existing) if not found]
+    if inserted:
+        session.execute(table.insert(), inserted)
+
+    updated = [column for column in columns if not column.primary_key]
+    if on_conflict == IGNORE or not updated:
+        return
+    rows = [row for row, found in zip(rows, existing) if found]
+    if rows:
+        # Les noms des paramètres ne peuvent pas être ceux des colonnes
+        statement = table.update()\
+                .where(and_(*[column == bindparam('pk_' + column.key)
+                              for column in primary_key]))\
+                .values(dict((column.key, bindparam('v_' + column.key))
+                             for column in updated))
+        session.execute(statement, [
+            dict([('pk_' + column.key, row[column.key])
+                  for column in primary_key] +
+                 [('v_' + column.key, row[column.key]) for column in updated])
+            for row in rows])
+
+
+def _merge_duplicates(rows, pks, on_conflict):
+    """
+    Returns the rows and primary keys of a chunk with one row per primary
+    key, and the number of merged rows. Following rows of a primary key
+    update the first one, as if they were written one after the other: the
+    last value of each column wins. With `on_conflict` `'ignore'`, following
+    rows are ignored.
+    """
+    indexes = {}
+    res_rows = []
+    res_pks = []
+    duplicates = 0
+    for row, pk in zip(rows, pks):
+        index = None
+        if None not in pk:
+            index = indexes.get(pk)
+        if index is None:
+            if None not in pk:
+                indexes[pk] = len(res_rows)
+            res_rows.append(row)
+            res_pks.append(pk)
+            continue
+
+        duplicates += 1
+        if on_conflict == UPDATE:
+            merged = dict(res_rows[index])
+            merged.update(row)
+            res_rows[index] = merged
+    return res_rows, res_pks, duplicates
+
+
+def upsert(cls, session, dictionaries, chunk_size=1000, on_conflict=UPDATE):
+    """
+    Writes `dictionaries` in the table of `cls` with `session`, `chunk_size`
+    rows at once. Returns a dictionary with the number of `inserted`,
+    `updated` and `ignored` rows.
+
+    Keys of dictionaries are names of column properties. Relations are
+    ignored. Rows whose primary key exists in database are updated, or
+    ignored if `on_conflict` is `'ignore'`.
+    """
+    if on_conflict not in (UPDATE, IGNORE):
+        raise ValueError('on_conflict must be {0!r} or {1!r}'.format(UPDATE,
+                                                                   IGNORE))
+
+    columns = column_map(cls)
+    mapper = cls.__mapper__
+    table = mapper.local_table
+    primary_key = list(mapper.primary_key)
+    dialect = session.get_bind(mapper=mapper).dialect
+
+    counts = {'inserted': 0, 'updated': 0, 'ignored': 0}
+    # Clefs primaires présentes en base ou écrites par cet appel
+    present = set()
+    dictionaries = iter(dictionaries)
+    while True:
+        chunk = []
+        for dictionary in dictionaries:
+            chunk.append(dictionary)
+            if len(chunk) == chunk_size:
+                break
+        if not chunk:
+            break
+
+        rows = _rows(cls, columns, chunk)
+        pks = [tuple(row.get(column.key) for column in primary_key)
+               for row in rows]
+        # Les lignes sont écrites par groupes de colonnes : les doublons
+        # d'une clef ne seraient pas écrits dans l'ordre.
+        rows, pks, duplicates = _merge_duplicates(rows, pks, on_conflict)
+        counts['ignored' if on_conflict == IGNORE else 'updated'] += \
+                duplicates
+        known = [pk for pk in pks if None not in pk and pk not in present]
+        if known:
+            found = session.execute(
+                select(primary_key)
+                .where(loading.primary_key_clause(primary_key, known)))
+            present.update(tuple(pk) for pk in found)
+
+        # `executemany` a besoin des mêmes colonnes pour toutes les lignes
+        groups = OrderedDict()
+        for row, pk in zip(rows, pks):
+            exists = None not in pk and pk in present
+            if exists:
+                counts['ignored' if on_conflict == IGNORE else 'updated'] += 1
+            else:
+                counts['inserted'] += 1
+                if None not in pk:
+                    present.add(pk)
+            group = groups.setdefault(tuple(sorted(row)), ([], []))
+            group[0].append(row)
+            group[1].append(exists)
+
+        for keys, (group_rows, existing) in groups.iteritems():
+            group_columns = [table.c[key] for key in keys]
+            _write(session, table, group_columns, primary_key, group_rows,
+                   existing, on_conflict, dialect)
+
+        if len(chunk) < chunk_size:
+            break
+
+    # Les écritures ne passent pas par le flush : la session est marquée ici
+    # comme ayant écrit dans la table, jusqu'à la fin de sa transaction.
+    cache.mark_written(session, [table])
+    return counts
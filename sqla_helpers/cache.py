@@ -0,0 +1,290 @@
+#-*- coding: utf-8 -*-
+"""
+Query results cache
+===================
+
+Results of :func:`sqla_helpers.base_model.query_operation` methods (`get`,
+`filter`, `all`, `count` ...) can be kept in a :class:`ResultCache`.
+The cache is enabled by setting the `result_cache` attribute of a model, or
+of :class:`sqla_helpers.base_model.BaseModel` for every model.
+
+.. code-block:: python
+
+    >>> Status.result_cache = ResultCache(maxsize=512, ttl=30)
+    >>> Status.get(name=u'ok')  # Query
+    <Status object at 0x2c19d90>
+    >>> Status.get(name=u'ok')  # From cache
+    <Status object at 0x2c19d90>
+
+Entries are evicted when the cache is full (least recently used first) or
+when their time to live, in seconds, is over. They are also invalidated when
+a session flushes inserts, updates or deletes on one of the tables read by
+their query, and when a transaction which flushed changes on those tables
+is rolled back.
+
+Until its transaction ends, a session which flushed changes on a table
+neither reads nor writes entries having read that table: they would hide
+its own changes from it, or show them to other sessions.
+
+Objects returned from cache are the ones of the first call, so an entry
+with objects is only used with the session those objects belong to.
+
+.. autoclass:: ResultCache
+    :members:
+"""
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_mapper, object_session
+from sqlalchemy.sql.util import find_tables
+
+from sqla_helpers.logical import Q, walk
+from sqla_helpers.utils import freeze
+
+_caches = weakref.WeakSet()
+# Session -> tables modifiées par un flush dans la transaction en cours
+_flushed = weakref.WeakKeyDictionary()
+
+
+class Uncacheable(Exception):
+    """
+    Raised when a criterion can't be part of a cache key.
+    """
+
+
+def _freeze(value):
+    """
+    Returns an hashable equivalent of `value`.
+    """
+    try:
+        return freeze(value)
+    except TypeError:
+        raise Uncacheable()
+
+
+def _ast_key(node):
+    """
+    Returns the key of an AST node of a :class:`sqla_helpers.logical.Q`.
+    """
+    # Le parcours en profondeur et le nombre d'enfants de chaque noeud
+    # suffisent à décrire l'arbre
+    return tuple((current.__class__.__name__, _freeze(current.operand),
+                  len(current.children))
+                 for current in walk(node))
+
+
+def make_key(cls, operation_name, operators, criterions):
+    """
+    Returns the cache key of an operation, or `None` if the operation can't
+    be cached (operators which aren't :class:`sqla_helpers.logical.Q`,
+    unhashable values ...).
+    """
+    try:
+        operators_key = []
+        for operator in operators:
+            if not isinstance(operator, Q):
+                raise Uncacheable()
+            # Des opérateurs équivalents une fois optimisés partagent la clef
+            operators_key.append(_ast_key(operator.optimized(cls)))
+        return (cls, operation_name, tuple(operators_key),
+                _freeze(criterions))
+    except Uncacheable:
+        return None
+
+
+def query_tables(query):
+    """
+    Returns the set of tables read by `query`.
+    """
+    return frozenset(find_tables(query.statement, check_columns=True,
+                                 include_joins=True))
+
+
+class ResultCache(object):
+    """
+    LRU cache of operations results, with a time to live.
+
+    :param maxsize: maximum number of entries,
+    :param ttl: time to live of an entry in seconds, `None` for no limit.
+
+    `hits`, `misses` and `evictions` counters are available to check the
+    cache efficiency. `evictions` counts entries dropped because of size,
+    age or invalidation.
+    """
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # clef -> (expiration, tables, résultat)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        _caches.add(self)
+
+
+    def get(self, key, session=None):
+        """
+        Returns a (found, value) couple for `key`.
+
+        An entry holding objects which don't belong to `session`, or having
+        read tables with changes flushed but not committed by `session`,
+        isn't used.
+        """
+        flushed = flushed_tables(session)
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                expiration, tables, value = entry
+                if expiration is not None and expiration < time.time():
+                    self.evictions += 1
+                elif not flushed.isdisjoint(tables):
+                    # L'entrée reste valable pour les autres sessions
+                    self._entries[key] = entry
+                elif _belongs_to(value, session):
+                    # Remise en fin de liste : c'est le plus récemment utilisé
+                    self._entries[key] = entry
+                    self.hits += 1
+                    return True, value
+            self.misses += 1
+            return False, None
+
+
+    def set(self, key, value, tables, session=None):
+        """
+        Stores `value` for `key`. `tables` are the tables read to compute
+        `value`, the entry is invalidated when one of them is flushed.
+
+        Nothing is stored if `session`, which computed `value`, has flushed
+        changes on one of `tables` which aren't committed yet.
+        """
+        if not flushed_tables(session).isdisjoint(tables):
+            return
+
+        expiration = None
+        if self.ttl is not None:
+            expiration = time.time() + self.ttl
+
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (expiration, tables, value)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+
+    def invalidate(self, tables):
+        """
+        Drops entries which have read one of `tables`.
+        """
+        tables = frozenset(tables)
+        with self._lock:
+            for key, (_, entry_tables, _) in self._entries.items():
+                if not tables.isdisjoint(entry_tables):
+                    del self._entries[key]
+                    self.evictions += 1
+
+
+    def clear(self):
+        """
+        Drops every entry. Counters are kept.
+        """
+        with self._lock:
+            self._entries.clear()
+
+
+    def info(self):
+        """
+        Returns a dictionary with counters and size of the cache.
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+        }
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def _belongs_to(value, session):
+    """
+    True if every mapped object in `value` is attached to `session`.
+    """
+    if isinstance(value, list):
+        return all(_belongs_to(v, session) for v in value)
+    if hasattr(value, '_sa_instance_state'):
+        return session is not None and object_session(value) is session
+    return True
+
+
+def flushed_tables(session):
+    """
+    Returns the tables on which `session` flushed changes in its current
+    transaction.
+    """
+    if session is None:
+        return frozenset()
+    return _flushed.get(session, frozenset())
+
+
+def mark_written(session, tables):
+    """
+    Records that `session` wrote in `tables` in its current transaction,
+    and invalidates entries having read them. Writes which don't go through
+    the flush (bulk statements ...) must call it.
+    """
+    tables = set(tables)
+    if session is not None and tables:
+        _flushed.setdefault(session, set()).update(tables)
+    invalidate_tables(tables)
+
+
+def invalidate_tables(tables):
+    """
+    Invalidates entries of every cache which have read one of `tables`.
+    """
+    if not tables:
+        return
+    for cache in list(_caches):
+        cache.invalidate(tables)
+
+
+@event.listens_for(Session, 'after_flush')
+def _after_flush(session, flush_context):
+    # Après un flush, les listes new, dirty et deleted sont encore celles
+    # d'avant le flush.
+    tables = set()
+    for instance in session.new | session.dirty | session.deleted:
+        tables.update(object_mapper(instance).tables)
+    mark_written(session, tables)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _after_rollback(session):
+    # Une autre session sur la même connexion a pu lire, et mettre en cache,
+    # les changements annulés.
+    invalidate_tables(_flushed.get(session, ()))
+
+
+@event.listens_for(Session, 'after_transaction_end')
+def _after_transaction_end(session, transaction):
+    if transaction.parent is None:
+        _flushed.pop(session, None)
+
+
+@event.listens_for(Session, 'after_bulk_update')
+def _after_bulk_update(update_context):
+    mark_written(update_context.session, update_context.mapper.tables)
+
+
+@event.listens_for(Session, 'after_bulk_delete')
+def _after_bulk_delete(delete_context):
+    mark_written(delete_context.session, delete_context.mapper.tables)
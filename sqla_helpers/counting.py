@@ -0,0 +1,152 @@
+#-*- coding: utf-8 -*-
+"""
+Counting
+========
+
+:meth:`sqla_helpers.base_model.BaseModel.count` emits a single
+`SELECT count(*)` over the joins and criterions of the search, without the
+subquery `Query.count` wraps around the whole selected row.
+
+When a criterion goes through a relation to a list of objects, a row of
+the queried class may match several rows of the join: the count becomes a
+`count(DISTINCT primary key)` (a count of a `SELECT DISTINCT` of the
+primary key for composite keys), so it equals the number of objects
+:meth:`sqla_helpers.base_model.BaseModel.filter` returns.
+
+With `estimate=True`, the number of rows is read from the statistics of the
+database when it keeps some:
+
+* PostgreSQL: `pg_class.reltuples` without criterions, the rows estimated
+  by the planner (`EXPLAIN`) otherwise,
+* MySQL: `information_schema.tables.table_rows`, without criterions,
+* SQLite: `sqlite_stat1`, filled by `ANALYZE`, without criterions.
+
+An exact count is done in other cases.
+
+:meth:`sqla_helpers.base_model.BaseModel.exists` selects an `EXISTS` of the
+search, or reads its first row (`LIMIT 1`) on databases which can't select
+an `EXISTS` (see :data:`NO_EXISTS_SELECT`).
+
+.. autofunction:: expression
+
+.. autofunction:: selects_exists
+
+.. autofunction:: estimate
+"""
+import json
+
+from sqlalchemy import distinct, func, text
+from sqlalchemy.orm import class_mapper
+
+NO_EXISTS_SELECT = frozenset(['mssql', 'oracle', 'sybase', 'firebird'])
+"""
+Dialects whose `SELECT` can't have an `EXISTS` in its columns.
+"""
+
+
+def joins_to_many(cls, classes):
+    """
+    Returns `True` if joining `classes` from `cls` crosses a relation to a
+    list of objects.
+    """
+    joined = [class_mapper(cls)]
+    for klass in classes:
+        mapper = class_mapper(klass)
+        for left in joined:
+            for prop in left.relationships:
+                if prop.uselist and mapper.isa(prop.mapper):
+                    return True
+        joined.append(mapper)
+    return False
+
+
+def expression(cls, classes):
+    """
+    Returns the count expression of a query on `cls` joined with `classes`,
+    or `None` when distinct composite primary keys have to be counted.
+    """
+    primary_key = class_mapper(cls).primary_key
+    if not joins_to_many(cls, classes):
+        return func.count()
+    if len(primary_key) == 1:
+        return func.count(distinct(primary_key[0]))
+    # `count(DISTINCT a, b)` n'est pas standard
+    return None
+
+
+def selects_exists(dialect):
+    """
+    Returns `True` if `dialect` can select an `EXISTS` expression.
+    """
+    return dialect.name not in NO_EXISTS_SELECT
+
+
+def _sqlite_rows(session, table):
+    exists = session.execute(text(
+        "SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'")).scalar()
+    if not exists:
+        return None
+    stat = session.execute(text(
+        'SELECT stat FROM sqlite_stat1 WHERE tbl = :name'),
+        {'name': table.name}).scalar()
+    if not stat:
+        return None
+    # Le premier nombre de `stat` est le nombre de lignes de la table
+    return int(stat.split()[0])
+
+
+def _mysql_rows(session, table):
+    return session.execute(text(
+        'SELECT table_rows FROM information_schema.tables '
+        'WHERE table_schema = COALESCE(:schema, DATABASE()) '
+        'AND table_name = :name'),
+        {'schema': table.schema, 'name': table.name}).scalar()
+
+
+def _postgresql_rows(session, table):
+    name = table.name if table.schema is None else \
+            '{0}.{1}'.format(table.schema, table.name)
+    rows = session.execute(text(
+        'SELECT reltuples FROM pg_class WHERE oid = to_regclass(:name)'),
+        {'name': name}).scalar()
+    # Une table jamais analysée a -1 (ou 0 avant PostgreSQL 14)
+    if rows is None or rows <= 0:
+        return None
+    return int(rows)
+
+
+def _postgresql_plan_rows(session, dialect, query):
+    compiled = query.statement.compile(dialect=dialect)
+    # Requête envoyée telle quelle au driver, avec ses paramètres compilés
+    plan = session.connection().execute(
+        'EXPLAIN (FORMAT JSON) ' + compiled.string, compiled.params).scalar()
+    if isinstance(plan, basestring):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def estimate(cls, operators, criterions):
+    """
+    Returns the estimated number of objects of `cls` matching `operators`
+    and `criterions`, or `None` if the database has no estimate for it.
+    """
+    mapper = class_mapper(cls)
+    if len(mapper.tables) != 1:
+        return None
+    table = mapper.local_table
+    session = cls.session
+    dialect = session.get_bind(mapper=mapper).dialect
+
+    if operators or criterions:
+        if dialect.name == 'postgresql':
+            return _postgresql_plan_rows(
+                session, dialect, cls.search(*operators, **criterions))
+        return None
+
+    if dialect.name == 'postgresql':
+        return _postgresql_rows(session, table)
+    if dialect.name == 'mysql':
+        return _mysql_rows(session, table)
+    if dialect.name == 'sqlite':
+        return _sqlite_rows(session, table)
+    return None
@@ -0,0 +1,199 @@
+#-*- coding: utf-8 -*-
+"""
+JSON encoding
+=============
+
+Writes JSON of mapped objects directly in a stream, without building the
+dictionaries returned by :meth:`sqla_helpers.base_model.BaseModel.dump`.
+
+For values supported by :mod:`json`, the output is the same as
+`json.dumps(instance.dump())`. Other values are encoded as:
+
+* dates, times and datetimes: string in ISO 8601 format,
+* decimals: exact number (`str(value)`),
+* binary values (`bytearray`, `buffer`): string encoded in base64.
+
+.. autofunction:: write_json
+
+.. autofunction:: write_json_many
+
+.. autofunction:: encode_value
+"""
+import base64
+import datetime
+import decimal
+import json
+from json.encoder import encode_basestring_ascii
+
+from sqlalchemy import event
+from sqlalchemy.orm import Mapper
+
+from sqla_helpers import loading
+
+_binary_types = (bytearray, buffer)
+
+
+def encode_value(value):
+    """
+    Returns the JSON encoding of a column value.
+
+    .. code-block:: python
+
+        >>> encode_value(u'plop')
+        '"plop"'
+        >>> encode_value(datetime.date(2014, 2, 21))
+        '"2014-02-21"'
+        >>> encode_value(decimal.Decimal('1.10'))
+        '1.10'
+    """
+    if value is None:
+        return 'null'
+    elif value is True:
+        return 'true'
+    elif value is False:
+        return 'false'
+    elif isinstance(value, basestring):
+        return encode_basestring_ascii(value)
+    elif isinstance(value, (int, long)):
+        return str(value)
+    elif isinstance(value, decimal.Decimal):
+        return str(value)
+    elif isinstance(value, (datetime.date, datetime.time)):
+        return encode_basestring_ascii(value.isoformat())
+    elif isinstance(value, _binary_types):
+        return encode_basestring_ascii(base64.b64encode(bytes(value)))
+    return json.dumps(value)
+
+
+_key_orders = {}
+
+event.listen(Mapper, 'after_configured', _key_orders.clear)
+
+
+def _dump_properties(cls, excludes, depth, includes=None):
+    """
+    Returns properties `dump` would export, in the iteration order of the
+    dictionary `dump` returns. Orders are cached by class, `excludes`,
+    `includes` and relations exporting.
+    """
+    with_relations = depth - 1 > 0
+    cache_key = (cls, excludes, includes, with_relations)
+    try:
+        return _key_orders[cache_key]
+    except KeyError:
+        pass
+
+    plan = loading.model_plan(cls)
+    properties = plan.columns
+    if with_relations:
+        properties += plan.scalars + plan.collections
+
+    # Les clefs sont insérées dans le même ordre que dans `dump`, le
+    # dictionnaire est donc parcouru dans le même ordre que celui de `dump`.
+    ordered = {}
+    for prop in properties:
+        if prop.key not in excludes and \
+           (includes is None or prop.key in includes):
+            ordered[prop.key] = prop
+
+    res = _key_orders[cache_key] = tuple(ordered.itervalues())
+    return res
+
+
+def _skipped_keys(instance, deferred, includes):
+    """
+    Returns the names of deferred columns `dump` doesn't export: those which
+    aren't loaded yet, unless `deferred` or `includes` is given.
+    """
+    if deferred or includes is not None:
+        return frozenset()
+    loaded = instance.__dict__
+    missing = [prop.key
+               for prop in loading.model_plan(instance.__class__).columns
+               if prop.key not in loaded]
+    if not missing:
+        return frozenset()
+    return loading.deferred_keys(instance).intersection(missing)
+
+
+def _encode(instance, excludes, depth, parts, includes=None, deferred=False):
+    """
+    Appends in `parts` JSON fragments of `instance`, dumped as `dump` does.
+    """
+    parts.append('{')
+    first = True
+    # Les colonnes différées ignorées par `dump` ne sont pas dans son
+    # dictionnaire : l'ordre des clefs se calcule sans elles.
+    skipped = _skipped_keys(instance, deferred, includes)
+    if skipped:
+        excludes = excludes | skipped
+    for prop in _dump_properties(instance.__class__, excludes, depth,
+                                 includes):
+        if first:
+            first = False
+        else:
+            parts.append(', ')
+        parts.append(encode_basestring_ascii(prop.key))
+        parts.append(': ')
+
+        value = getattr(instance, prop.key)
+        if prop.kind == loading.COLUMN:
+            parts.append(encode_value(value))
+        elif prop.kind == loading.SCALAR:
+            # Comme dans `dump`, les exclusions ne valent qu'au premier niveau
+            _encode(value, frozenset(), depth - 1, parts, deferred=deferred)
+        else:
+            parts.append('[')
+            for index, related in enumerate(value):
+                if index:
+                    parts.append(', ')
+                _encode(related, frozenset(), depth - 1, parts,
+                        deferred=deferred)
+            parts.append(']')
+    parts.append('}')
+    return parts
+
+
+def write_json(instance, stream, depth=2, excludes=[], includes=None,
+               deferred=False):
+    """
+    Writes in `stream` the JSON of `instance` as `dump` would export it with
+    the same `depth`, `excludes`, `includes` and `deferred`.
+    """
+    if includes is not None:
+        includes = frozenset(includes)
+    stream.write(''.join(_encode(instance, frozenset(excludes), depth, [],
+                                 includes, deferred)))
+
+
+def write_json_many(instances, stream, depth=2, excludes=[], ndjson=False,
+                    includes=None):
+    """
+    Writes in `stream` the JSON list of `instances`. An object is written at
+    once, so the whole list is never built in memory.
+
+    If `ndjson` is True, objects are written one per line (`Newline Delimited
+    JSON`) instead of a JSON list.
+
+    Returns the number of written objects.
+    """
+    excludes = frozenset(excludes)
+    if includes is not None:
+        includes = frozenset(includes)
+    count = 0
+    if not ndjson:
+        stream.write('[')
+
+    for count, instance in enumerate(instances, 1):
+        if ndjson or count == 1:
+            parts = []
+        else:
+            parts = [', ']
+        _encode(instance, excludes, depth, parts, includes)
+        if ndjson:
+            parts.append('\n')
+        stream.write(''.join(parts))
+
+    if not ndjson:
+        stream.write(']')
+    return count
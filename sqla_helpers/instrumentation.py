@@ -0,0 +1,323 @@
+#-*- coding: utf-8 -*-
+"""
+Instrumentation
+===============
+
+Methods of :class:`sqla_helpers.base_model.BaseModel` (`search`, query
+operations as `get`, `filter`, `count` ..., `load` and `dump`) emit an
+:class:`Event` to listeners registered in :data:`registry`. A listener is
+any callable taking the event.
+
+.. code-block:: python
+
+    >>> sink = HistogramSink()
+    >>> listen(sink)
+    >>> Treatment.filter(status__name=u'ok')
+    >>> sink.stats()
+    {('filter', 'Treatment', 'status__name'): {'count': 1, 'p50_ms': 0.25, ...}}
+    >>> remove(sink)
+
+An event is emitted for the outermost instrumented call of a thread only:
+the objects loaded by `get` or the relations dumped by `dump` are part of
+its event. Criterions are described by their shape, without their values.
+
+When no listener is registered, a call only costs a check of the listeners
+list, and statements aren't counted.
+
+.. autoclass:: Event
+    :members:
+
+.. autoclass:: Registry
+    :members:
+
+.. autoclass:: HistogramSink
+    :members:
+
+.. autofunction:: criterions_shape
+"""
+import bisect
+import threading
+import timeit
+from functools import wraps
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from sqla_helpers.logical import Q, walk, AndASTNode, OrASTNode, NotASTNode
+
+_clock = timeit.default_timer
+_local = threading.local()
+
+
+class Event(object):
+    """
+    A call of an instrumented method:
+
+    * `operation`: name of the method (`search`, `filter`, `dump` ...),
+    * `model`: the class,
+    * `shape`: criterions shape (see :func:`criterions_shape`), `None` when
+      the method has no criterions,
+    * `duration`: wall time, in seconds,
+    * `statements`: number of statements executed during the call,
+    * `rows`: number of objects (or rows) returned, `None` if the method
+      doesn't return them (`search` returns a query).
+    """
+    __slots__ = ('operation', 'model', 'shape', 'duration', 'statements',
+                 'rows')
+
+    def __init__(self, operation, model, shape, duration, statements, rows):
+        self.operation = operation
+        self.model = model
+        self.shape = shape
+        self.duration = duration
+        self.statements = statements
+        self.rows = rows
+
+    def __repr__(self):
+        return '<Event {0} {1} [{2}] {3:.3f} ms>'.format(
+            self.operation, self.model.__name__, self.shape,
+            self.duration * 1000)
+
+
+def _count_statement(conn, cursor, statement, parameters, context,
+                     executemany):
+    if getattr(_local, 'depth', 0):
+        _local.statements += 1
+
+
+class Registry(object):
+    """
+    Listeners of instrumentation events.
+
+    Statements are counted through an engine event which is only listened
+    while a listener is registered.
+    """
+
+    def __init__(self):
+        self.listeners = ()
+        self._lock = threading.Lock()
+
+
+    def listen(self, listener):
+        """
+        Registers `listener`, a callable taking an :class:`Event`.
+        """
+        with self._lock:
+            if not self.listeners:
+                event.listen(Engine, 'before_cursor_execute', _count_statement)
+            # Tuple remplacé, jamais modifié : la liste parcourue par `emit`
+            # ne change pas pendant le parcours.
+            self.listeners = self.listeners + (listener,)
+
+
+    def remove(self, listener):
+        """
+        Unregisters `listener`.
+        """
+        with self._lock:
+            listeners = list(self.listeners)
+            listeners.remove(listener)
+            self.listeners = tuple(listeners)
+            if not self.listeners:
+                event.remove(Engine, 'before_cursor_execute', _count_statement)
+
+
+    def emit(self, instrumentation_event):
+        """
+        Sends an event to every listener.
+        """
+        for listener in self.listeners:
+            listener(instrumentation_event)
+
+
+registry = Registry()
+"""
+Global :class:`Registry` of :class:`sqla_helpers.base_model.BaseModel`.
+"""
+
+listen = registry.listen
+remove = registry.remove
+
+_symbols = {AndASTNode: '&', OrASTNode: '|', NotASTNode: '~'}
+
+
+def _operator_shape(operator):
+    if not isinstance(operator, Q):
+        return '<{0}>'.format(getattr(operator, '__name__',
+                                      operator.__class__.__name__))
+    # Notation préfixe, le nombre d'enfants décrit l'arbre
+    return ' '.join(
+        ','.join(sorted(node.operand)) if node.operand
+        else '{0}{1}'.format(_symbols.get(node.__class__, '?'),
+                             len(node.children))
+        for node in walk(operator.ast))
+
+
+def criterions_shape(operators, criterions):
+    """
+    Returns the shape of a call's criterions, a string with the criterions
+    keys and the structure of operators, without values.
+
+    .. code-block:: python
+
+        >>> criterions_shape([Q(id=1) | Q(status__name=u'ko')],
+        ...                  {'name__like': u'a%'})
+        'name__like; |2 id status__name'
+    """
+    parts = [','.join(sorted(criterions))]
+    parts.extend(_operator_shape(operator) for operator in operators)
+    return '; '.join(parts)
+
+
+def _rows(result):
+    if result is None:
+        return 0
+    if isinstance(result, (list, tuple)):
+        return len(result)
+    if hasattr(result, 'statement'):
+        # Requête non exécutée
+        return None
+    return 1
+
+
+def _call_shape(args, kwargs):
+    return criterions_shape(args, kwargs)
+
+
+def instrumented(operation, shape=_call_shape):
+    """
+    Decorator of a method whose calls emit an :class:`Event`. `shape` is
+    called with the positional and keywords arguments of the call, the
+    class or the object excepted, and returns the shape of the event.
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(cls_or_self, *args, **kwargs):
+            if not registry.listeners or getattr(_local, 'depth', 0):
+                return method(cls_or_self, *args, **kwargs)
+
+            _local.depth = 1
+            _local.statements = 0
+            start = _clock()
+            try:
+                result = method(cls_or_self, *args, **kwargs)
+            finally:
+                duration = _clock() - start
+                statements = _local.statements
+                _local.depth = 0
+            if isinstance(cls_or_self, type):
+                model = cls_or_self
+            else:
+                model = cls_or_self.__class__
+            registry.emit(Event(operation, model, shape(args, kwargs),
+                                duration, statements, _rows(result)))
+            return result
+        return wrapper
+    return decorator
+
+
+def no_shape(args, kwargs):
+    """
+    Shape of methods without criterions.
+    """
+    return None
+
+
+def keys_shape(args, kwargs):
+    """
+    Shape of `load`: the keys of the loaded dictionary.
+    """
+    if args and isinstance(args[0], dict):
+        return ','.join(sorted(args[0]))
+    return None
+
+
+# Bornes des seaux de durées, en secondes : de 10 µs à ~ 80 s, chaque seau
+# étant 25 % plus large que le précédent.
+BUCKETS = tuple(1e-5 * 1.25 ** i for i in xrange(72))
+
+
+class _Histogram(object):
+    __slots__ = ('counts', 'count', 'duration', 'statements', 'rows')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.duration = 0.
+        self.statements = 0
+        self.rows = 0
+
+    def add(self, instrumentation_event):
+        self.counts[bisect.bisect_left(BUCKETS,
+                                       instrumentation_event.duration)] += 1
+        self.count += 1
+        self.duration += instrumentation_event.duration
+        self.statements += instrumentation_event.statements
+        self.rows += instrumentation_event.rows or 0
+
+    def percentile(self, rank):
+        """
+        Returns the upper bound of the bucket holding the `rank` percentile.
+        """
+        threshold = rank / 100. * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= threshold and count:
+                return BUCKETS[min(index, len(BUCKETS) - 1)]
+        return BUCKETS[-1]
+
+
+class HistogramSink(object):
+    """
+    Listener keeping, in memory, an histogram of durations and counters of
+    statements and rows per operation, model and shape.
+    """
+
+    def __init__(self):
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+
+    def __call__(self, instrumentation_event):
+        key = (instrumentation_event.operation,
+               instrumentation_event.model.__name__,
+               instrumentation_event.shape)
+        with self._lock:
+            try:
+                histogram = self._histograms[key]
+            except KeyError:
+                histogram = self._histograms[key] = _Histogram()
+            histogram.add(instrumentation_event)
+
+
+    def stats(self):
+        """
+        Returns a dictionary of (operation, model name, shape) -> statistics:
+        number of calls, total and mean time, 50th, 90th and 99th
+        percentiles of durations (upper bound of their bucket), in
+        milliseconds, mean number of statements and rows per call.
+        """
+        res = {}
+        with self._lock:
+            for key, histogram in self._histograms.iteritems():
+                res[key] = {
+                    'count': histogram.count,
+                    'total_ms': histogram.duration * 1000,
+                    'mean_ms': histogram.duration * 1000 / histogram.count,
+                    'p50_ms': histogram.percentile(50) * 1000,
+                    'p90_ms': histogram.percentile(90) * 1000,
+                    'p99_ms': histogram.percentile(99) * 1000,
+                    'statements': histogram.statements /
+                                  float(histogram.count),
+                    'rows': histogram.rows / float(histogram.count),
+                }
+        return res
+
+
+    def clear(self):
+        """
+        Drops every histogram.
+        """
+        with self._lock:
+            self._histograms.clear()
@@ -0,0 +1,235 @@
+#-*- coding: utf-8 -*-
+"""
+Lazy loads detection
+====================
+
+Reading a relation which isn't loaded yet queries the database: a `dump`
+with `depth`, or a loop over objects reading a relation, quietly runs a
+query per object ("N+1" queries). A :class:`LazyLoadDetector` counts those
+lazy loads per relation path, and tells which eager loading option would
+load them with the first query.
+
+.. code-block:: python
+
+    >>> with BaseModel.detect_lazy_loads() as detector:
+    ...     dumped = [s.dump() for s in Status.filter()]
+    >>> detector.report()
+    [<LazyLoad Status.treatments: 12 loads, selectinload(Status.treatments)>]
+    >>> Status.search().options(detector.report()[0].option())
+    <sqlalchemy.orm.query.Query object at 0x2ad3990>
+
+Paths start at objects which weren't lazy loaded themselves: objects of
+queries, or objects loaded eagerly by them. Lazy loads are counted in the
+current thread, whatever the class of objects.
+
+With a `threshold`, :class:`TooManyLazyLoads` is raised at the end of the
+block if a relation path was lazy loaded more than `threshold` times, so a
+test can catch a regression.
+
+:attr:`sqla_helpers.base_model.BaseModel.lazy_load_threshold` sets the
+threshold of `filter`, `load`, `load_many`, `dump` and `dump_many` calls,
+run in a detector each. It is `None` by default: nothing is detected.
+
+While no detector is active, lazy loads aren't watched at all.
+
+.. autoclass:: LazyLoadDetector
+    :members:
+
+.. autoclass:: LazyLoad
+    :members:
+
+.. autoclass:: TooManyLazyLoads
+"""
+import threading
+import weakref
+from functools import wraps
+
+from sqlalchemy import orm
+from sqlalchemy.orm import attributes
+from sqlalchemy.orm.strategies import LazyLoader
+
+_local = threading.local()
+_lock = threading.Lock()
+# Nombre de détecteurs actifs, tous threads confondus
+_active = [0]
+_emit_lazyload = LazyLoader.__dict__['_emit_lazyload']
+
+
+class TooManyLazyLoads(Exception):
+    """
+    Raised when a relation path was lazy loaded more times than the
+    threshold of a :class:`LazyLoadDetector`.
+    """
+
+    def __init__(self, threshold, lazy_loads):
+        self.threshold = threshold
+        self.lazy_loads = lazy_loads
+        super(TooManyLazyLoads, self).__init__(
+            u'Relations lazy loaded more than {0} times: {1}'.format(
+                threshold, u', '.join(
+                    u'{0} ({1} loads, use {2})'.format(
+                        lazy_load.name, lazy_load.count, lazy_load.suggestion)
+                    for lazy_load in lazy_loads)))
+
+
+class LazyLoad(object):
+    """
+    Lazy loads of a relation path:
+
+    * `model`: the class the path starts from,
+    * `path`: relations crossed, in :mod:`sqla_helpers` syntax
+      (`status__treatments`),
+    * `count`: number of lazy loads of the last relation of the path,
+    * `suggestion`: the eager loading option loading the path, as text.
+
+    As in :func:`sqla_helpers.loading.eager_options`, lists of objects are
+    loaded with `selectinload`, objects with `joinedload`.
+    """
+    __slots__ = ('model', 'path', 'count', 'suggestion')
+
+    def __init__(self, model, path):
+        self.model = model
+        self.path = path
+        self.count = 0
+        self.suggestion = '.'.join(
+            '{0}({1}.{2})'.format(strategy, cls.__name__, key)
+            for cls, key, strategy in self._links())
+
+    @property
+    def name(self):
+        return '{0}.{1}'.format(self.model.__name__, self.path)
+
+    def _links(self):
+        cls = self.model
+        for key in self.path.split('__'):
+            prop = cls.__mapper__.get_property(key)
+            if prop.uselist:
+                strategy = 'selectinload'
+            else:
+                strategy = 'joinedload'
+            yield cls, key, strategy
+            cls = prop.mapper.class_
+
+    def option(self):
+        """
+        Returns the eager loading option loading the path, to give to
+        `Query.options`.
+        """
+        loader = orm
+        for cls, key, strategy in self._links():
+            loader = getattr(loader, strategy)(getattr(cls, key))
+        return loader
+
+    def __repr__(self):
+        return '<LazyLoad {0}: {1} loads, {2}>'.format(self.name, self.count,
+                                                      self.suggestion)
+
+
+class LazyLoadDetector(object):
+    """
+    Context manager counting lazy loads of relations in the current
+    thread, per relation path.
+
+    With `threshold`, :class:`TooManyLazyLoads` is raised when leaving the
+    block if a path was lazy loaded more than `threshold` times, unless the
+    block raised an exception.
+    """
+
+    def __init__(self, threshold=None):
+        self.threshold = threshold
+        self.lazy_loads = {}
+        # Chemin de chaque objet chargé paresseusement, depuis sa racine
+        self._origins = weakref.WeakKeyDictionary()
+
+    def __enter__(self):
+        with _lock:
+            if not _active[0]:
+                LazyLoader._emit_lazyload = _watched_emit_lazyload
+            _active[0] += 1
+        detectors = getattr(_local, 'detectors', ())
+        _local.detectors = detectors + (self,)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        detectors = list(_local.detectors)
+        detectors.remove(self)
+        _local.detectors = tuple(detectors)
+        with _lock:
+            _active[0] -= 1
+            if not _active[0]:
+                LazyLoader._emit_lazyload = _emit_lazyload
+        if exc_type is None:
+            self.check()
+        return False
+
+    @property
+    def count(self):
+        """
+        Total number of lazy loads.
+        """
+        return sum(lazy_load.count for lazy_load in self.lazy_loads.itervalues())
+
+    def report(self):
+        """
+        Returns the :class:`LazyLoad` of each path, the most loaded first.
+        """
+        return sorted(self.lazy_loads.itervalues(),
+                      key=lambda lazy_load: (-lazy_load.count, lazy_load.name))
+
+    def check(self):
+        """
+        Raises :class:`TooManyLazyLoads` if a path was lazy loaded more than
+        `threshold` times.
+        """
+        if self.threshold is None:
+            return
+        exceeded = [lazy_load for lazy_load in self.report()
+                    if lazy_load.count > self.threshold]
+        if exceeded:
+            raise TooManyLazyLoads(self.threshold, exceeded)
+
+    def _record(self, prop, state, result):
+        model, path = self._origins.get(state, (state.class_, None))
+        if path is None:
+            path = prop.key
+        else:
+            path = '{0}__{1}'.format(path, prop.key)
+        try:
+            lazy_load = self.lazy_loads[model, path]
+        except KeyError:
+            lazy_load = self.lazy_loads[model, path] = LazyLoad(model, path)
+        lazy_load.count += 1
+
+        if result is None:
+            return
+        if not prop.uselist:
+            result = [result]
+        for instance in result:
+            self._origins.setdefault(attributes.instance_state(instance),
+                                     (model, path))
+
+
+def _watched_emit_lazyload(self, session, state, primary_key_identity,
+                           passive):
+    result = _emit_lazyload(self, session, state, primary_key_identity,
+                            passive)
+    for detector in getattr(_local, 'detectors', ()):
+        detector._record(self.parent_property, state, result)
+    return result
+
+
+def watched(method):
+    """
+    Decorator of methods of :class:`sqla_helpers.base_model.BaseModel` run
+    in a :class:`LazyLoadDetector` when the class has a
+    `lazy_load_threshold`. A call made in an active detector isn't watched
+    again.
+    """
+    @wraps(method)
+    def wrapper(cls_or_self, *args, **kwargs):
+        threshold = cls_or_self.lazy_load_threshold
+        if threshold is None or getattr(_local, 'detectors', ()):
+            return method(cls_or_self, *args, **kwargs)
+        with LazyLoadDetector(threshold):
+            return method(cls_or_self, *args, **kwargs)
+    return wrapper
@@ -1,7 +1,108 @@
 #-*- coding: utf-8 -*-
+"""
+Loading and dumping tools
+=========================
 
+.. autofunction:: model_plan
+
+.. autofunction:: dump_options
+
+.. autofunction:: deferred_keys
+
+.. autoclass:: ModelPlan
+    :members:
+
+.. autoclass:: PropertyPlan
+    :members:
+"""
+
+from sqlalchemy import and_, event, or_, orm
+from sqlalchemy.orm import Mapper, strategies
+from sqlalchemy.orm.properties import ColumnProperty, RelationshipProperty
 from sqlalchemy.orm.state import InstanceState
 
+COLUMN = 0
+SCALAR = 1
+COLLECTION = 2
+
+
+class PropertyPlan(object):
+    """
+    A mapped property, classified once for all.
+
+    `kind` is :data:`COLUMN` for every non relation property, :data:`SCALAR`
+    for a relation to an object and :data:`COLLECTION` for a relation to a
+    list of objects. `target` is the related class for relations, `None`
+    otherwise.
+    """
+    __slots__ = ('key', 'kind', 'target')
+
+    def __init__(self, key, kind, target=None):
+        self.key = key
+        self.kind = kind
+        self.target = target
+
+
+class ModelPlan(object):
+    """
+    Description of a mapped class used by `dump` and `load`, which avoids
+    to classify mapper's properties for each object.
+
+    * `properties`: every :class:`PropertyPlan`, in mapper's order,
+    * `columns`, `scalars` and `collections`: properties by kind,
+    * `relations`: scalar and collection properties, in mapper's order,
+    * `keys`: frozenset of properties' names,
+    * `primary_key`: tuple of primary key attributes names.
+    """
+    __slots__ = ('properties', 'columns', 'relations', 'scalars',
+                 'collections', 'keys', 'primary_key')
+
+    def __init__(self, mapper):
+        properties = []
+        for attr_key, attr_type in mapper._props.iteritems():
+            if isinstance(attr_type, RelationshipProperty):
+                if attr_type.uselist:
+                    kind = COLLECTION
+                else:
+                    kind = SCALAR
+                properties.append(PropertyPlan(attr_key, kind,
+                                               attr_type.mapper.class_))
+            else:
+                properties.append(PropertyPlan(attr_key, COLUMN))
+
+        self.properties = tuple(properties)
+        self.columns = tuple(p for p in properties if p.kind == COLUMN)
+        self.relations = tuple(p for p in properties if p.kind != COLUMN)
+        self.scalars = tuple(p for p in properties if p.kind == SCALAR)
+        self.collections = tuple(p for p in properties if p.kind == COLLECTION)
+        self.keys = frozenset(p.key for p in properties)
+        self.primary_key = tuple(attr.key for attr in mapper.primary_key)
+
+
+_plans = {}
+
+
+def model_plan(cls):
+    """
+    Returns the :class:`ModelPlan` of `cls`.
+
+    Plans are built once mappers are configured and dropped each time
+    `SQLAlchemy` configures new mappers, since relations (backrefs for
+    instance) may have been added.
+    """
+    try:
+        return _plans[cls]
+    except KeyError:
+        # Le plan doit voir toutes les propriétés, y compris les backrefs
+        # ajoutées à la configuration des autres mappers.
+        orm.configure_mappers()
+        plan = _plans[cls] = ModelPlan(cls.__mapper__)
+        return plan
+
+
+event.listen(Mapper, 'after_configured', _plans.clear)
+
+
 def instancied(cls):
     """
     Return a class without use on `__init__`.
@@ -13,3 +114,216 @@ def instancied(cls):
     instance._sa_instance_state = InstanceState(instance,
                                                   instance._sa_class_manager)
     return instance
+
+
+def loading_key(cls, dictionary):
+    """
+    Returns the primary key values of `cls` found in `dictionary`, as a
+    dictionary. If one of the primary key attributes is missing, `None` is
+    returned: the object can't be loaded from database.
+
+    .. code-block:: python
+
+        >>> loading_key(Treatment, {'id': 1, 'name': u'test'})
+        {'id': 1}
+        >>> loading_key(Treatment, {'name': u'test'}) is None
+        True
+    """
+    key = {}
+    for name in model_plan(cls).primary_key:
+        if not name in dictionary:
+            return None
+        key[name] = dictionary[name]
+
+    return key
+
+
+def identity(cls, criterions):
+    """
+    Returns the primary key tuple of `cls` if `criterions` are exactly
+    equalities on the primary key attributes, `None` otherwise.
+
+    .. code-block:: python
+
+        >>> identity(Treatment, {'id': 1})
+        (1,)
+        >>> identity(Treatment, {'id__lt': 1}) is None
+        True
+    """
+    primary_key = model_plan(cls).primary_key
+    if len(criterions) != len(primary_key):
+        return None
+
+    try:
+        key = tuple(criterions[name] for name in primary_key)
+    except KeyError:
+        return None
+
+    for value in key:
+        # Une valeur nulle ou non hashable n'est pas une identité
+        if value is None:
+            return None
+        try:
+            hash(value)
+        except TypeError:
+            return None
+    return key
+
+
+def collect_primary_keys(cls, dictionaries, keys):
+    """
+    Walks through `dictionaries` as :meth:`sqla_helpers.base_model.BaseModel.load`
+    does and stores in `keys` every primary key found, for each class of the
+    graph.
+
+    `keys` is a dictionary of class -> set of primary key tuples. Tuples follow
+    the order of `cls.__mapper__.primary_key`.
+    """
+    plan = model_plan(cls)
+    for dictionary in dictionaries:
+        # Les valeurs qui ne sont pas des dictionnaires seront rejetées par
+        # `load` , ce n'est pas à la collecte de le faire.
+        if not isinstance(dictionary, dict):
+            continue
+
+        key = loading_key(cls, dictionary)
+        if key is not None:
+            try:
+                keys.setdefault(cls, set()).add(
+                    tuple(key[name] for name in plan.primary_key))
+            except TypeError:
+                # Clef non hashable, `load` s'en chargera avec un `get`
+                pass
+
+        for relation in plan.relations:
+            if relation.key not in dictionary:
+                continue
+
+            attr_value = dictionary[relation.key]
+            if relation.kind == COLLECTION:
+                children = attr_value or []
+            else:
+                children = [attr_value]
+            collect_primary_keys(relation.target, children, keys)
+
+    return keys
+
+
+def primary_key_clause(columns, pks):
+    """
+    Returns the criterion selecting rows whose primary key `columns` have
+    one of the values tuples `pks`.
+    """
+    if len(columns) == 1:
+        return columns[0].in_([pk[0] for pk in pks])
+    return or_(*[and_(*[column == value for column, value in zip(columns, pk)])
+                 for pk in pks])
+
+
+def eager_options(cls, depth, excludes=(), parent=None, includes=None):
+    """
+    Returns the loader options which load, in a query per relation level,
+    every relation :meth:`sqla_helpers.base_model.BaseModel.dump` goes through
+    with the same `depth`, `excludes` and `includes`.
+
+    Collections are loaded with `selectinload`, scalar relations with
+    `joinedload`.
+
+    .. code-block:: python
+
+        >>> Treatment.session.query(Treatment).options(*eager_options(Treatment, 2))
+        <sqlalchemy.orm.query.Query object at 0x2ad3990>
+    """
+    options = []
+    # Comme dans `dump`, les relations ne sont pas exportées à la dernière
+    # profondeur.
+    if depth - 1 <= 0:
+        return options
+
+    for relation in model_plan(cls).relations:
+        if relation.key in excludes or \
+           (includes is not None and relation.key not in includes):
+            continue
+
+        attr = getattr(cls, relation.key)
+        if relation.kind == COLLECTION:
+            strategy = 'selectinload'
+        else:
+            strategy = 'joinedload'
+
+        if parent is None:
+            loader = getattr(orm, strategy)(attr)
+        else:
+            loader = getattr(parent, strategy)(attr)
+
+        options.append(loader)
+        # Les exclusions ne s'appliquent qu'au premier niveau de `dump`
+        options.extend(eager_options(relation.target, depth - 1,
+                                     parent=loader))
+
+    return options
+
+
+def column_options(cls, excludes=(), includes=None):
+    """
+    Returns the loader options which only load columns
+    :meth:`sqla_helpers.base_model.BaseModel.dump` exports with the same
+    `excludes` and `includes`: a `load_only` of included columns, or a
+    `defer` of each excluded column.
+
+    .. code-block:: python
+
+        >>> column_options(Treatment, includes=['id', 'name'])
+        [<sqlalchemy.orm.strategy_options._UnboundLoad object at 0x2ad3990>]
+    """
+    plan = model_plan(cls)
+    columns = [prop.key for prop in plan.columns]
+    if includes is not None:
+        # La clef primaire est toujours chargée
+        return [orm.load_only(*[key for key in columns
+                                if key in plan.primary_key or
+                                (key in includes and key not in excludes)])]
+    # La clef primaire, nécessaire à l'identité des objets, n'est jamais
+    # différée : elle n'est seulement pas exportée.
+    return [orm.defer(key) for key in columns
+            if key in excludes and key not in plan.primary_key]
+
+
+def dump_options(cls, depth, excludes=(), includes=None):
+    """
+    Returns the loader options of a query whose objects are dumped with
+    `depth`, `excludes` and `includes`: see :func:`eager_options` and
+    :func:`column_options`.
+    """
+    return column_options(cls, excludes, includes) + \
+            eager_options(cls, depth, excludes, includes=includes)
+
+
+def deferred_keys(instance):
+    """
+    Returns the names of column attributes of `instance` which are deferred
+    (`deferred()` in the mapping, or `defer()` / `load_only()` options of
+    the query which loaded it) and not loaded yet: reading them would query
+    the database. Other unloaded attributes (expired, never set ...) aren't
+    deferred.
+    """
+    state = instance._sa_instance_state
+    if state.key is None:
+        # Un objet qui n'est pas en base n'a rien à charger
+        return frozenset()
+    unloaded = state.unloaded - state.expired_attributes
+    if not unloaded:
+        return frozenset()
+
+    mapper = state.mapper
+    callables = state.callables or {}
+    res = []
+    for key in unloaded:
+        prop = mapper.get_property(key)
+        if not isinstance(prop, ColumnProperty):
+            continue
+        # Les options de la requête posent un chargeur par objet
+        if prop.deferred or \
+           isinstance(callables.get(key), strategies.LoadDeferredColumns):
+            res.append(key)
+    return frozenset(res)
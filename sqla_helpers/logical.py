@@ -11,20 +11,93 @@ Abstract Syntatic Tree
 .. autoclass:: OrASTNode
     :members:
 
+Trees are walked with an explicit stack, never with recursion: a tree can be
+deeper than the Python recursion limit.
+
+.. autofunction:: walk
+
+Optimization
+============
+
+.. autofunction:: optimize
+
+Serialization
+=============
+
+.. autofunction:: serialize
+
+.. autofunction:: deserialize
+
 Q Object
 ========
 .. autoclass:: Q
     :members:
 """
 
-from sqlalchemy import or_, and_, not_
-from sqla_helpers.process import process_params
+import datetime
+import decimal
+import json
+import zlib
+
+from sqlalchemy import or_, and_, not_, false
+from sqlalchemy.orm.properties import ColumnProperty
+from sqlalchemy.sql.expression import ClauseElement
+
+from sqla_helpers.process import process_params, lookup_cache
+from sqla_helpers.utils import freeze
+
+
+def _children(node):
+    """
+    Returns children evaluated for `node`: a leaf has none.
+    """
+    if node.operand:
+        return ()
+    return node.children
+
+
+def walk(node):
+    """
+    Iterates over nodes of the tree `node`, parents before their children and
+    children from left to right.
+    """
+    stack = [node]
+    while stack:
+        current = stack.pop()
+        yield current
+        stack.extend(reversed(_children(current)))
+
+
+def postorder(node, visit, children=_children):
+    """
+    Returns `visit(node, results)`, where `results` are the values returned by
+    `visit` for the children of `node` given by `children`.
+
+    Children are visited from left to right, before their parent.
+    """
+    stack = [(node, None)]
+    results = []
+    while stack:
+        current, current_children = stack.pop()
+        if current_children is None:
+            current_children = children(current)
+            stack.append((current, current_children))
+            stack.extend((child, None) for child in reversed(current_children))
+        else:
+            count = len(current_children)
+            if count:
+                args = results[-count:]
+                del results[-count:]
+            else:
+                args = []
+            results.append(visit(current, args))
+    return results[0]
 
 
 class ASTNode(object):
     """
     A tree's node represent a logic Sqlalchemy operator.
-    Contains 2 child tree of a set of criterion.
+    Contains child trees or a set of criterion.
 
 
     Handled criterions are describes in  :mod:`sqla_helpers`.
@@ -38,57 +111,84 @@ class ASTNode(object):
         <sqlalchemy.sql.expression.BinaryExpression object at 0x1f04090>
 
     If a node contains criterions, the node is a leaf. (meaning the :attr:`ASTNode.operand`
-    attribute is not `None`.)
+    attribute is not empty.)
 
-    If node contains children, a recursive processing of children subtrees is done.
+    If node contains children, processing of children subtrees is done first.
+    A node can have any number of children:
+
+        >>> ast = OrASTNode(AndASTNode(id=1), AndASTNode(id=2), AndASTNode(id=3))
 
     `ASTNode.operator` method is excecuted during the return of `process_param`
-    or during the recursive return of children.
+    or on the return of children.
 
     :class: `ASTNode` is an abstract class which doesn't implement :method: ASTNode.operator`.
     """
+    __slots__ = ('children', 'operand')
 
     def operator(self, *args, **kwargs):
         raise NotImplementedError()
 
 
-    def __init__(self, lhs=None, rhs=None, **operand):
-        self.lhs = lhs
-        self.rhs = rhs
+    def __init__(self, *children, **operand):
+        self.children = tuple(child for child in children if child is not None)
         self.operand = operand
 
 
+    @property
+    def lhs(self):
+        """
+        First child, `None` if the node has no child.
+        """
+        return self.children[0] if self.children else None
+
+
+    @property
+    def rhs(self):
+        """
+        Second child, `None` if the node has less than two children.
+        """
+        return self.children[1] if len(self.children) > 1 else None
+
+
+    def is_leaf(self):
+        """
+        True if the node holds criterions.
+        """
+        return bool(self.operand)
+
+
     def __call__(self, klass, class_found):
         """
         Process every node.
         """
-        # Si l'on a des paramètres bruts, c'est que l'on est une feuille de
-        # l'arbre
-        # On retourne alors le process des paramètres
-        if self.operand:
-            clauses = process_params(klass, class_found, **self.operand)
-        else:
-            # Sinon, nous avons des enfants et l'on retourne l'opération que l'on
-            # représente sur le retour des enfants.
-            clauses = []
-            if self.lhs:
-                clauses.append(self.lhs(klass, class_found))
-            if self.rhs:
-                clauses.append(self.rhs(klass, class_found))
+        def visit(node, clauses):
+            # Si l'on a des paramètres bruts, c'est que l'on est une feuille de
+            # l'arbre
+            # On retourne alors le process des paramètres
+            if node.operand:
+                clauses = process_params(klass, class_found, **node.operand)
+            # Sinon, nous avons des enfants et l'on retourne l'opération que
+            # l'on représente sur le retour des enfants.
+            return node.operator(*clauses)
 
-        return self.operator(*clauses)
+        return postorder(self, visit)
 
 
 class OrASTNode(ASTNode):
+    __slots__ = ()
 
     def operator(self, *args):
         """
         Excecut a logical or on `SQLAlchemy` criterions.
+        An or without criterion is false.
         """
+        if not args:
+            return false()
         return or_(*args)
 
 
 class AndASTNode(ASTNode):
+    __slots__ = ()
 
     def operator(self, *args):
         """
@@ -98,9 +198,10 @@ class AndASTNode(ASTNode):
 
 
 class NotASTNode(ASTNode):
+    __slots__ = ()
 
     def __init__(self, lhs=None, **operand):
-        super(NotASTNode, self).__init__(lhs, None, **operand)
+        super(NotASTNode, self).__init__(lhs, **operand)
 
 
     def operator(self, *args):
@@ -110,6 +211,337 @@ class NotASTNode(ASTNode):
         return not_(*args)
 
 
+def _leaf_key(node):
+    """
+    Returns a key identifying a leaf by its class and criterions, `None` if
+    criterions can't be hashed.
+    """
+    try:
+        return (node.__class__, freeze(node.operand))
+    except TypeError:
+        return None
+
+
+def _in_candidate(klass, node):
+    """
+    If `node` is a leaf with a single equality or `in` criterion on a column,
+    returns a (path, values) couple, where `path` is the criterion key without
+    operator. Returns `None` otherwise.
+    """
+    if node.__class__ is not AndASTNode or len(node.operand) != 1:
+        return None
+
+    key, value = node.operand.items()[0]
+    if value is None or isinstance(value, ClauseElement) or \
+       hasattr(value, '__clause_element__'):
+        return None
+
+    try:
+        plan = lookup_cache.get(klass, key)
+    except AttributeError:
+        # L'erreur sera levée à l'évaluation
+        return None
+    if not isinstance(getattr(plan.attribute, 'property', None),
+                      ColumnProperty):
+        return None
+
+    if plan.operator == '__eq__':
+        return key, [value]
+    if plan.operator == 'in_' and isinstance(value, (list, tuple)):
+        return key[:-len('__in')], list(value)
+    return None
+
+
+def _merge_equalities(klass, children):
+    """
+    Merges children of an OR which are equalities (or `in`) on the same
+    attribute into a single `in` criterion.
+    """
+    groups = {}
+    for index, child in enumerate(children):
+        candidate = _in_candidate(klass, child)
+        if candidate is not None:
+            groups.setdefault(candidate[0], []).append((index, candidate[1]))
+
+    merged = {}
+    dropped = set()
+    for path, members in groups.iteritems():
+        if len(members) < 2:
+            continue
+        values = []
+        seen = set()
+        for _, member_values in members:
+            for value in member_values:
+                try:
+                    if value in seen:
+                        continue
+                    seen.add(value)
+                except TypeError:
+                    pass
+                values.append(value)
+        merged[members[0][0]] = AndASTNode(**{path + '__in': values})
+        dropped.update(index for index, _ in members[1:])
+
+    if not merged:
+        return children
+    return [merged.get(index, child) for index, child in enumerate(children)
+            if index not in dropped]
+
+
+def _operands(node):
+    """
+    Returns children of `node`, children of nested nodes of the same type
+    being lifted in their parent: (a | b) | c gives [a, b, c].
+    """
+    if node.operand or isinstance(node, NotASTNode):
+        return _children(node)
+
+    node_class = node.__class__
+    res = []
+    stack = list(reversed(node.children))
+    while stack:
+        child = stack.pop()
+        if child.__class__ is node_class and not child.operand:
+            stack.extend(reversed(child.children))
+        else:
+            res.append(child)
+    return res
+
+
+def _rewrite(klass, node, children):
+    """
+    Returns the optimized version of `node`, whose children are already
+    optimized.
+    """
+    if node.operand or not node.children:
+        return node
+
+    if isinstance(node, NotASTNode):
+        child = children[0]
+        # ~~q == q
+        if isinstance(child, NotASTNode) and not child.operand and \
+           len(child.children) == 1:
+            return child.children[0]
+        return NotASTNode(child)
+
+    node_class = node.__class__
+    flat = []
+    for child in children:
+        # Un enfant optimisé peut être devenu du même type que son parent
+        if child.__class__ is node_class and not child.operand:
+            flat.extend(child.children)
+        else:
+            flat.append(child)
+
+    # a | a == a, a & a == a
+    res = []
+    seen = set()
+    for child in flat:
+        key = _leaf_key(child) if child.operand else id(child)
+        if key is not None:
+            if key in seen:
+                continue
+            seen.add(key)
+        res.append(child)
+
+    # a == 1 | a == 2 == a IN (1, 2)
+    if node_class is OrASTNode:
+        res = _merge_equalities(klass, res)
+
+    if len(res) == 1:
+        return res[0]
+    return node_class(*res)
+
+
+def optimize(node, klass):
+    """
+    Returns an optimized tree equivalent to `node`, for queries on `klass`:
+
+    * nested nodes of the same type are flattened in a single n-ary node,
+    * duplicate leaves of a node are removed,
+    * double negations are removed,
+    * an OR of equalities on the same attribute becomes an `in`.
+
+    .. code-block:: python
+
+        >>> ast = optimize((Q(id=1) | Q(id=2) | Q(name='foo')).ast, Treatment)
+        >>> [child.operand for child in ast.children]
+        [{'id__in': [1, 2]}, {'name': 'foo'}]
+
+    Original tree isn't modified. Cost is linear in the number of nodes.
+    """
+    return postorder(node,
+                      lambda current, children: _rewrite(klass, current,
+                                                         children),
+                      children=_operands)
+
+
+def _dumps(value):
+    return json.dumps(value, sort_keys=True, separators=(',', ':'))
+
+
+_SYMBOLS = {AndASTNode: '&', OrASTNode: '|', NotASTNode: '~'}
+_NODES = dict((symbol, node_class)
+              for node_class, symbol in _SYMBOLS.iteritems())
+
+
+def _encode_value(value):
+    """
+    Returns the JSON form of a criterion value. Types JSON doesn't know are
+    tagged: `{"$decimal": "1.5"}`.
+    """
+    if isinstance(value, str):
+        # JSON lit les chaînes d'octets en UTF-8
+        try:
+            value.decode('utf-8')
+        except UnicodeDecodeError:
+            raise TypeError("{0!r} isn't an UTF-8 string".format(value))
+        return value
+    if value is None or isinstance(value, (bool, int, long, float, unicode)):
+        return value
+    if isinstance(value, (list, tuple)):
+        return [_encode_value(v) for v in value]
+    if isinstance(value, (set, frozenset)):
+        # Un ensemble n'a pas d'ordre, on en fixe un
+        return sorted((_encode_value(v) for v in value), key=_dumps)
+    if isinstance(value, decimal.Decimal):
+        return {'$decimal': str(value)}
+    if isinstance(value, datetime.datetime) and value.tzinfo is None:
+        return {'$datetime': value.isoformat()}
+    if isinstance(value, datetime.date) and \
+       not isinstance(value, datetime.datetime):
+        return {'$date': value.isoformat()}
+    raise TypeError("{0!r} can't be serialized".format(value))
+
+
+def _decode_object(dictionary):
+    """
+    Rebuilds values tagged by :func:`_encode_value`.
+    """
+    if len(dictionary) != 1:
+        return dictionary
+    tag, value = dictionary.items()[0]
+    if tag == '$decimal':
+        return decimal.Decimal(value)
+    if tag == '$datetime':
+        fmt = '%Y-%m-%dT%H:%M:%S.%f' if '.' in value else '%Y-%m-%dT%H:%M:%S'
+        return datetime.datetime.strptime(value, fmt)
+    if tag == '$date':
+        return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+    return dictionary
+
+
+def _leaf_text(symbol, operand):
+    return _dumps([symbol, dict((key, _encode_value(value))
+                                for key, value in operand.iteritems())])
+
+
+def _canonical_operands(node):
+    """
+    Children of `node` in the canonical form: nested nodes of the same type
+    are lifted, as well as criterions of a leaf in an AND.
+    """
+    if node.operand or isinstance(node, NotASTNode):
+        return _children(node)
+
+    node_class = node.__class__
+    res = []
+    stack = list(reversed(node.children))
+    while stack:
+        child = stack.pop()
+        if child.__class__ is node_class and not child.operand:
+            stack.extend(reversed(child.children))
+        elif node_class is AndASTNode and child.__class__ is AndASTNode \
+             and len(child.operand) > 1:
+            # a=1, b=2 est équivalent à a=1 & b=2
+            res.extend(AndASTNode(**{key: value})
+                       for key, value in sorted(child.operand.iteritems()))
+        else:
+            res.append(child)
+    return res
+
+
+def serialize(node):
+    """
+    Returns the canonical JSON form of the tree `node`.
+
+    The form doesn't depend on how the tree was written: children of AND and
+    OR nodes are sorted and deduplicated, nested nodes of the same type are
+    flattened, and criterions of a leaf are split in an AND.
+
+    .. code-block:: python
+
+        >>> serialize((Q(name=u'a') | Q(id__in=[1, 2])).ast)
+        '["|",[["&",{"id__in":[1,2]}],["&",{"name":"a"}]]]'
+        >>> serialize((Q(id__in=[1, 2]) | Q(name=u'a')).ast)
+        '["|",[["&",{"id__in":[1,2]}],["&",{"name":"a"}]]]'
+
+    Values may be `None`, booleans, numbers, strings, decimals, dates, naive
+    datetimes and lists or sets of them. Other values (mapped objects, SQL
+    expressions ...) raise a `TypeError`.
+    """
+    def visit(current, texts):
+        try:
+            symbol = _SYMBOLS[current.__class__]
+        except KeyError:
+            raise TypeError("{0!r} can't be serialized".format(current))
+
+        if current.operand:
+            if symbol != '&' or len(current.operand) == 1:
+                return _leaf_text(symbol, current.operand)
+            texts = [_leaf_text(symbol, {key: value})
+                     for key, value in current.operand.iteritems()]
+
+        if symbol != '~':
+            texts = sorted(set(texts))
+            if len(texts) == 1:
+                return texts[0]
+        return '["{0}",[{1}]]'.format(symbol, ','.join(texts))
+
+    return postorder(node, visit, children=_canonical_operands)
+
+
+def deserialize(data):
+    """
+    Returns the tree of a form returned by :func:`serialize`, compressed or
+    not. Raises a `ValueError` if `data` isn't a serialized tree.
+    """
+    try:
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        if not data.startswith('['):
+            data = zlib.decompress(data)
+        tree = json.loads(data, object_hook=_decode_object)
+
+        def children(item):
+            symbol, body = item
+            if isinstance(body, list):
+                return body
+            return ()
+
+        def visit(item, nodes):
+            symbol, body = item
+            node_class = _NODES[symbol]
+            if isinstance(body, dict):
+                return node_class(**dict((str(key), value)
+                                         for key, value in body.iteritems()))
+            if node_class is NotASTNode and len(nodes) != 1:
+                raise ValueError()
+            return node_class(*nodes)
+
+        return postorder(tree, visit, children=children)
+    except (TypeError, ValueError, KeyError, zlib.error):
+        raise ValueError('Invalid serialized Q object')
+
+
+def _ast(operand):
+    """
+    Returns the AST of a :class:`Q` object or of a dictionary of criterions.
+    """
+    if isinstance(operand, Q):
+        return operand.ast
+    return AndASTNode(**operand)
+
 
 class Q(object):
     """
@@ -125,20 +557,127 @@ class Q(object):
     The :method: `__call__` from :class:`Q` call the :method:`__call__`
     from AST children. The return is an `SQLAlchemy` opertation usable in
     a `Query` object.
+
+    Before processing, the AST is optimized (see :func:`optimize`).
+
+    To combine many criterions, :meth:`Q.any_of` and :meth:`Q.all_of` build a
+    single node instead of a chain of operations:
+
+        >>> Q.any_of(Q(name=name) for name in names)
+        >>> Q.all_of([{'id__gt': 4}, {'status__name': u'ok'}])
+
+    :class:`Q` objects are compared and hashed on their canonical form (see
+    :func:`serialize`), so equivalent objects are equal whatever the order of
+    their operands:
+
+        >>> Q(id=1) | Q(name=u'a') == Q(name=u'a') | Q(id=1)
+        True
+
+    An object holding values which can't be serialized is only equal to
+    itself.
     """
+    __slots__ = ('ast', '_optimized', '_serialized')
 
     def __init__(self, astnode=None, **kwargs):
         if astnode:
             self.ast = astnode
         else:
             self.ast = AndASTNode(**kwargs)
+        self._optimized = None
+        self._serialized = None
+
+
+    @classmethod
+    def any_of(cls, operands):
+        """
+        Returns a :class:`Q` object true when one of `operands` is true.
+        `operands` are :class:`Q` objects or dictionaries of criterions.
+
+        Without operand, the object is always false.
+        """
+        return cls(OrASTNode(*[_ast(operand) for operand in operands]))
+
+
+    @classmethod
+    def all_of(cls, operands):
+        """
+        Returns a :class:`Q` object true when all `operands` are true.
+        `operands` are :class:`Q` objects or dictionaries of criterions.
+
+        Without operand, the object is always true.
+        """
+        return cls(AndASTNode(*[_ast(operand) for operand in operands]))
+
+
+    @classmethod
+    def from_serialized(cls, data):
+        """
+        Returns the :class:`Q` object serialized in `data` by
+        :meth:`Q.serialize`.
+        """
+        return cls(deserialize(data))
+
+
+    def serialize(self, binary=False):
+        """
+        Returns the canonical JSON form of the object, compressed with zlib if
+        `binary` is True.
+        """
+        if self._serialized is None:
+            self._serialized = serialize(self.ast)
+        if binary:
+            return zlib.compress(self._serialized, 9)
+        return self._serialized
+
+
+    def _canonical(self):
+        """
+        Returns the canonical form, `None` if the object can't be serialized.
+        """
+        try:
+            return self.serialize()
+        except (TypeError, ValueError):
+            return None
+
+
+    def __eq__(self, other):
+        if not isinstance(other, Q):
+            return NotImplemented
+        if self is other:
+            return True
+        canonical = self._canonical()
+        return canonical is not None and canonical == other._canonical()
+
+
+    def __ne__(self, other):
+        res = self.__eq__(other)
+        if res is NotImplemented:
+            return res
+        return not res
+
+
+    def __hash__(self):
+        canonical = self._canonical()
+        if canonical is None:
+            return object.__hash__(self)
+        return hash(canonical)
+
+
+    def optimized(self, klass):
+        """
+        Returns the optimized AST for queries on `klass`.
+        Optimization is done once per class.
+        """
+        if self._optimized is None or self._optimized[0] is not klass:
+            self._optimized = (klass, optimize(self.ast, klass))
+        return self._optimized[1]
 
 
     def __call__(self, klass, class_found):
         """
         Processing and interpreting AST of current `Q` object.
         """
-        return self.ast(klass, class_found)
+        return self.optimized(klass)(klass, class_found)
 
 
     def __or__(self, q):
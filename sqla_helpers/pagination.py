@@ -0,0 +1,219 @@
+#-*- coding: utf-8 -*-
+"""
+Keyset pagination
+=================
+
+Pages are read with a seek on the ordering columns (`WHERE (key) > (last
+key)`), not with an `OFFSET`. Reading a page costs the same whatever its
+depth, as long as ordering columns are indexed.
+
+The position after a page is given to clients as an opaque cursor.
+
+.. autoclass:: Page
+    :members:
+
+.. autoclass:: InvalidCursor
+"""
+import base64
+import datetime
+import decimal
+import json
+
+from sqlalchemy import and_, case, false, or_, tuple_
+
+from sqla_helpers import loading
+from sqla_helpers.encoding import encode_value
+
+
+class InvalidCursor(ValueError):
+    """
+    Exception raised when a pagination cursor can't be decoded.
+    """
+    def __unicode__(self):
+        return u'Invalid pagination cursor.'
+
+    def __str__(self):
+        return 'Invalid pagination cursor'
+
+
+class Page(object):
+    """
+    A page of objects.
+
+    * `items`: list of objects of the page,
+    * `next`: cursor of the following page, `None` on the last page,
+    * `per_page`: maximum number of objects in a page.
+
+    A page can be iterated as its items list.
+    """
+
+    def __init__(self, items, next, per_page):
+        self.items = items
+        self.next = next
+        self.per_page = per_page
+
+
+    def __iter__(self):
+        return iter(self.items)
+
+
+    def __len__(self):
+        return len(self.items)
+
+
+    @property
+    def has_next(self):
+        """
+        True if a page follows this one.
+        """
+        return self.next is not None
+
+
+def ordering(cls, order_by=None):
+    """
+    Returns a list of (attribute name, descending) couples from `order_by`.
+
+    `order_by` is an attribute name or a list of them. A name prefixed by `-`
+    means a descending order. Primary key attributes are appended when missing,
+    so ordering is always unique. Without `order_by`, the primary key is used.
+    """
+    if order_by is None:
+        order_by = []
+    elif isinstance(order_by, basestring):
+        order_by = [order_by]
+
+    res = []
+    for name in order_by:
+        if name.startswith('-'):
+            res.append((name[1:], True))
+        else:
+            res.append((name, False))
+
+    names = set(name for name, _ in res)
+    # Le sens de la clef primaire suit celui de la dernière colonne demandée
+    desc = res[-1][1] if res else False
+    for name in loading.model_plan(cls).primary_key:
+        if name not in names:
+            res.append((name, desc))
+    return res
+
+
+def _nullable(attr):
+    """
+    True if the column of attribute `attr` accepts `NULL`.
+    """
+    return any(column.nullable for column in attr.property.columns)
+
+
+def order_clauses(cls, order):
+    """
+    Returns `ORDER BY` clauses of `order`, as returned by :func:`ordering`.
+
+    Whatever the database, `NULL` values of a nullable column come after
+    other values in ascending order, before them in descending order.
+    """
+    clauses = []
+    for name, desc in order:
+        attr = getattr(cls, name)
+        if _nullable(attr):
+            # Les bases ne placent pas toutes les NULL au même endroit, ni
+            # ne connaissent toutes NULLS FIRST / NULLS LAST.
+            is_null = case([(attr.is_(None), 1)], else_=0)
+            clauses.append(is_null.desc() if desc else is_null.asc())
+        clauses.append(attr.desc() if desc else attr.asc())
+    return clauses
+
+
+def _after(attr, desc, value, nullable):
+    """
+    Returns the criterion selecting values of `attr` strictly after `value`,
+    in the order of :func:`order_clauses`.
+    """
+    if not nullable:
+        return attr < value if desc else attr > value
+    if value is None:
+        # Les NULL sont en fin d'ordre croissant, en tête d'ordre décroissant
+        return attr.isnot(None) if desc else false()
+    if desc:
+        return attr < value
+    return or_(attr > value, attr.is_(None))
+
+
+def seek_clause(cls, order, values):
+    """
+    Returns the criterion selecting rows after `values` for `order`.
+    """
+    attributes = [getattr(cls, name) for name, _ in order]
+    nullables = [_nullable(attr) for attr in attributes]
+    directions = set(desc for _, desc in order)
+
+    if len(attributes) == 1:
+        attr, (_, desc) = attributes[0], order[0]
+        return _after(attr, desc, values[0], nullables[0])
+
+    if len(directions) == 1 and not any(nullables):
+        # Même sens pour toutes les colonnes : une comparaison de tuples,
+        # que les bases savent résoudre avec l'index.
+        if directions.pop():
+            return tuple_(*attributes) < tuple_(*values)
+        return tuple_(*attributes) > tuple_(*values)
+
+    # Sens mélangés ou valeurs NULL :
+    # (a > x) OR (a = x AND b < y) OR (a = x AND b = y AND c > z) ...
+    # `a == None` est rendu en `a IS NULL`.
+    clauses = []
+    for index, (attr, (_, desc)) in enumerate(zip(attributes, order)):
+        equalities = [attributes[i] == values[i] for i in xrange(index)]
+        seek = _after(attr, desc, values[index], nullables[index])
+        clauses.append(and_(*(equalities + [seek])))
+    return or_(*clauses)
+
+
+def encode_cursor(instance, order):
+    """
+    Returns the cursor pointing after `instance`.
+    """
+    values = [encode_value(getattr(instance, name)) for name, _ in order]
+    payload = '[{0}]'.format(','.join(values))
+    return base64.urlsafe_b64encode(payload).rstrip('=')
+
+
+def _decode_value(column_type, value):
+    """
+    Rebuilds a value from its JSON form, for types encoded as strings.
+    """
+    try:
+        python_type = column_type.python_type
+    except NotImplementedError:
+        return value
+
+    if value is None or isinstance(value, python_type):
+        return value
+    if python_type is datetime.datetime:
+        fmt = '%Y-%m-%dT%H:%M:%S.%f' if '.' in value else '%Y-%m-%dT%H:%M:%S'
+        return datetime.datetime.strptime(value, fmt)
+    if python_type is datetime.date:
+        return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+    if python_type is decimal.Decimal:
+        return decimal.Decimal(str(value))
+    if python_type is float:
+        return float(value)
+    return value
+
+
+def decode_cursor(cls, cursor, order):
+    """
+    Returns values of ordering attributes stored in `cursor`.
+
+    Raises :exc:`InvalidCursor` if the cursor doesn't match `order`.
+    """
+    try:
+        cursor = str(cursor)
+        payload = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(payload, parse_float=decimal.Decimal)
+        if not isinstance(values, list) or len(values) != len(order):
+            raise ValueError()
+        return [_decode_value(getattr(cls, name).type, value)
+                for (name, _), value in zip(order, values)]
+    except (TypeError, ValueError, UnicodeEncodeError):
+        raise InvalidCursor()
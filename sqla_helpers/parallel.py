@@ -0,0 +1,142 @@
+#-*- coding: utf-8 -*-
+"""
+Parallel export
+===============
+
+:meth:`sqla_helpers.base_model.BaseModel.parallel_dump` splits objects to
+dump in ranges of primary key, dumped by a pool of processes.
+
+A range is sent to a worker as a task holding the class (pickled by
+reference), the engine URL, serialized :class:`sqla_helpers.logical.Q`
+operators, criterions and bounds of the range. The worker builds its own
+engine once, and dumps the range in a session used by the class through
+:meth:`sqla_helpers.base_model.BaseModel.using`.
+
+.. autofunction:: ranges
+
+.. autofunction:: dump
+"""
+import multiprocessing
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from sqla_helpers.logical import Q
+
+RANGES_PER_WORKER = 4
+"""
+Number of ranges per worker, so a slow range doesn't keep other workers
+idle.
+"""
+
+# Moteurs des processus de travail, par URL
+_engines = {}
+
+
+def ranges(pks, count):
+    """
+    Returns at most `count` (first, last) couples splitting the ordered list
+    `pks` in ranges of the same size.
+
+    .. code-block:: python
+
+        >>> ranges([1, 2, 3, 5, 8, 13, 21], 3)
+        [(1, 3), (5, 13), (21, 21)]
+    """
+    if not pks:
+        return []
+    size = -(-len(pks) // count)
+    return [(pks[start], pks[min(start + size, len(pks)) - 1])
+            for start in xrange(0, len(pks), size)]
+
+
+def _engine(url):
+    try:
+        return _engines[str(url)]
+    except KeyError:
+        engine = _engines[str(url)] = create_engine(url)
+        return engine
+
+
+def _range_query(cls, operators, criterions, bounds=None):
+    """
+    Returns the query of objects matching criterions, ordered by primary key
+    and limited to the range `bounds`.
+    """
+    primary_key = cls.__mapper__.primary_key
+    query = cls.search(*operators, **criterions).order_by(*primary_key)
+    if bounds is not None:
+        first, last = bounds
+        query = query.filter(primary_key[0] >= first,
+                             primary_key[0] <= last)
+    return query
+
+
+def _dump_range(task):
+    """
+    Dumps a range of objects in a worker process.
+    """
+    cls, url, operators, criterions, bounds, depth, excludes, chunk_size, \
+            includes = task
+    session = sessionmaker(bind=_engine(url))()
+    try:
+        with cls.using(session):
+            operators = [Q.from_serialized(operator) for operator in operators]
+            query = _range_query(cls, operators, criterions, bounds)
+            return list(cls._iter_dump_query(query, depth, excludes,
+                                             chunk_size, includes))
+    finally:
+        session.close()
+
+
+def dump(cls, operators, criterions, workers=None, depth=2, excludes=(),
+         chunk_size=1000, includes=None):
+    """
+    Generator of dumped objects of `cls` matching `operators` and
+    `criterions`, ordered by primary key, dumped by `workers` processes.
+
+    Objects are dumped in the current process with a single worker, or when
+    the class has a composite primary key.
+    """
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    primary_key = cls.__mapper__.primary_key
+
+    if workers <= 1 or len(primary_key) != 1:
+        query = _range_query(cls, operators, criterions)
+        for dumped in cls._iter_dump_query(query, depth, excludes,
+                                           chunk_size, includes):
+            yield dumped
+        return
+
+    for operator in operators:
+        if not isinstance(operator, Q):
+            raise ValueError('Operators sent to workers must be Q objects')
+    serialized = [operator.serialize(binary=True) for operator in operators]
+
+    session = cls.session
+    url = session.get_bind(mapper=cls.__mapper__).url
+    if url.get_backend_name() == 'sqlite' and \
+       url.database in (None, '', ':memory:'):
+        raise ValueError("Workers can't read an in-memory SQLite database")
+
+    pks = [pk for pk, in cls.search(*operators, **criterions)
+                            .with_entities(primary_key[0])
+                            .distinct()
+                            .order_by(primary_key[0])]
+    tasks = [(cls, url, serialized, criterions, bounds, depth, excludes,
+              chunk_size, includes)
+             for bounds in ranges(pks, workers * RANGES_PER_WORKER)]
+    if not tasks:
+        return
+
+    pool = multiprocessing.Pool(min(workers, len(tasks)))
+    try:
+        # `imap` rend les résultats dans l'ordre des tâches
+        for dumped_range in pool.imap(_dump_range, tasks):
+            for dumped in dumped_range:
+                yield dumped
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
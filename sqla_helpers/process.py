@@ -1,4 +1,27 @@
 # -*- coding: utf-8 -*-
+"""
+Criterions processing
+=====================
+
+.. autofunction:: process_params
+
+.. autofunction:: process_path
+
+Lookup plans
+============
+
+.. autoclass:: LookupPlan
+    :members:
+.. autoclass:: LookupCache
+    :members:
+"""
+import threading
+from collections import OrderedDict
+
+from sqlalchemy import event
+from sqlalchemy.orm import Mapper
+from sqlalchemy.orm.properties import ColumnProperty
+
 operators = {
     'not': '__ne__',
     'lt': '__lt__',
@@ -15,6 +38,167 @@ Keys are operators in :mod:`sqla_helpers` syntax and values are methods name
 called by an InstrumentAttribut object.
 """
 
+
+class LookupPlan(object):
+    """
+    Compiled form of a criterion key in :mod:`sqla_helpers` syntax.
+
+    A plan keeps everything which only depends on the key and the queried
+    class: the classes crossed through relations (to be joined), the
+    targeted `InstrumentedAttribute`, the operator name and the bound
+    comparator method.
+
+    .. code-block:: python
+
+        >>> plan = LookupPlan.compile(Treatment, 'status__name__like')
+        >>> plan.classes
+        (Status,)
+        >>> plan.operator
+        'like'
+    """
+    __slots__ = ('key', 'classes', 'attribute', 'operator', 'comparator')
+
+    def __init__(self, key, classes, attribute, operator):
+        self.key = key
+        self.classes = classes
+        self.attribute = attribute
+        self.operator = operator
+        self.comparator = getattr(attribute, operator)
+
+
+    @classmethod
+    def compile(cls, klass, key):
+        """
+        Build the plan of `key` from `klass`.
+
+        Raises an `AttributeError` if an attribute isn't found on the path.
+        """
+        # Si il y a des __ dans le paramètre, on souhaite
+        # faire une recherche sur un attribut d'une relation
+        params = key.split('__')
+        # Le dernier élément peut être un opérateur
+        if params[-1] in operators:
+            operator = operators[params.pop()]
+        else:
+            operator = '__eq__'
+        # On récupère le nom de l'attribut de comparaison
+        # qui est systèmatiquement en dernier
+        comparator_attr_name = params.pop()
+        # La boucle permet de récupérer l'attribut dans la classe la plus
+        # loin dans les relations.
+        # Exemple = [parameter, task, id_task]
+        # comparator_attr_name = "id_task"
+        # cls.(classe de l'attribut "parameter").(classe de l'attribut
+        # "task").id_task)
+        classes = []
+        for param in params:
+            klass = getattr(klass, param).property.mapper.class_
+            classes.append(klass)
+
+        return cls(key, tuple(classes), getattr(klass, comparator_attr_name),
+                   operator)
+
+
+    def __call__(self, value, class_found):
+        """
+        Returns the `SQLAlchemy` criterion comparing the attribute with `value`.
+        Classes to join are added in `class_found`.
+        """
+        for klass in self.classes:
+            if klass not in class_found:
+                class_found.append(klass)
+        return self.comparator(value)
+
+
+class LookupCache(object):
+    """
+    Bounded LRU cache of :class:`LookupPlan` objects, indexed by the queried
+    class and the criterion key.
+
+    The cache is emptied each time `SQLAlchemy` (re)configures mappers, because
+    new relations or attributes may change the resolution of a key.
+
+    `hits` and `misses` counters are available to check the cache efficiency.
+
+    .. code-block:: python
+
+        >>> lookup_cache.info()
+        {'hits': 1022, 'misses': 6, 'size': 6, 'maxsize': 1024}
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._plans = OrderedDict()
+        self._lock = threading.Lock()
+
+
+    def get(self, klass, key):
+        """
+        Returns the plan of `key` for `klass`, compiling it if needed.
+        """
+        cache_key = (klass, key)
+        with self._lock:
+            plan = self._plans.pop(cache_key, None)
+            if plan is not None:
+                # Remise en fin de liste : c'est le plus récemment utilisé
+                self._plans[cache_key] = plan
+                self.hits += 1
+                return plan
+            self.misses += 1
+
+        # La compilation se fait hors du verrou, elle peut lever une
+        # AttributeError que l'on laisse remonter.
+        plan = LookupPlan.compile(klass, key)
+        with self._lock:
+            self._plans[cache_key] = plan
+            while len(self._plans) > self.maxsize:
+                self._plans.popitem(last=False)
+        return plan
+
+
+    def clear(self):
+        """
+        Drops every compiled plan. Counters are kept.
+        """
+        with self._lock:
+            self._plans.clear()
+
+
+    def reset_stats(self):
+        """
+        Sets `hits` and `misses` counters to zero.
+        """
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+
+    def info(self):
+        """
+        Returns a dictionary with counters and size of the cache.
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._plans),
+            'maxsize': self.maxsize,
+        }
+
+
+    def __len__(self):
+        return len(self._plans)
+
+
+lookup_cache = LookupCache()
+"""
+Global :class:`LookupCache` used by :func:`process_params`.
+"""
+
+event.listen(Mapper, 'after_configured', lookup_cache.clear)
+
+
 def process_params(cls, class_found, **kwargs):
     """
     Returns a `SQLAlchemy` criterions list matching :mod:`sqla_helpers` syntax.
@@ -50,37 +234,43 @@ def process_params(cls, class_found, **kwargs):
         >>> class_found
         [Status]
 
+    Keys are compiled once in :class:`LookupPlan` objects kept in
+    :data:`lookup_cache`, so a same key isn't parsed twice.
+
     """
     criterion = []
     for k, v in kwargs.iteritems():
-        # Si il y a des __ dans le paramètre, on souhaite
-        # faire une recherche sur un attribut d'une relation
-        params = k.split('__')
-        # Le dernier élément peut être un opérateur
-        if params[-1] in operators.keys():
-            op = params.pop()
-            operator = operators[op]
-        else:
-            operator = '__eq__'
-        # On récupère le nom de l'attribut de comparaison
-        # qui est systèmatiquement en dernier
-        comparator_attr_name = params.pop()
-        # On garde la classe à partir de laquelle on récupère l'attribut
-        # courant.
-        klass = cls
-        # La boucle permet de récupérer l'attribut dans la classe la plus
-        # loin dans les relations.
-        # Exemple = [parameter, task, id_task]
-        # comparator_attr_name = "id_task"
-        # cls.(classe de l'attribut "parameter").(classe de l'attribut
-        # "task").id_task)
-        for param in params:
-            klass = getattr(klass, param).property.mapper.class_
-            if klass not in class_found:
-                class_found.append(klass)
-
-        instrumented_attr = getattr(klass, comparator_attr_name)
-        comparator = getattr(instrumented_attr, operator)
-        criterion.append(comparator(v))
+        plan = lookup_cache.get(cls, k)
+        criterion.append(plan(v, class_found))
 
     return criterion
+
+
+def process_path(cls, class_found, path):
+    """
+    Returns the column attribute targeted by `path`, an attribute name in
+    :mod:`sqla_helpers` syntax without operator. Classes crossed through
+    relations are added in :param:`class_found`, as :func:`process_params`
+    does.
+
+    .. code-block:: python
+
+        >>> class_found = []
+        >>> process_path(Treatment, class_found, 'status__name')
+        <sqlalchemy.orm.attributes.InstrumentedAttribute object at 0x22bd3d0>
+        >>> class_found
+        [Status]
+
+    Raises an `AttributeError` if an attribute isn't found on the path or
+    isn't a column.
+    """
+    if path.split('__')[-1] in operators:
+        raise AttributeError('{0} is an operator, not an attribute'.format(path))
+    plan = lookup_cache.get(cls, path)
+    if not isinstance(getattr(plan.attribute, 'property', None),
+                      ColumnProperty):
+        raise AttributeError('{0} is not a column'.format(path))
+    for klass in plan.classes:
+        if klass not in class_found:
+            class_found.append(klass)
+    return plan.attribute
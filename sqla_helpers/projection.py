@@ -0,0 +1,89 @@
+#-*- coding: utf-8 -*-
+"""
+Projection
+==========
+
+:meth:`sqla_helpers.base_model.BaseModel.values` and
+:meth:`sqla_helpers.base_model.BaseModel.filter` with `fields` select only
+the given attributes, instead of whole objects. The `Query` selects
+columns only: no object is built nor added to the session's identity map,
+and pending changes are flushed first as for any query.
+
+Fields are given in :mod:`sqla_helpers` syntax (`status__name`). Relations
+crossed by criterions are joined as usual, relations only crossed by fields
+are joined with a `LEFT OUTER JOIN`, so objects without related object are
+still read (with `None` values).
+
+Rows are :func:`record_class` records: tuples with an attribute per field.
+The classes of the last :data:`RECORDS_MAXSIZE` tuples of fields are kept.
+
+.. code-block:: python
+
+    >>> rows = Treatment.values(fields=['id', 'status__name'], id__lt=3)
+    >>> rows
+    [Record(id=1, status__name=u'ok'), Record(id=2, status__name=u'ok')]
+    >>> rows[0].status__name
+    u'ok'
+
+.. autofunction:: record_class
+
+.. autofunction:: values
+"""
+import threading
+from collections import namedtuple, OrderedDict
+
+from sqla_helpers import loading
+
+RECORDS_MAXSIZE = 256
+
+# Classes de lignes, par tuple de champs, la plus récemment utilisée en fin
+_records = OrderedDict()
+_lock = threading.Lock()
+
+
+def record_class(fields):
+    """
+    Returns the class of rows with `fields`, a `namedtuple`: rows are
+    tuples, without instance dictionary.
+    """
+    fields = tuple(fields)
+    with _lock:
+        record = _records.pop(fields, None)
+        if record is None:
+            record = namedtuple('Record', fields)
+        _records[fields] = record
+        while len(_records) > RECORDS_MAXSIZE:
+            _records.popitem(last=False)
+    return record
+
+
+def values(cls, operators, criterions, fields=None, named=True):
+    """
+    Returns rows of `fields` of objects of `cls` matching `operators` and
+    `criterions`. Without `fields`, column attributes of `cls` are read.
+
+    Rows are :func:`record_class` records, or plain tuples if `named` is
+    `False`.
+    """
+    if fields is None:
+        fields = [column.key for column in loading.model_plan(cls).columns]
+    else:
+        fields = list(fields)
+    if not fields:
+        raise ValueError('No field to read')
+
+    joined_class, clauses = cls._criteria(operators, criterions)
+    # Les classes ajoutées par les champs seulement sont jointes à gauche
+    fields_class = list(joined_class)
+    columns = [cls.process_path(fields_class, path).label(path)
+               for path in fields]
+
+    session = cls.session
+    query = session.query(*columns).select_from(cls).join(*joined_class)
+    query = query.outerjoin(*fields_class[len(joined_class):])
+    query = query.filter(*clauses)
+    # La `Query` ne charge que des colonnes : aucun objet n'est construit
+    if not named:
+        return [tuple(row) for row in query]
+    record = record_class(fields)
+    return [record._make(row) for row in query]
@@ -0,0 +1,169 @@
+#-*- coding: utf-8 -*-
+"""
+Session scopes
+==============
+
+By default, :attr:`sqla_helpers.base_model.BaseModel.session` calls the
+registered session maker on each access. With a session factory, each
+operation then works in a new session, with its own connection and identity
+map.
+
+To keep one session per thread, register a `scoped_session`, and remove
+its session at the end of each request. `scopefunc` keeps a session per
+other kind of scope (greenlet ...):
+
+.. code-block:: python
+
+    >>> registry = scoped_session(sessionmaker(bind=engine))
+    >>> BaseModel.register_sessionmaker(registry)
+    >>> Treatment.session is Treatment.session
+    True
+    >>> registry.remove()  # End of request: closes the thread's session
+
+A block of code can also share a session with
+:meth:`sqla_helpers.base_model.BaseModel.using`. The scope counts connection
+checkouts and statements run by its session:
+
+.. code-block:: python
+
+    >>> with BaseModel.using(session) as scope:
+    ...     treatment = Treatment.get(id=1)
+    ...     Status.count()
+    >>> scope.info()
+    {'checkouts': 1, 'queries': 2}
+
+.. autoclass:: Scope
+    :members:
+"""
+import threading
+from contextlib import contextmanager
+
+from sqlalchemy import event, exc, orm
+from sqlalchemy.orm import Session
+
+from sqla_helpers.utils import call_if_callable
+
+_local = threading.local()
+
+
+class Scope(object):
+    """
+    A session shared by the models during a `with` block.
+
+    * `model`: class the scope applies to, with its subclasses,
+    * `session`: the shared session,
+    * `checkouts`: number of connections checked out by the session,
+    * `queries`: number of statements run by the session.
+    """
+
+    def __init__(self, model, session):
+        self.model = model
+        self.session = session
+        self.checkouts = 0
+        self.queries = 0
+
+
+    def info(self):
+        """
+        Returns a dictionary with the counters of the scope.
+        """
+        return {
+            'checkouts': self.checkouts,
+            'queries': self.queries,
+        }
+
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters,
+                               context, executemany):
+        if getattr(conn, '_sqla_helpers_session', None) is self.session:
+            self.queries += 1
+
+
+def _scopes():
+    """
+    Returns the stack of scopes of the current thread.
+    """
+    try:
+        return _local.scopes
+    except AttributeError:
+        scopes = _local.scopes = []
+        return scopes
+
+
+def current_session(cls):
+    """
+    Returns the session of the innermost scope applying to `cls`, `None`
+    outside of any scope.
+    """
+    for scope in reversed(getattr(_local, 'scopes', ())):
+        if issubclass(cls, scope.model):
+            return scope.session
+    return None
+
+
+@contextmanager
+def using(cls, session=None, close=None):
+    """
+    Context manager sharing `session` between `cls` and its subclasses in the
+    current thread, yielding the :class:`Scope`.
+
+    Without `session`, one is got from the session maker of `cls`. It is
+    closed at the end of the block if `close` is True. By default (`close`
+    is `None`), it is closed only if the session maker is a `sessionmaker`:
+    other session makers (`scoped_session` ...) may return a session shared
+    outside of the block.
+
+    Statements are counted on the bind of the session for `cls`, only while
+    the block runs.
+    """
+    if session is None:
+        sessionmaker = cls.sessionmaker
+        session = call_if_callable(sessionmaker)
+        if close is None:
+            # Seule une fabrique `sessionmaker` crée à coup sûr une session
+            # propre au bloc
+            close = isinstance(sessionmaker, orm.sessionmaker)
+    elif close is None:
+        close = False
+
+    scope = Scope(cls, session)
+    bind = _bind(cls, session)
+    if bind is not None:
+        event.listen(bind, 'before_cursor_execute',
+                     scope._before_cursor_execute)
+    scopes = _scopes()
+    scopes.append(scope)
+    try:
+        yield scope
+    finally:
+        scopes.remove(scope)
+        if bind is not None:
+            event.remove(bind, 'before_cursor_execute',
+                         scope._before_cursor_execute)
+        if close:
+            session.close()
+
+
+def _bind(cls, session):
+    """
+    Returns the engine (or connection) of `session` for `cls`, `None` when
+    it can't be found.
+    """
+    mapper = getattr(cls, '__mapper__', None)
+    try:
+        return session.get_bind(mapper=mapper)
+    except exc.UnboundExecutionError:
+        return None
+
+
+@event.listens_for(Session, 'after_begin')
+def _after_begin(session, transaction, connection):
+    for scope in getattr(_local, 'scopes', ()):
+        if scope.session is session:
+            scope.checkouts += 1
+            # La connexion est marquée avec sa session. Les options
+            # d'exécution (baked queries ...) clonent la connexion, marque
+            # comprise ; la connexion du pool peut, elle, servir à d'autres
+            # sessions du même thread.
+            connection._sqla_helpers_session = session
+
@@ -0,0 +1,59 @@
+from sqla_helpers import instrumentation
+from sqla_helpers.instrumentation import Event, HistogramSink, Registry, \
+        criterions_shape
+from sqla_helpers.logical import Q
+from sqla_helpers.tests.class_test import Treatment
+
+
+def test_criterions_shape():
+    assert criterions_shape([], {}) == ''
+    assert criterions_shape([], {'name': 1, 'id__lt': 2}) == 'id__lt,name'
+    shape = criterions_shape([Q(id=1) | Q(status__name=u'ko')],
+                             {'name__like': u'a%'})
+    assert shape == 'name__like; |2 id status__name'
+    # Values aren't part of the shape
+    assert shape == criterions_shape([Q(id=2) | Q(status__name=u'ok')],
+                                     {'name__like': u'b%'})
+    assert criterions_shape([~Q(id=1)], {}) == '; ~1 id'
+
+
+def test_criterions_shape_callable():
+    def my_operator(klass, joined):
+        pass
+    assert criterions_shape([my_operator], {}) == '; <my_operator>'
+
+
+def test_registry():
+    registry = Registry()
+    events = []
+    registry.listen(events.append)
+    registry.emit(1)
+    registry.remove(events.append)
+    registry.emit(2)
+    assert events == [1]
+    assert registry.listeners == ()
+
+
+def test_histogram_sink():
+    sink = HistogramSink()
+    for i in xrange(100):
+        sink(Event('filter', Treatment, 'id', 0.001, 1, 10))
+    sink(Event('filter', Treatment, 'id', 0.5, 3, 10))
+    sink(Event('get', Treatment, 'id', 0.002, 1, 1))
+    stats = sink.stats()
+    assert set(stats) == set([('filter', 'Treatment', 'id'),
+                              ('get', 'Treatment', 'id')])
+    filter_stats = stats[('filter', 'Treatment', 'id')]
+    assert filter_stats['count'] == 101
+    assert 1 <= filter_stats['p50_ms'] < 1.25
+    assert 1 <= filter_stats['p99_ms'] < 1.25
+    assert 500 <= filter_stats['total_ms'] - 100 < 501
+    assert filter_stats['statements'] == 103 / 101.
+    assert filter_stats['rows'] == 10
+    sink.clear()
+    assert sink.stats() == {}
+
+
+def test_default_registry():
+    assert instrumentation.listen == instrumentation.registry.listen
+    assert instrumentation.registry.listeners == ()
@@ -0,0 +1,103 @@
+from nose import with_setup
+from nose.tools import raises
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from sqla_helpers.base_model import BaseModel
+from sqla_helpers.logical import Q
+from sqla_helpers.tests.class_test import Treatment, Status, metadata
+
+engine = create_engine('sqlite://')
+session = sessionmaker(bind=engine)()
+
+
+def populate():
+    BaseModel.register_sessionmaker(session, force=True)
+    metadata.create_all(engine)
+    status = [Status(u'ok'), Status(u'ko')]
+    session.add_all(status)
+    for i in xrange(10):
+        session.add(Treatment(u'test {}'.format(i), status[0]))
+    for i in xrange(8):
+        session.add(Treatment(u'test_ko {}'.format(i), status[1]))
+    session.commit()
+
+
+def unpopulate():
+    session.query(Treatment).delete()
+    session.query(Status).delete()
+    session.commit()
+
+
+@with_setup(populate, unpopulate)
+def test_aggregate():
+    statements = []
+    def before(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    event.listen(engine, 'before_cursor_execute', before)
+    try:
+        rows = Treatment.aggregate(group_by=['status__name'], count='id',
+                                   max=['id', 'name'], min='id')
+    finally:
+        event.remove(engine, 'before_cursor_execute', before)
+    assert len(statements) == 1
+    assert 'GROUP BY status.name' in statements[0]
+    assert [row._asdict() for row in rows] == [
+        {'status__name': u'ko', 'id__count': 8, 'id__min': 11, 'id__max': 18,
+         'name__max': u'test_ko 7'},
+        {'status__name': u'ok', 'id__count': 10, 'id__min': 1, 'id__max': 10,
+         'name__max': u'test 9'},
+    ]
+    assert rows[1].status__name == u'ok'
+    assert rows[1].id__count == 10
+
+
+@with_setup(populate, unpopulate)
+def test_aggregate_criterions():
+    rows = Treatment.aggregate(Q(id__lt=3) | Q(id__gt=16),
+                               group_by='status_id', sum='id', avg='id')
+    assert [tuple(row) for row in rows] == [(1, 3, 1.5), (2, 35, 17.5)]
+
+    rows = Treatment.aggregate(count='id', status__name=u'ok')
+    assert [tuple(row) for row in rows] == [(10,)]
+
+
+@with_setup(populate, unpopulate)
+def test_aggregate_to_many():
+    rows = Status.aggregate(group_by=['name'], count='treatments__id',
+                            treatments__id__gt=5)
+    assert [tuple(row) for row in rows] == [(u'ko', 8), (u'ok', 5)]
+
+
+@with_setup(populate, unpopulate)
+def test_aggregate_groups():
+    rows = Treatment.aggregate(group_by=['status__name'])
+    assert [tuple(row) for row in rows] == [(u'ko',), (u'ok',)]
+
+
+@with_setup(populate, unpopulate)
+def test_aggregate_outer_join():
+    session.add(Treatment(u'no status', None))
+    session.commit()
+    # Treatments without status are grouped under None
+    rows = Treatment.aggregate(group_by=['status__name'], count='id')
+    assert [tuple(row) for row in rows] == [(None, 1), (u'ko', 8), (u'ok', 10)]
+    # Relations of criterions are inner joined
+    rows = Treatment.aggregate(group_by=['status__name'], count='id',
+                               status__name__like=u'%')
+    assert [tuple(row) for row in rows] == [(u'ko', 8), (u'ok', 10)]
+
+
+@raises(ValueError)
+def test_aggregate_nothing():
+    Treatment.aggregate(status__name=u'ok')
+
+
+@raises(AttributeError)
+def test_aggregate_operator():
+    Treatment.aggregate(count='id__in')
+
+
+@raises(AttributeError)
+def test_aggregate_relation():
+    Treatment.aggregate(count='status')
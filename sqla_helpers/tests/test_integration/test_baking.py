@@ -0,0 +1,131 @@
+from nose import with_setup
+from nose.tools import raises
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from sqla_helpers.tests.class_test import Treatment, Status
+
+
+from sqla_helpers import baking
+from sqla_helpers.base_model import BaseModel
+from sqla_helpers.logical import Q
+from sqla_helpers.tests.class_test import metadata
+
+engine = create_engine('sqlite://')
+session = sessionmaker(bind=engine)()
+
+def populate():
+    BaseModel.register_sessionmaker(session, force=True)
+    metadata.create_all(engine)
+    status = [Status(u'ok'), Status(u'ko')]
+    session.add_all(status)
+
+    ok  = status[0]
+    for i in xrange(10):
+        tr = Treatment(u'test {}'.format(i), ok)
+        session.add(tr)
+
+    ko = status[1]
+    for i in xrange(8):
+        tr = Treatment(u'test_ko {}'.format(i), ko)
+        session.add(tr)
+
+    session.commit()
+
+
+def unpopulate():
+	session.query(Treatment).delete()
+	session.query(Status).delete()
+	session.commit()
+
+
+def test_shape():
+    key, values = baking.shape(Treatment, [Q(id=1) | Q(status__name=u'ko')],
+                               {'name': u'a', 'status_id__in': [1, 2]})
+    assert values == [1, u'ko', u'a', [1, 2]]
+    other_key, other_values = baking.shape(
+        Treatment, [Q(id=4) | Q(status__name=u'ok')],
+        {'status_id__in': [1], 'name': u'b'})
+    assert key == other_key
+    assert other_values == [4, u'ok', u'b', [1]]
+    assert baking.shape(Treatment, [Q(id=1) & Q(status__name=u'ko')],
+                        {'name': u'a', 'status_id__in': [1, 2]})[0] != key
+    none_key, values = baking.shape(Treatment, [], {'name': None})
+    assert values == []
+    assert none_key != baking.shape(Treatment, [], {'name': u'a'})[0]
+
+
+def test_unbakeable():
+    assert baking.shape(Treatment, [lambda klass, joined: None], {}) is None
+    assert baking.shape(Treatment, [], {'status': None}) is None
+    assert baking.shape(Treatment, [], {'id': Treatment.status_id}) is None
+    assert baking.shape(Treatment, [], {'id__in': 1}) is None
+    assert baking.shape(Treatment, [], {'dump_depth': 1}) is None
+
+
+@with_setup(populate, unpopulate)
+def test_baked_operations():
+    assert Treatment.count(status__name=u'ok') == 10
+    assert Treatment.count(status__name=u'ko') == 8
+    assert Treatment.count(Q(id=2) | Q(status__name=u'ko')) == 9
+    assert Treatment.count(Q(id=3) | Q(status__name=u'ok')) == 10
+    assert Treatment.count(~Q(id__in=[1, 2, 3])) == 15
+    assert Treatment.count(~Q(id__in=[1])) == 17
+    assert Treatment.count(name=None) == 0
+    assert [tr.id for tr in Treatment.filter(id__lt=3)] == [1, 2]
+    assert Treatment.one(name=u'test 4').id == 5
+    assert Treatment.get(name=u'test_ko 0').status.name == u'ko'
+
+
+@with_setup(populate, unpopulate)
+def test_baked_compiled_once():
+    compiled = []
+    def count(conn, clauseelement, multiparams, params):
+        compiled.append(clauseelement)
+    Treatment.count(status__name=u'ok', id__gt=0)
+    event.listen(engine, 'before_execute', count)
+    try:
+        assert Treatment.count(status__name=u'ko', id__gt=2) == 8
+        assert Treatment.count(status__name=u'ok', id__gt=5) == 5
+    finally:
+        event.remove(engine, 'before_execute', count)
+    # Same statement object, compiled once
+    assert compiled[0] is compiled[1]
+
+
+@with_setup(populate, unpopulate)
+def test_not_baked():
+    status = Status.get(name=u'ok')
+    assert Treatment.count(status=status) == 10
+    BaseModel.bake_queries = False
+    try:
+        assert Treatment.count(status__name=u'ok') == 10
+    finally:
+        BaseModel.bake_queries = True
+
+
+@with_setup(populate, unpopulate)
+@raises(AttributeError)
+def test_unknow_attr():
+    Treatment.filter(test=u'toto')
+
+
+@with_setup(populate, unpopulate)
+def test_or_to_in_single_shape():
+    q = Q(id=1)
+    for i in xrange(2, 5001):
+        q = q | Q(id=i)
+    key, values = baking.shape(Treatment, [q], {})
+    assert values == [range(1, 5001)]
+    assert key == baking.shape(Treatment, [Q(id=1) | Q(id=7)], {})[0]
+    assert Treatment.count(q) == 18
+    assert Treatment.count(Q(id=1) | Q(id=2) | ~~Q(id=3)) == 3
+
+
+@with_setup(populate, unpopulate)
+def test_any_of():
+    assert Treatment.count(Q.any_of(Q(id=i) for i in xrange(20000))) == 18
+    assert Treatment.count(Q.any_of({'name': u'test {}'.format(i)}
+                                    for i in xrange(3))) == 3
+    assert Treatment.count(Q.any_of([])) == 0
+    assert Treatment.count(Q.all_of([{'id__gt': 2}, {'id__lt': 5}])) == 2
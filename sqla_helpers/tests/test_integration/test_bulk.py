@@ -0,0 +1,181 @@
+from mock import patch
+from nose import with_setup
+from nose.tools import raises
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from sqla_helpers.base_model import BaseModel
+from sqla_helpers.cache import ResultCache
+from sqla_helpers.tests.class_test import Treatment, Status, metadata
+
+engine = create_engine('sqlite://')
+session = sessionmaker(bind=engine)()
+
+
+def populate():
+    BaseModel.register_sessionmaker(session, force=True)
+    metadata.create_all(engine)
+    status = [Status(u'ok'), Status(u'ko')]
+    session.add_all(status)
+    for i in xrange(4):
+        session.add(Treatment(u'test {}'.format(i), status[0]))
+    session.commit()
+
+
+def unpopulate():
+    session.rollback()
+    session.query(Treatment).delete()
+    session.query(Status).delete()
+    session.commit()
+
+
+def names():
+    session.expire_all()
+    return dict((tr.id, (tr.name, tr.status_id))
+                for tr in session.query(Treatment))
+
+
+@with_setup(populate, unpopulate)
+def test_upsert():
+    counts = Treatment.bulk_upsert([
+        {'id': 1, 'name': u'updated'},
+        {'id': 2, 'name': u'updated', 'status_id': 2},
+        {'id': 10, 'name': u'new', 'status_id': 2},
+        {'name': u'no id', 'status_id': 1},
+    ])
+    assert counts == {'inserted': 2, 'updated': 2, 'ignored': 0}
+    res = names()
+    assert len(res) == 6
+    assert res[1] == (u'updated', 1)
+    assert res[2] == (u'updated', 2)
+    assert res[3] == (u'test 2', 1)
+    assert res[10] == (u'new', 2)
+    assert res[11] == (u'no id', 1)
+
+
+@with_setup(populate, unpopulate)
+def test_upsert_ignore():
+    counts = Treatment.bulk_upsert([
+        {'id': 1, 'name': u'updated'},
+        {'id': 10, 'name': u'new', 'status_id': 2},
+    ], on_conflict='ignore')
+    assert counts == {'inserted': 1, 'updated': 0, 'ignored': 1}
+    res = names()
+    assert res[1] == (u'test 0', 1)
+    assert res[10] == (u'new', 2)
+
+
+@with_setup(populate, unpopulate)
+def test_upsert_chunks():
+    statements = []
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(executemany)
+    event.listen(engine, 'before_cursor_execute', count)
+    try:
+        counts = Treatment.bulk_upsert(
+            ({'id': i, 'name': u'bulk {}'.format(i), 'status_id': 1}
+             for i in xrange(1, 1001)), chunk_size=300)
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+    assert counts == {'inserted': 996, 'updated': 4, 'ignored': 0}
+    # A select of existing keys and an executemany per chunk
+    assert statements == [False, True] * 4
+    res = names()
+    assert len(res) == 1000
+    assert res[1] == (u'bulk 1', 1)
+    assert res[1000] == (u'bulk 1000', 1)
+
+
+@with_setup(populate, unpopulate)
+def test_upsert_duplicates():
+    counts = Treatment.bulk_upsert([
+        {'id': 10, 'name': u'first'},
+        {'id': 10, 'name': u'second'},
+    ])
+    assert counts == {'inserted': 1, 'updated': 1, 'ignored': 0}
+    assert names()[10] == (u'second', None)
+
+
+@with_setup(populate, unpopulate)
+def test_upsert_duplicates_columns():
+    # Duplicates with other columns are written in input order
+    rows = [{'id': 200, 'name': u'zz'},
+            {'id': 200, 'name': u'yy', 'status_id': 1},
+            {'id': 200, 'name': u'xx'}]
+    assert Treatment.bulk_upsert(rows) == \
+            {'inserted': 1, 'updated': 2, 'ignored': 0}
+    assert names()[200] == (u'xx', 1)
+    with patch('sqla_helpers.bulk._native_statement', return_value=None):
+        rows = [{'id': 201, 'name': u'zz'},
+                {'id': 201, 'name': u'yy', 'status_id': 1},
+                {'id': 201, 'name': u'xx'},
+                {'id': 1, 'name': u'aa', 'status_id': 2},
+                {'id': 1, 'name': u'bb'}]
+        assert Treatment.bulk_upsert(rows) == \
+                {'inserted': 1, 'updated': 4, 'ignored': 0}
+        assert Treatment.bulk_upsert(rows, on_conflict='ignore') == \
+                {'inserted': 0, 'updated': 0, 'ignored': 5}
+        rows = [{'id': 202, 'name': u'first'},
+                {'id': 202, 'name': u'second', 'status_id': 1}]
+        assert Treatment.bulk_upsert(rows, on_conflict='ignore') == \
+                {'inserted': 1, 'updated': 0, 'ignored': 1}
+    res = names()
+    assert res[201] == (u'xx', 1)
+    assert res[1] == (u'bb', 2)
+    assert res[202] == (u'first', None)
+
+
+@with_setup(populate, unpopulate)
+def test_upsert_relations_ignored():
+    counts = Treatment.bulk_upsert([
+        {'id': 1, 'name': u'updated', 'status': {'id': 2}},
+    ])
+    assert counts == {'inserted': 0, 'updated': 1, 'ignored': 0}
+    assert names()[1] == (u'updated', 1)
+
+
+@with_setup(populate, unpopulate)
+def test_upsert_generic():
+    # Databases without native upsert: INSERT and UPDATE statements
+    with patch('sqla_helpers.bulk._native_statement', return_value=None):
+        counts = Treatment.bulk_upsert([
+            {'id': 1, 'name': u'updated'},
+            {'id': 10, 'name': u'new', 'status_id': 2},
+            {'id': 10, 'name': u'again', 'status_id': 2},
+        ])
+        assert counts == {'inserted': 1, 'updated': 2, 'ignored': 0}
+        counts = Treatment.bulk_upsert([
+            {'id': 2, 'name': u'updated'},
+            {'id': 11, 'name': u'new', 'status_id': 2},
+        ], on_conflict='ignore')
+        assert counts == {'inserted': 1, 'updated': 0, 'ignored': 1}
+    res = names()
+    assert res[1] == (u'updated', 1)
+    assert res[2] == (u'test 1', 1)
+    assert res[10] == (u'again', 2)
+    assert res[11] == (u'new', 2)
+
+
+@with_setup(populate, unpopulate)
+def test_upsert_cache_rollback():
+    BaseModel.result_cache = ResultCache()
+    try:
+        assert Treatment.count(name=u'bulk') == 0
+        Treatment.bulk_upsert([{'id': 10, 'name': u'bulk'}])
+        assert Treatment.count(name=u'bulk') == 1
+        session.rollback()
+        assert Treatment.count(name=u'bulk') == 0
+    finally:
+        BaseModel.result_cache = None
+
+
+@with_setup(populate, unpopulate)
+@raises(AttributeError)
+def test_upsert_unknown_key():
+    Treatment.bulk_upsert([{'id': 1, 'plop': u'updated'}])
+
+
+@with_setup(populate, unpopulate)
+@raises(ValueError)
+def test_upsert_on_conflict():
+    Treatment.bulk_upsert([{'id': 1}], on_conflict='replace')
@@ -0,0 +1,196 @@
+import time
+
+from nose import with_setup
+from nose.tools import raises
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm.exc import NoResultFound
+
+from sqla_helpers.tests.class_test import Treatment, Status
+
+
+from sqla_helpers.base_model import BaseModel
+from sqla_helpers.cache import ResultCache, make_key
+from sqla_helpers.logical import Q
+from sqla_helpers.tests.class_test import metadata
+
+engine = create_engine('sqlite://')
+session = sessionmaker(bind=engine)()
+
+def populate():
+    BaseModel.register_sessionmaker(session, force=True)
+    BaseModel.result_cache = ResultCache(maxsize=8, ttl=60)
+    metadata.create_all(engine)
+    status = [Status(u'ok'), Status(u'ko')]
+    session.add_all(status)
+
+    ok  = status[0]
+    for i in xrange(10):
+        tr = Treatment(u'test {}'.format(i), ok)
+        session.add(tr)
+
+    ko = status[1]
+    for i in xrange(8):
+        tr = Treatment(u'test_ko {}'.format(i), ko)
+        session.add(tr)
+
+    session.commit()
+
+
+def unpopulate():
+	BaseModel.result_cache = None
+	session.query(Treatment).delete()
+	session.query(Status).delete()
+	session.commit()
+
+
+def count_statements(fun, *args, **kwargs):
+    statements = []
+    def count(*args):
+        statements.append(args)
+    event.listen(engine, 'before_cursor_execute', count)
+    try:
+        res = fun(*args, **kwargs)
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+    return res, len(statements)
+
+
+@with_setup(populate, unpopulate)
+def test_cache_hit():
+    cache = BaseModel.result_cache
+    status = Status.get(name=u'ok')
+    res, statements = count_statements(Status.get, name=u'ok')
+    assert res is status
+    assert statements == 0
+    assert cache.hits == 1 and cache.misses == 1
+
+    assert Treatment.count(Q(id=2) | Q(status__name=u'ko')) == 9
+    res, statements = count_statements(Treatment.count,
+                                       Q(id=2) | Q(status__name=u'ko'))
+    assert res == 9
+    assert statements == 0
+
+    treatments = Treatment.filter(status__name=u'ok')
+    treatments.pop()
+    res, statements = count_statements(Treatment.filter, status__name=u'ok')
+    assert len(res) == 10
+    assert statements == 0
+
+
+@with_setup(populate, unpopulate)
+def test_cache_flush_invalidation():
+    assert Treatment.count(status__name=u'ko') == 8
+    assert Status.count() == 2
+    session.add(Treatment(u'new', Status.get(name=u'ko')))
+    session.flush()
+    assert Treatment.count(status__name=u'ko') == 9
+    assert Status.count() == 2
+
+    Status.get(name=u'ok').name = u'OK'
+    session.flush()
+    # Count reads status table, through the join
+    assert Treatment.count(status__name=u'ok') == 0
+
+    session.query(Treatment).filter(Treatment.status_id == 2).delete()
+    assert Treatment.count(status__name=u'ko') == 0
+
+
+@with_setup(populate, unpopulate)
+def test_cache_rollback():
+    cache = BaseModel.result_cache
+    assert Treatment.count() == 18
+    session.add(Treatment(u'new', None))
+    session.flush()
+    assert Treatment.count() == 19
+    # Uncommitted results aren't cached
+    res, statements = count_statements(Treatment.count)
+    assert (res, statements) == (19, 1)
+    assert Status.count() == 2
+    assert len(cache) == 1
+
+    session.rollback()
+    assert Treatment.count() == 18
+    res, statements = count_statements(Treatment.count)
+    assert (res, statements) == (18, 0)
+
+
+@with_setup(populate, unpopulate)
+def test_cache_rollback_invalidation():
+    cache = BaseModel.result_cache
+    session.add(Treatment(u'new', None))
+    session.flush()
+    # An entry read from the flushed table, by another way
+    cache.set(make_key(Treatment, 'count', [], {}), 19,
+              frozenset([Treatment.__table__]))
+    session.rollback()
+    assert Treatment.count() == 18
+
+
+@with_setup(populate, unpopulate)
+def test_cache_bulk_update_rollback():
+    assert Treatment.count(name=u'bulk') == 0
+    session.query(Treatment).filter(Treatment.id == 1)\
+           .update({'name': u'bulk'}, synchronize_session=False)
+    assert Treatment.count(name=u'bulk') == 1
+    session.rollback()
+    assert Treatment.count(name=u'bulk') == 0
+
+
+@with_setup(populate, unpopulate)
+def test_cache_bulk_delete_rollback():
+    assert Treatment.count(id=1) == 1
+    session.query(Treatment).filter(Treatment.id == 1)\
+           .delete(synchronize_session=False)
+    assert Treatment.count(id=1) == 0
+    session.rollback()
+    assert Treatment.count(id=1) == 1
+
+
+@with_setup(populate, unpopulate)
+def test_cache_eviction():
+    cache = BaseModel.result_cache
+    for i in xrange(1, 11):
+        Treatment.filter(id=i)
+    assert len(cache) == 8
+    assert cache.evictions == 2
+    # id 1 was the least recently used
+    cache.ttl = 0
+    Treatment.filter(id=1)
+    assert cache.misses == 11
+    assert cache.evictions == 3
+    time.sleep(0.01)
+    Treatment.filter(id=1)
+    assert cache.info()['evictions'] == 4
+    assert cache.hits == 0
+
+
+@with_setup(populate, unpopulate)
+@raises(NoResultFound)
+def test_cache_no_result():
+    try:
+        Treatment.get(name=u'nothing')
+    finally:
+        assert len(BaseModel.result_cache) == 0
+
+
+@with_setup(populate, unpopulate)
+def test_cache_other_session():
+    other_session = sessionmaker(bind=engine)()
+    status = Status.get(name=u'ok')
+    BaseModel.register_sessionmaker(other_session, force=True)
+    res, statements = count_statements(Status.get, name=u'ok')
+    assert res is not status
+    assert statements == 1
+
+
+def test_make_key():
+    assert make_key(Treatment, 'one', [], {'id': 1, 'name': u'a'}) == \
+            make_key(Treatment, 'one', [], {'name': u'a', 'id': 1})
+    assert make_key(Treatment, 'one', [], {'id__in': [1, 2]}) == \
+            make_key(Treatment, 'one', [], {'id__in': (1, 2)})
+    assert make_key(Treatment, 'one', [Q(id=1) | Q(id=2)], {}) == \
+            make_key(Treatment, 'one', [Q(id=1) | Q(id=2)], {})
+    assert make_key(Treatment, 'one', [Q(id=1)], {}) != \
+            make_key(Treatment, 'count', [Q(id=1)], {})
+    assert make_key(Treatment, 'one', [lambda klass, joined: None], {}) is None
@@ -1,5 +1,6 @@
+from mock import patch
 from nose import with_setup
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
 
 from sqla_helpers.tests.class_test import Treatment, Status
@@ -52,3 +53,103 @@ def test_complex_count():
     assert Treatment.count(~Q(id=2)) == 17
     assert Treatment.count(Q(id=2) | Q(id=3), status__name=u'ok') == 2
     assert Treatment.count(Q(id=2) | Q(status__name=u'ko')) == 9
+
+
+def statements(function):
+    res = []
+    def before(conn, cursor, statement, parameters, context, executemany):
+        res.append(statement)
+    event.listen(engine, 'before_cursor_execute', before)
+    try:
+        result = function()
+    finally:
+        event.remove(engine, 'before_cursor_execute', before)
+    return result, res
+
+
+@with_setup(populate, unpopulate)
+def test_count_statement():
+    for bake_queries in (True, False):
+        BaseModel.bake_queries = bake_queries
+        try:
+            count, sql = statements(
+                lambda: Treatment.count(Q(id=2) | Q(id=3), status__name=u'ok'))
+        finally:
+            BaseModel.bake_queries = True
+        assert count == 2
+        assert len(sql) == 1
+        # No subquery around the selected rows
+        assert sql[0].count('SELECT') == 1
+        assert 'count(*)' in sql[0]
+        assert 'JOIN status' in sql[0]
+
+
+@with_setup(populate, unpopulate)
+def test_count_to_many():
+    # Each status matches several treatments
+    count, sql = statements(
+        lambda: Status.count(treatments__name__like=u'test%'))
+    assert count == 2
+    assert 'count(DISTINCT status.id)' in sql[0]
+    assert Status.count(treatments__name__like=u'test_ko%') == 1
+    assert Status.count(treatments__name__like=u'test%') == \
+            len(Status.filter(treatments__name__like=u'test%'))
+
+
+@with_setup(populate, unpopulate)
+def test_count_estimate():
+    # Without statistics, the count is exact
+    assert Treatment.count(estimate=True) == 18
+    session.execute('ANALYZE')
+    session.add(Treatment(u'new', None))
+    session.flush()
+    try:
+        # Statistics are the ones of the ANALYZE
+        assert Treatment.count(estimate=True) == 18
+        assert Treatment.count() == 19
+        # No estimate for criterions on SQLite
+        assert Treatment.count(estimate=True, status__name=u'ok') == 10
+    finally:
+        session.rollback()
+        session.execute('DROP TABLE sqlite_stat1')
+
+
+@with_setup(populate, unpopulate)
+def test_exists():
+    for bake_queries in (True, False):
+        BaseModel.bake_queries = bake_queries
+        try:
+            exists, sql = statements(
+                lambda: Treatment.exists(status__name=u'ok'))
+            assert Treatment.exists(Q(id=2) | Q(id=300))
+            assert not Treatment.exists(status__name=u'lol')
+            assert not Treatment.exists(Q(id=200) | Q(id=300))
+        finally:
+            BaseModel.bake_queries = True
+        assert exists is True
+        assert len(sql) == 1
+        assert sql[0].startswith('SELECT EXISTS (SELECT')
+
+
+@with_setup(populate, unpopulate)
+def test_exists_limit():
+    # Databases which can't select an EXISTS read the first row
+    BaseModel.bake_queries = False
+    try:
+        with patch('sqla_helpers.counting.selects_exists', return_value=False):
+            exists, sql = statements(
+                lambda: Treatment.exists(status__name=u'ok'))
+            assert not Treatment.exists(status__name=u'lol')
+    finally:
+        BaseModel.bake_queries = True
+    assert exists is True
+    assert 'EXISTS' not in sql[0]
+    assert 'LIMIT' in sql[0]
+
+
+@with_setup(populate, unpopulate)
+def test_first():
+    first = Treatment.first(status__name=u'ko')
+    assert first.status.name == u'ko'
+    assert Treatment.first(status__name=u'lol') is None
+    assert Treatment.first(Q(id=3) | Q(id=300)).id == 3
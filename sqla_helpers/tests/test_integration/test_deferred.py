@@ -0,0 +1,214 @@
+import json
+from StringIO import StringIO
+
+from nose import with_setup
+from sqlalchemy import Column, ForeignKey, Integer, String, Text, \
+        create_engine, event
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import deferred, load_only, relationship, sessionmaker
+
+from sqla_helpers.base_model import BaseModel
+
+Base = declarative_base(cls=BaseModel)
+
+
+class Folder(Base):
+    __tablename__ = 'folder'
+    id = Column('id', Integer, primary_key=True)
+    name = Column('name', String)
+
+
+class Document(Base):
+    __tablename__ = 'document'
+    id = Column('id', Integer, primary_key=True)
+    title = Column('title', String)
+    summary = Column('summary', Text)
+    content = deferred(Column('content', Text))
+    folder_id = Column('folder_id', ForeignKey('folder.id'))
+    folder = relationship('Folder', backref='documents')
+
+
+engine = create_engine('sqlite://')
+session = sessionmaker(bind=engine)()
+statements = []
+
+
+def before(conn, cursor, statement, parameters, context, executemany):
+    statements.append(statement)
+
+
+def populate():
+    BaseModel.register_sessionmaker(session, force=True)
+    Base.metadata.create_all(engine)
+    folder = Folder(id=1, name=u'folder')
+    session.add(folder)
+    for i in xrange(1, 4):
+        session.add(Document(id=i, title=u'doc {0}'.format(i),
+                             summary=u'summary' * 100, content=u'x' * 10000,
+                             folder=folder))
+    session.commit()
+    session.expunge_all()
+    del statements[:]
+    event.listen(engine, 'before_cursor_execute', before)
+
+
+def unpopulate():
+    event.remove(engine, 'before_cursor_execute', before)
+    session.rollback()
+    Base.metadata.drop_all(engine)
+
+
+@with_setup(populate, unpopulate)
+def test_dump_skips_deferred():
+    document = Document.get(id=1)
+    del statements[:]
+    dumped = document.dump(depth=1)
+    assert statements == []
+    assert dumped == {'id': 1, 'title': u'doc 1', 'summary': u'summary' * 100,
+                      'folder_id': 1}
+
+    stream = StringIO()
+    document.dump_json(stream, depth=1)
+    assert json.loads(stream.getvalue()) == dumped
+    assert statements == []
+
+
+@with_setup(populate, unpopulate)
+def test_dump_deferred_asked():
+    document = Document.get(id=1)
+    assert document.dump(depth=1, deferred=True)['content'] == u'x' * 10000
+    document = Document.get(id=2)
+    assert document.dump(depth=1, includes=['id', 'content']) == \
+            {'id': 2, 'content': u'x' * 10000}
+    stream = StringIO()
+    Document.get(id=3).dump_json(stream, depth=1, deferred=True)
+    assert json.loads(stream.getvalue())['content'] == u'x' * 10000
+
+
+@with_setup(populate, unpopulate)
+def test_dump_expired():
+    document = Document.get(id=1)
+    session.commit()
+    # Expired columns are loaded, deferred ones aren't
+    assert document.dump(depth=1) == {'id': 1, 'title': u'doc 1',
+                                      'summary': u'summary' * 100,
+                                      'folder_id': 1}
+
+
+@with_setup(populate, unpopulate)
+def test_dump_new_object():
+    document = Document(title=u'new')
+    assert document.dump(depth=1) == {'id': None, 'title': u'new',
+                                      'summary': None, 'content': None,
+                                      'folder_id': None}
+
+
+@with_setup(populate, unpopulate)
+def test_dump_pending_object():
+    # Columns never set on a flushed object aren't deferred: they are dumped
+    document = Document.load({'title': u'pending'})
+    session.add(document)
+    session.flush()
+    dumped = document.dump(depth=1)
+    assert dumped == {'id': 4, 'title': u'pending', 'summary': None,
+                      'folder_id': None}
+
+    stream = StringIO()
+    document.dump_json(stream, depth=1)
+    assert stream.getvalue() == json.dumps(dumped)
+
+
+@with_setup(populate, unpopulate)
+def test_dump_deferred_option():
+    document = Document.search(id=1).options(
+        load_only('id', 'title')).one()
+    del statements[:]
+    assert document.dump(depth=1) == {'id': 1, 'title': u'doc 1'}
+    assert statements == []
+
+
+@with_setup(populate, unpopulate)
+def test_iter_dump_excludes():
+    dumped = list(Document.iter_dump(depth=1, excludes=['summary']))
+    assert len(statements) == 1
+    assert 'summary' not in statements[0]
+    assert 'content' not in statements[0]
+    assert dumped[0] == {'id': 1, 'title': u'doc 1', 'folder_id': 1}
+
+
+@with_setup(populate, unpopulate)
+def test_iter_dump_includes():
+    dumped = list(Document.iter_dump(includes=['title', 'content', 'folder']))
+    assert len(statements) == 1
+    assert 'summary' not in statements[0]
+    assert 'document.content' in statements[0]
+    assert dumped[0] == {'title': u'doc 1', 'content': u'x' * 10000,
+                         'folder': {'id': 1, 'name': u'folder'}}
+
+
+@with_setup(populate, unpopulate)
+def test_dump_many_includes():
+    dumped = Document.dump_many(Document.search(), includes=['id', 'title'])
+    assert len(statements) == 1
+    assert 'summary' not in statements[0]
+    assert dumped == [{'id': i, 'title': u'doc {0}'.format(i)}
+                      for i in xrange(1, 4)]
+
+    stream = StringIO()
+    Document.dump_json_many(Document.search(), stream, excludes=['summary'],
+                            depth=1)
+    assert 'summary' not in statements[-1]
+    assert json.loads(stream.getvalue())[0] == {'id': 1, 'title': u'doc 1',
+                                                'folder_id': 1}
+
+
+@with_setup(populate, unpopulate)
+def test_excluded_primary_key():
+    expected = [{'title': u'doc {0}'.format(i), 'folder_id': 1}
+                for i in xrange(1, 4)]
+    assert Document.dump_many(Document.search(), depth=1,
+                              excludes=['id', 'summary']) == expected
+    assert list(Document.iter_dump(depth=1, excludes=['id', 'summary'])) == \
+            expected
+
+    stream = StringIO()
+    Document.dump_json_many(Document.search(), stream, depth=1,
+                            excludes=['id', 'summary'])
+    assert json.loads(stream.getvalue()) == expected
+
+
+def _deferred_model(index):
+    """
+    Returns a model with columns named after `index` and a deferred column.
+    """
+    columns = dict(('column_{0}_{1}'.format(index, i), Column(String))
+                   for i in xrange(4))
+    columns.update(__tablename__='deferred_{0}'.format(index),
+                   id=Column(Integer, primary_key=True),
+                   body=deferred(Column(Text)))
+    return type('Deferred{0}'.format(index), (Base, ), columns)
+
+
+_deferred_models = [_deferred_model(index) for index in xrange(20)]
+
+
+@with_setup(populate, unpopulate)
+def test_dump_json_deferred_order():
+    # Keys order of a dictionary depends on the set of keys: JSON must be
+    # the same as the one of the dictionary without deferred columns.
+    for model in _deferred_models:
+        values = dict((column.key, u'value') for column in model.__table__.c
+                      if column.key != 'id')
+        session.add(model(id=1, **values))
+    session.commit()
+    session.expunge_all()
+
+    for model in _deferred_models:
+        instance = model.get(id=1)
+        stream = StringIO()
+        instance.dump_json(stream)
+        assert stream.getvalue() == json.dumps(instance.dump())
+
+        stream = StringIO()
+        model.dump_json_many(model.search(), stream)
+        assert stream.getvalue() == json.dumps(model.dump_many(model.search()))
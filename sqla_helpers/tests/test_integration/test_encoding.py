@@ -0,0 +1,93 @@
+import datetime
+import decimal
+import json
+from StringIO import StringIO
+
+from nose import with_setup
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from sqla_helpers.tests.class_test import Treatment, Status
+
+
+from sqla_helpers.base_model import BaseModel
+from sqla_helpers.encoding import encode_value
+from sqla_helpers.tests.class_test import metadata
+
+engine = create_engine('sqlite://')
+session = sessionmaker(bind=engine)()
+
+def populate():
+    BaseModel.register_sessionmaker(session, force=True)
+    metadata.create_all(engine)
+    status = [Status(u'ok'), Status(u'k\xf8')]
+    session.add_all(status)
+
+    ok  = status[0]
+    for i in xrange(10):
+        tr = Treatment(u'test {}'.format(i), ok)
+        session.add(tr)
+
+    ko = status[1]
+    for i in xrange(8):
+        tr = Treatment(u'test_k\xf8 {}'.format(i), ko)
+        session.add(tr)
+
+    session.commit()
+
+
+def unpopulate():
+	session.query(Treatment).delete()
+	session.query(Status).delete()
+	session.commit()
+
+
+@with_setup(populate, unpopulate)
+def test_dump_json():
+    for tr in Treatment.filter():
+        for kwargs in ({}, {'depth': 1}, {'depth': 3},
+                       {'excludes': ['status_id', 'name']}):
+            stream = StringIO()
+            tr.dump_json(stream, **kwargs)
+            assert stream.getvalue() == json.dumps(tr.dump(**kwargs))
+
+
+@with_setup(populate, unpopulate)
+def test_dump_json_many():
+    expected = json.dumps([st.dump(depth=3) for st in Status.filter()])
+    stream = StringIO()
+    assert Status.dump_json_many(Status.search(), stream, depth=3) == 2
+    assert stream.getvalue() == expected
+
+    stream = StringIO()
+    assert Status.dump_json_many([], stream) == 0
+    assert stream.getvalue() == '[]'
+
+
+@with_setup(populate, unpopulate)
+def test_dump_json_many_ndjson():
+    treatments = Treatment.filter(status__name=u'ok')
+    stream = StringIO()
+    count = Treatment.dump_json_many(treatments, stream, ndjson=True,
+                                     excludes=['status'])
+    assert count == 10
+    lines = stream.getvalue().split('\n')
+    assert lines[-1] == ''
+    assert lines[:-1] == [json.dumps(tr.dump(excludes=['status']))
+                          for tr in treatments]
+
+
+def test_encode_value():
+    assert encode_value(None) == 'null'
+    assert encode_value(True) == 'true'
+    assert encode_value(3) == '3'
+    assert encode_value(2 ** 70) == json.dumps(2 ** 70)
+    assert encode_value(1.1) == json.dumps(1.1)
+    assert encode_value(u'\xe9"') == json.dumps(u'\xe9"')
+    assert encode_value({'a': [1]}) == json.dumps({'a': [1]})
+    assert encode_value(decimal.Decimal('1.10')) == '1.10'
+    assert encode_value(datetime.datetime(2014, 2, 21, 10, 30)) == \
+            '"2014-02-21T10:30:00"'
+    assert encode_value(datetime.date(2014, 2, 21)) == '"2014-02-21"'
+    assert encode_value(bytearray('\x00\xff')) == '"AP8="'
+    assert encode_value(buffer('\x00\xff')) == '"AP8="'
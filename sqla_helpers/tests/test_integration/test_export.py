@@ -0,0 +1,81 @@
+import gc
+import os
+import tempfile
+
+from nose import with_setup
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from sqla_helpers.tests.class_test import Treatment, Status
+
+
+from sqla_helpers.base_model import BaseModel
+from sqla_helpers.tests.class_test import metadata
+
+# The memory test runs over 1M rows when SQLA_HELPERS_BIG_TESTS is set.
+if os.environ.get('SQLA_HELPERS_BIG_TESTS'):
+    ROWS = 1000000
+else:
+    ROWS = 20000
+
+db_file = tempfile.NamedTemporaryFile(suffix='.sqlite')
+engine = create_engine('sqlite:///{0}'.format(db_file.name))
+session = sessionmaker(bind=engine)()
+
+def populate():
+    BaseModel.register_sessionmaker(session, force=True)
+    metadata.create_all(engine)
+    engine.execute(Status.__table__.insert(),
+                   [{'id': 1, 'name': u'ok'}, {'id': 2, 'name': u'ko'}])
+    insert = Treatment.__table__.insert()
+    for start in xrange(0, ROWS, 10000):
+        engine.execute(insert, [
+            {'id': i + 1, 'name': u'test {0}'.format(i), 'status_id': i % 2 + 1}
+            for i in xrange(start, min(start + 10000, ROWS))
+        ])
+
+
+def unpopulate():
+	session.query(Treatment).delete()
+	session.query(Status).delete()
+	session.commit()
+
+
+@with_setup(populate, unpopulate)
+def test_iter_dump():
+    expected = [tr.dump() for tr in Treatment.filter(id__le=50)]
+    session.expunge_all()
+    dumped = list(Treatment.iter_dump(id__le=50, chunk_size=7))
+    assert sorted(dumped) == sorted(expected)
+    assert list(Treatment.iter_dump(status__name=u'ok', id__le=4, depth=1,
+                                    excludes=['name'])) in (
+        [{'id': 1, 'status_id': 1}, {'id': 3, 'status_id': 1}],
+        [{'id': 3, 'status_id': 1}, {'id': 1, 'status_id': 1}],
+    )
+
+
+@with_setup(populate, unpopulate)
+def test_iter_dump_keeps_session_objects():
+    status = Status.get(id=1)
+    for _ in Treatment.iter_dump(chunk_size=10, id__le=100):
+        pass
+    assert status in session
+    assert len(session.identity_map) == 1
+
+
+@with_setup(populate, unpopulate)
+def test_iter_dump_memory():
+    session.expunge_all()
+    chunk_size = 1000
+    gc.collect()
+    objects = []
+    for position, _ in enumerate(Treatment.iter_dump(chunk_size=chunk_size), 1):
+        # Loaded objects never exceed a chunk
+        assert len(session.identity_map) <= chunk_size + 2
+        if position in (ROWS // 10, ROWS - 1):
+            gc.collect()
+            objects.append(len(gc.get_objects()))
+
+    assert position == ROWS
+    # The number of living objects doesn't grow with the exported rows
+    assert objects[1] - objects[0] < chunk_size * 10
@@ -1,6 +1,8 @@
 from nose import with_setup
-from sqlalchemy import create_engine
+from nose.tools import raises
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm.exc import NoResultFound
 
 from sqla_helpers.tests.class_test import Treatment, Status
 
@@ -49,3 +51,52 @@ def test_filter():
   assert len(Treatment.filter(id=1)) == 1
   assert len(Treatment.filter(~Q(id=1))) == 17
   assert len(Treatment.filter(status__name=u'ok')) == len(Treatment.filter(~Q(status__name=u'ko')))
+
+
+@with_setup(populate, unpopulate)
+def test_get_identity_map():
+    statements = []
+    def count(*args):
+        statements.append(args)
+    tr = Treatment.get(id=1)
+    event.listen(engine, 'before_cursor_execute', count)
+    try:
+        assert Treatment.get(id=1) is tr
+        assert not statements
+        assert Treatment.get(id=1, name=u'test 0') is tr
+        assert len(statements) == 1
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+
+
+@with_setup(populate, unpopulate)
+@raises(NoResultFound)
+def test_get_unknown():
+    Treatment.get(id=42)
+
+
+@with_setup(populate, unpopulate)
+@raises(NoResultFound)
+def test_one_unknown():
+    Treatment.one(id=42)
+
+
+@with_setup(populate, unpopulate)
+def test_get_expired():
+    tr = Treatment.get(id=1)
+    session.query(Treatment).filter(Treatment.id == 1)\
+           .update({'name': u'updated'}, synchronize_session=False)
+    session.commit()
+    # Expired objects are read again
+    assert Treatment.get(id=1) is tr
+    assert tr.name == u'updated'
+
+    session.query(Treatment).filter(Treatment.id == 1)\
+           .delete(synchronize_session=False)
+    session.commit()
+    try:
+        Treatment.get(id=1)
+    except NoResultFound:
+        pass
+    else:
+        assert False, 'NoResultFound not raised'
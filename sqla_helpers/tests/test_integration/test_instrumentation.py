@@ -0,0 +1,101 @@
+from nose import with_setup
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from sqla_helpers import instrumentation
+from sqla_helpers.base_model import BaseModel
+from sqla_helpers.logical import Q
+from sqla_helpers.tests.class_test import Treatment, Status, metadata
+
+engine = create_engine('sqlite://')
+session = sessionmaker(bind=engine)()
+events = []
+
+
+def populate():
+    BaseModel.register_sessionmaker(session, force=True)
+    metadata.create_all(engine)
+    status = [Status(u'ok'), Status(u'ko')]
+    session.add_all(status)
+    for i in xrange(10):
+        session.add(Treatment(u'test {}'.format(i), status[i % 2]))
+    session.commit()
+    session.expunge_all()
+    del events[:]
+    instrumentation.listen(events.append)
+
+
+def unpopulate():
+    instrumentation.remove(events.append)
+    session.rollback()
+    session.query(Treatment).delete()
+    session.query(Status).delete()
+    session.commit()
+
+
+@with_setup(populate, unpopulate)
+def test_query_operations():
+    Treatment.filter(Q(id=1) | Q(id=300), status__name=u'ok')
+    Treatment.count(status__name=u'ko')
+    Treatment.exists(id=3)
+    assert [(e.operation, e.model, e.shape, e.statements, e.rows)
+            for e in events] == [
+        ('filter', Treatment, 'status__name; |2 id id', 1, 1),
+        ('count', Treatment, 'status__name', 1, 1),
+        ('exists', Treatment, 'id', 1, 1),
+    ]
+    assert all(e.duration > 0 for e in events)
+
+
+@with_setup(populate, unpopulate)
+def test_outermost_call():
+    # `get` calls `one`, a single event is emitted
+    treatment = Treatment.get(id=1)
+    assert [(e.operation, e.shape, e.statements, e.rows) for e in events] == \
+            [('get', 'id', 1, 1)]
+    # From the identity map
+    Treatment.get(id=1)
+    assert events[-1].statements == 0
+
+    # Relations loaded by `dump` are part of its event
+    treatment.dump()
+    assert [(e.operation, e.model, e.shape, e.statements, e.rows)
+            for e in events[2:]] == [('dump', Treatment, None, 1, 1)]
+
+
+@with_setup(populate, unpopulate)
+def test_search_and_load():
+    query = Treatment.search(status__name=u'ok', dump_depth=2)
+    assert (events[0].operation, events[0].shape, events[0].rows) == \
+            ('search', 'dump_depth,status__name', None)
+    Treatment.dump_many(query)
+    Treatment.load({'id': 1, 'name': u'loaded'})
+    assert [(e.operation, e.shape, e.statements, e.rows)
+            for e in events[1:]] == [('dump_many', None, 1, 5),
+                                     ('load', 'id,name', 1, 1)]
+
+
+@with_setup(populate, unpopulate)
+def test_histogram_sink():
+    sink = instrumentation.HistogramSink()
+    instrumentation.listen(sink)
+    try:
+        for i in xrange(1, 6):
+            Treatment.filter(id=i)
+    finally:
+        instrumentation.remove(sink)
+    Treatment.filter(id=1)
+    stats = sink.stats()
+    assert stats.keys() == [('filter', 'Treatment', 'id')]
+    assert stats[('filter', 'Treatment', 'id')]['count'] == 5
+    assert stats[('filter', 'Treatment', 'id')]['statements'] == 1
+
+
+@with_setup(populate, unpopulate)
+def test_no_listener():
+    instrumentation.remove(events.append)
+    try:
+        Treatment.filter(id=1)
+        assert events == []
+    finally:
+        instrumentation.listen(events.append)
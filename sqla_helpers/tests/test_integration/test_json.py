@@ -1,6 +1,8 @@
 from nose import with_setup
-from sqlalchemy import create_engine
+from nose.tools import raises
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm.exc import NoResultFound
 
 from sqla_helpers.tests.class_test import Treatment, Status
 
@@ -76,3 +78,96 @@ def test_coeherence():
     tr = Treatment.get(id=1)
     tr2 = Treatment.load(tr.dump())
     assert tr == tr2
+
+
+@with_setup(populate, unpopulate)
+def test_load_many():
+    dictionaries = [
+        {'id': 1, 'name': u'plop'},
+        {'id': 2, 'status': {'id': 2}},
+        {'name': u'new', 'status': {'id': 1}},
+        {'name': u'new', 'status': {'name': u'new status'}},
+        {'id': 1},
+    ]
+    loaded = Treatment.load_many(dictionaries)
+    expected = [Treatment.load(d) for d in dictionaries]
+    assert len(loaded) == len(expected)
+    for i in (0, 1, 4):
+        assert loaded[i] is expected[i]
+    for i in (2, 3):
+        assert loaded[i] is not expected[i]
+        assert loaded[i].name == expected[i].name
+        assert loaded[i].status.name == expected[i].status.name
+    assert loaded[0] is loaded[4]
+    assert loaded[0].name == u'plop'
+    assert loaded[1].status.name == u'ko'
+    assert loaded[2].status is Status.get(id=1)
+
+
+def count_statements(fun, *args, **kwargs):
+    statements = []
+    def count(*args):
+        statements.append(args)
+    event.listen(engine, 'before_cursor_execute', count)
+    try:
+        res = fun(*args, **kwargs)
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+    return res, len(statements)
+
+
+@with_setup(populate, unpopulate)
+def test_load_many_queries():
+    session.expunge_all()
+    _, statements = count_statements(Treatment.load_many,
+                                     [{'id': i, 'status': {'id': 1}}
+                                      for i in xrange(1, 11)], chunk_size=5)
+    # Two chunks of treatments and one for status
+    assert statements == 3
+
+
+@with_setup(populate, unpopulate)
+@raises(NoResultFound)
+def test_load_many_unknown():
+    Treatment.load_many([{'id': 1}, {'id': 42}])
+
+
+@with_setup(populate, unpopulate)
+def test_dump_many():
+    expected = [tr.dump(depth=3) for tr in Treatment.filter()]
+    session.expire_all()
+    res, statements = count_statements(Treatment.dump_many,
+                                       Treatment.search(), depth=3)
+    assert res == expected
+    # treatment joined with status, then status' treatments
+    assert statements == 2
+
+    expected = [st.dump(excludes=['name']) for st in Status.filter()]
+    session.expire_all()
+    res, statements = count_statements(Status.dump_many, Status.search(),
+                                       excludes=['name'])
+    assert res == expected
+    assert statements == 2
+
+
+@with_setup(populate, unpopulate)
+def test_dump_many_instances():
+    treatments = Treatment.filter(status__name=u'ko')
+    expected = [tr.dump() for tr in treatments]
+    session.expire_all()
+    treatments = Treatment.filter(status__name=u'ko')
+    res, statements = count_statements(Treatment.dump_many, treatments)
+    assert res == expected
+    assert statements == 1
+
+
+@with_setup(populate, unpopulate)
+def test_search_dump_depth():
+    expected = [tr.dump() for tr in Treatment.filter(status__name=u'ok')]
+    session.expire_all()
+    def dump():
+        return [tr.dump() for tr in Treatment.search(status__name=u'ok',
+                                                     dump_depth=2)]
+    res, statements = count_statements(dump)
+    assert res == expected
+    assert statements == 1
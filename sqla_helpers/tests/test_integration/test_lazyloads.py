@@ -0,0 +1,123 @@
+from nose import with_setup
+from nose.tools import raises
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm.strategies import LazyLoader
+
+from sqla_helpers import lazyloads
+from sqla_helpers.base_model import BaseModel
+from sqla_helpers.lazyloads import LazyLoadDetector, TooManyLazyLoads
+from sqla_helpers.tests.class_test import Treatment, Status, metadata
+
+engine = create_engine('sqlite://')
+session = sessionmaker(bind=engine)()
+
+
+def populate():
+    BaseModel.register_sessionmaker(session, force=True)
+    metadata.create_all(engine)
+    status = [Status(u'status {}'.format(i)) for i in xrange(5)]
+    session.add_all(status)
+    for i in xrange(20):
+        session.add(Treatment(u'test {}'.format(i), status[i % 5]))
+    session.commit()
+    session.expunge_all()
+
+
+def unpopulate():
+    BaseModel.lazy_load_threshold = None
+    session.rollback()
+    session.query(Treatment).delete()
+    session.query(Status).delete()
+    session.commit()
+
+
+@with_setup(populate, unpopulate)
+def test_detect():
+    with BaseModel.detect_lazy_loads() as detector:
+        dumped = [status.dump() for status in Status.filter()]
+    assert len(dumped[0]['treatments']) == 4
+
+    report = detector.report()
+    assert len(report) == 1
+    assert report[0].model is Status
+    assert report[0].path == 'treatments'
+    assert report[0].count == 5
+    assert report[0].suggestion == 'selectinload(Status.treatments)'
+    assert detector.count == 5
+
+
+@with_setup(populate, unpopulate)
+def test_paths():
+    # Status are lazy loaded from treatments: paths start at the treatments
+    with BaseModel.detect_lazy_loads() as detector:
+        for treatment in Treatment.filter(id__lt=10):
+            treatment.dump(depth=3)
+
+    report = detector.report()
+    assert [(lazy_load.name, lazy_load.count) for lazy_load in report] == \
+            [('Treatment.status', 5), ('Treatment.status__treatments', 5)]
+    assert report[1].suggestion == \
+            'joinedload(Treatment.status).selectinload(Status.treatments)'
+
+    session.expunge_all()
+    query = Treatment.search(id__lt=10).options(report[1].option())
+    with BaseModel.detect_lazy_loads() as detector:
+        for treatment in query:
+            treatment.dump(depth=3)
+    assert detector.report() == []
+
+
+@with_setup(populate, unpopulate)
+def test_eager_dump():
+    with BaseModel.detect_lazy_loads() as detector:
+        Status.dump_many(Status.search())
+    assert detector.count == 0
+
+
+@with_setup(populate, unpopulate)
+def test_threshold():
+    with LazyLoadDetector(threshold=5):
+        [status.dump() for status in Status.filter()]
+
+    session.expunge_all()
+    try:
+        with LazyLoadDetector(threshold=4):
+            [status.dump() for status in Status.filter()]
+    except TooManyLazyLoads as e:
+        assert e.threshold == 4
+        assert [lazy_load.name for lazy_load in e.lazy_loads] == \
+                ['Status.treatments']
+        assert 'selectinload(Status.treatments)' in str(e)
+    else:
+        assert False, 'TooManyLazyLoads not raised'
+
+
+@with_setup(populate, unpopulate)
+def test_nested():
+    with LazyLoadDetector() as outer:
+        Treatment.get(id=1).status
+        with LazyLoadDetector() as inner:
+            Treatment.get(id=2).status
+    assert outer.count == 2
+    assert inner.count == 1
+
+
+@with_setup(populate, unpopulate)
+def test_inactive():
+    assert LazyLoader._emit_lazyload.im_func is lazyloads._emit_lazyload
+    with LazyLoadDetector():
+        assert LazyLoader._emit_lazyload.im_func is not \
+                lazyloads._emit_lazyload
+    assert LazyLoader._emit_lazyload.im_func is lazyloads._emit_lazyload
+
+
+@with_setup(populate, unpopulate)
+@raises(TooManyLazyLoads)
+def test_class_threshold():
+    treatment = Treatment.get(id=1)
+    assert treatment.dump()['status']['id'] == treatment.status_id
+
+    session.expunge_all()
+    BaseModel.lazy_load_threshold = 0
+    Treatment.get(id=1).dump()
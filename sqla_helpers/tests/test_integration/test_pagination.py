@@ -0,0 +1,128 @@
+from nose import with_setup
+from nose.tools import raises
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from sqla_helpers.tests.class_test import Treatment, Status
+
+
+from sqla_helpers.base_model import BaseModel
+from sqla_helpers.logical import Q
+from sqla_helpers.pagination import InvalidCursor
+from sqla_helpers.tests.class_test import metadata
+
+engine = create_engine('sqlite://')
+session = sessionmaker(bind=engine)()
+
+def populate():
+    BaseModel.register_sessionmaker(session, force=True)
+    metadata.create_all(engine)
+    status = [Status(u'ok'), Status(u'ko')]
+    session.add_all(status)
+
+    ok  = status[0]
+    for i in xrange(10):
+        tr = Treatment(u'test {}'.format(i), ok)
+        session.add(tr)
+
+    ko = status[1]
+    for i in xrange(8):
+        tr = Treatment(u'test_ko {}'.format(i), ko)
+        session.add(tr)
+
+    session.commit()
+
+
+def unpopulate():
+	session.query(Treatment).delete()
+	session.query(Status).delete()
+	session.commit()
+
+
+def read_pages(*operators, **criterions):
+    pages = []
+    after = None
+    while True:
+        page = Treatment.paginate(*operators, after=after, **criterions)
+        pages.append([tr.id for tr in page])
+        if not page.has_next:
+            return pages
+        after = page.next
+
+
+@with_setup(populate, unpopulate)
+def test_paginate():
+    page = Treatment.paginate(per_page=5)
+    assert [tr.id for tr in page] == [1, 2, 3, 4, 5]
+    assert len(page) == 5
+    assert page.next
+    assert read_pages(per_page=5) == [range(1, 6), range(6, 11),
+                                      range(11, 16), range(16, 19)]
+    assert read_pages(per_page=9) == [range(1, 10), range(10, 19)]
+    assert read_pages(per_page=20) == [range(1, 19)]
+
+
+@with_setup(populate, unpopulate)
+def test_paginate_criterions():
+    assert read_pages(Q(id__lt=4) | Q(id__gt=15), status__name=u'ko',
+                      per_page=2) == [[16, 17], [18]]
+    assert read_pages(status__name=u'nothing') == [[]]
+
+
+@with_setup(populate, unpopulate)
+def test_paginate_order_by():
+    assert read_pages(per_page=4, order_by='-id') == [
+        range(18, 14, -1), range(14, 10, -1), range(10, 6, -1),
+        range(6, 2, -1), [2, 1]]
+    # Mixed directions, primary key follows the last direction
+    pages = read_pages(per_page=4, order_by=['status_id', '-name'])
+    assert sum(pages, []) == range(10, 0, -1) + range(18, 10, -1)
+    pages = read_pages(per_page=3, order_by=['-status_id', 'name'])
+    assert sum(pages, []) == range(11, 19) + range(1, 11)
+
+
+@with_setup(populate, unpopulate)
+@raises(InvalidCursor)
+def test_paginate_invalid_cursor():
+    Treatment.paginate(after='plop')
+
+
+@with_setup(populate, unpopulate)
+@raises(InvalidCursor)
+def test_paginate_other_ordering():
+    page = Treatment.paginate(per_page=2)
+    Treatment.paginate(after=page.next, order_by=['name'])
+
+
+@with_setup(populate, unpopulate)
+def test_paginate_to_many():
+    pages = []
+    after = None
+    while True:
+        page = Status.paginate(treatments__name__like=u'test%', per_page=1,
+                               after=after)
+        pages.append([status.name for status in page])
+        if not page.has_next:
+            break
+        after = page.next
+    assert pages == [[u'ok'], [u'ko']]
+
+
+@with_setup(populate, unpopulate)
+def test_paginate_null_values():
+    Treatment.get(id=5).name = None
+    Treatment.get(id=12).name = None
+    session.commit()
+
+    pages = read_pages(per_page=1, order_by='name')
+    assert len(pages) == 18
+    # Null values are last in ascending order
+    assert sum(pages, [])[-2:] == [5, 12]
+
+    pages = read_pages(per_page=4, order_by='-name')
+    assert sum(pages, [])[:2] == [12, 5]
+    assert sorted(sum(pages, [])) == range(1, 19)
+
+    pages = read_pages(per_page=3, order_by=['-status_id', 'name'])
+    assert sum(pages, []) == [11, 13, 14, 15, 16, 17, 18, 12,
+                              1, 2, 3, 4, 6, 7, 8, 9, 10, 5]
@@ -0,0 +1,91 @@
+import os
+import shutil
+import tempfile
+
+from nose import with_setup
+from nose.tools import raises
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from sqla_helpers import parallel
+from sqla_helpers.base_model import BaseModel
+from sqla_helpers.logical import Q
+from sqla_helpers.tests.class_test import Treatment, Status, metadata
+
+directory = None
+engine = None
+session = None
+
+
+def populate():
+    global directory, engine, session
+    # Workers need a database they can open: a file
+    directory = tempfile.mkdtemp()
+    engine = create_engine('sqlite:///' + os.path.join(directory, 'test.db'))
+    session = sessionmaker(bind=engine)()
+    BaseModel.register_sessionmaker(session, force=True)
+    metadata.create_all(engine)
+    status = [Status(u'ok'), Status(u'ko')]
+    session.add_all(status)
+    for i in xrange(100):
+        session.add(Treatment(u'test {}'.format(i), status[i % 2]))
+    session.commit()
+
+
+def unpopulate():
+    session.close()
+    engine.dispose()
+    shutil.rmtree(directory)
+
+
+def test_ranges():
+    assert parallel.ranges([1, 2, 3, 5, 8, 13, 21], 3) == \
+            [(1, 3), (5, 13), (21, 21)]
+    assert parallel.ranges([1, 2], 8) == [(1, 1), (2, 2)]
+    assert parallel.ranges([], 8) == []
+
+
+@with_setup(populate, unpopulate)
+def test_parallel_dump():
+    expected = [tr.dump() for tr in session.query(Treatment)
+                                           .order_by(Treatment.id)]
+    dumped = list(Treatment.parallel_dump(workers=3))
+    assert dumped == expected
+
+
+@with_setup(populate, unpopulate)
+def test_parallel_dump_criterions():
+    dumped = list(Treatment.parallel_dump(
+        Q(id__lt=10) | Q(id__gt=95), status__name=u'ok', workers=2, depth=1))
+    assert [d['id'] for d in dumped] == [1, 3, 5, 7, 9, 97, 99]
+    assert 'status' not in dumped[0]
+
+    dumped = list(Treatment.parallel_dump(status__name=u'ok', workers=2,
+                                          excludes=['status_id']))
+    assert len(dumped) == 50
+    assert dumped[0] == {'id': 1, 'name': u'test 0',
+                         'status': {'id': 1, 'name': u'ok'}}
+
+
+@with_setup(populate, unpopulate)
+def test_parallel_dump_single_worker():
+    dumped = list(Treatment.parallel_dump(status__name=u'ko', workers=1))
+    assert [d['id'] for d in dumped] == range(2, 101, 2)
+
+
+@with_setup(populate, unpopulate)
+def test_parallel_dump_empty():
+    assert list(Treatment.parallel_dump(id__gt=1000, workers=2)) == []
+
+
+@with_setup(populate, unpopulate)
+@raises(ValueError)
+def test_parallel_dump_operator():
+    list(Treatment.parallel_dump(lambda klass, joined: None, workers=2))
+
+
+@raises(ValueError)
+def test_parallel_dump_memory():
+    memory = sessionmaker(bind=create_engine('sqlite://'))()
+    BaseModel.register_sessionmaker(memory, force=True)
+    list(Treatment.parallel_dump(workers=2))
@@ -0,0 +1,106 @@
+from nose import with_setup
+from nose.tools import raises
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from sqla_helpers import projection
+from sqla_helpers.base_model import BaseModel
+from sqla_helpers.logical import Q
+from sqla_helpers.tests.class_test import Treatment, Status, metadata
+
+engine = create_engine('sqlite://')
+session = sessionmaker(bind=engine)()
+
+
+def populate():
+    BaseModel.register_sessionmaker(session, force=True)
+    metadata.create_all(engine)
+    status = [Status(u'ok'), Status(u'ko')]
+    session.add_all(status)
+    for i in xrange(4):
+        session.add(Treatment(u'test {}'.format(i), status[i % 2]))
+    session.add(Treatment(u'no status', None))
+    session.commit()
+    session.expunge_all()
+
+
+def unpopulate():
+    session.query(Treatment).delete()
+    session.query(Status).delete()
+    session.commit()
+
+
+@with_setup(populate, unpopulate)
+def test_values():
+    rows = Treatment.values(fields=['id', 'status__name'], id__lt=3)
+    assert rows == [(1, u'ok'), (2, u'ko')]
+    assert rows[1].id == 2
+    assert rows[1].status__name == u'ko'
+    assert type(rows[0]) is projection.record_class(['id', 'status__name'])
+    # No object is loaded
+    assert len(session.identity_map) == 0
+
+
+@with_setup(populate, unpopulate)
+def test_values_default_fields():
+    rows = Treatment.values(Q(id=1) | Q(id=4))
+    assert rows[0]._asdict() == {'id': 1, 'name': u'test 0', 'status_id': 1}
+    assert [row.id for row in rows] == [1, 4]
+
+
+@with_setup(populate, unpopulate)
+def test_values_outer_join():
+    # Relations crossed by fields only don't filter objects
+    rows = Treatment.values(fields=['name', 'status__name'], id__gt=3)
+    assert rows == [(u'test 3', u'ko'), (u'no status', None)]
+    # Relations of criterions are inner joined
+    rows = Treatment.values(fields=['name', 'status__name'], id__gt=3,
+                            status__name=u'ko')
+    assert rows == [(u'test 3', u'ko')]
+
+
+def test_record_class_bounded():
+    record = projection.record_class(['id', 'name'])
+    for i in xrange(projection.RECORDS_MAXSIZE):
+        projection.record_class(['field_{0}'.format(i)])
+        # Recently used classes are kept
+        assert projection.record_class(['id', 'name']) is record
+    assert len(projection._records) == projection.RECORDS_MAXSIZE
+    assert ('field_0', ) not in projection._records
+
+
+@with_setup(populate, unpopulate)
+def test_values_tuples():
+    rows = Treatment.values(fields=['id'], status__name=u'ok', named=False)
+    assert rows == [(1,), (3,)]
+    assert type(rows[0]) is tuple
+
+
+@with_setup(populate, unpopulate)
+def test_filter_fields():
+    rows = Treatment.filter(status__name=u'ok', fields=['id', 'name'])
+    assert rows == [(1, u'test 0'), (3, u'test 2')]
+    assert rows[1].name == u'test 2'
+    assert len(session.identity_map) == 0
+    assert [t.id for t in Treatment.filter(status__name=u'ok')] == [1, 3]
+
+
+@with_setup(populate, unpopulate)
+@raises(AttributeError)
+def test_values_relation():
+    Treatment.values(fields=['status'])
+
+
+@with_setup(populate, unpopulate)
+def test_values_autoflush():
+    session.add(Treatment(u'pending', None))
+    assert Treatment.values(fields=['name'], name=u'pending') == \
+            [(u'pending', )]
+    assert len(Treatment.filter(fields=['id'], name=u'pending')) == 1
+
+    session.autoflush = False
+    try:
+        session.add(Treatment(u'not flushed', None))
+        assert Treatment.values(name=u'not flushed') == []
+    finally:
+        session.autoflush = True
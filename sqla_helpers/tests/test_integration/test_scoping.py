@@ -0,0 +1,123 @@
+import threading
+
+from nose import with_setup
+from sqlalchemy import create_engine
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+from sqla_helpers.base_model import BaseModel
+from sqla_helpers.tests.class_test import Treatment, Status, metadata
+
+engine = create_engine('sqlite://')
+factory = sessionmaker(bind=engine)
+
+
+def populate():
+    BaseModel.register_sessionmaker(factory, force=True)
+    metadata.create_all(engine)
+    session = factory()
+    status = [Status(u'ok'), Status(u'ko')]
+    session.add_all(status)
+    for i in xrange(10):
+        session.add(Treatment(u'test {}'.format(i), status[i % 2]))
+    session.commit()
+    session.close()
+
+
+def unpopulate():
+    session = factory()
+    session.query(Treatment).delete()
+    session.query(Status).delete()
+    session.commit()
+    session.close()
+
+
+@with_setup(populate, unpopulate)
+def test_session_per_access():
+    assert Treatment.session is not Treatment.session
+
+
+@with_setup(populate, unpopulate)
+def test_using():
+    with BaseModel.using() as scope:
+        session = Treatment.session
+        assert Status.session is session
+        treatment = Treatment.get(id=1)
+        assert Treatment.get(id=1) is treatment
+        assert Treatment.count(status__name=u'ok') == 5
+        assert treatment.status is Status.get(name=u'ok')
+    assert scope.session is session
+    assert scope.checkouts == 1
+    # get, count, lazy load of status, get by name
+    assert scope.queries == 4
+    assert scope.info() == {'checkouts': 1, 'queries': 4}
+    assert Treatment.session is not session
+    # Session made by the scope is closed at the end
+    assert treatment not in session
+    # Statements are only counted in the block
+    assert len(engine.dispatch.before_cursor_execute) == 0
+    Treatment.count()
+    assert scope.queries == 4
+
+
+@with_setup(populate, unpopulate)
+def test_using_session():
+    session = factory()
+    with BaseModel.using(session) as scope:
+        first = Treatment.get(id=1)
+        session.commit()
+        second = Treatment.get(id=2)
+    assert scope.checkouts == 2
+    assert scope.queries == 2
+    # Given session isn't closed
+    assert first in session
+    assert second in session
+    session.close()
+
+
+@with_setup(populate, unpopulate)
+def test_using_nested():
+    outer_session = factory()
+    inner_session = factory()
+    with BaseModel.using(outer_session) as outer:
+        with Treatment.using(inner_session) as inner:
+            assert Treatment.session is inner_session
+            assert Status.session is outer_session
+            Treatment.count()
+            Status.count()
+        assert Treatment.session is outer_session
+    assert outer.queries == 1
+    assert inner.queries == 1
+    outer_session.close()
+    inner_session.close()
+
+
+@with_setup(populate, unpopulate)
+def test_using_thread():
+    sessions = []
+    session = factory()
+    with BaseModel.using(session):
+        thread = threading.Thread(
+            target=lambda: sessions.append(Treatment.session))
+        thread.start()
+        thread.join()
+    assert sessions[0] is not session
+    session.close()
+
+
+@with_setup(populate, unpopulate)
+def test_using_scoped_session():
+    scoped = scoped_session(factory)
+    BaseModel.register_sessionmaker(scoped, force=True)
+    treatment = Treatment.get(id=1)
+    treatment.name = u'changed'
+    with BaseModel.using() as scope:
+        assert scope.session is scoped()
+    # The thread's session isn't closed by the scope
+    assert treatment in scoped()
+    assert Treatment.get(id=1).name == u'changed'
+
+    with BaseModel.using(close=True):
+        pass
+    assert treatment not in scoped()
+    scoped.remove()
+
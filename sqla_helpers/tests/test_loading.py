@@ -0,0 +1,54 @@
+from sqla_helpers.tests.class_test import Treatment, Status
+
+from sqla_helpers import loading
+from sqla_helpers.loading import model_plan, COLUMN, SCALAR, COLLECTION
+
+
+def test_model_plan():
+    plan = model_plan(Treatment)
+    assert set(p.key for p in plan.columns) == set(['id', 'name', 'status_id'])
+    assert [p.key for p in plan.scalars] == ['status']
+    assert plan.scalars[0].target is Status
+    assert plan.collections == ()
+    assert plan.keys == frozenset(['id', 'name', 'status_id', 'status'])
+    assert plan.primary_key == ('id',)
+
+
+def test_model_plan_backref():
+    plan = model_plan(Status)
+    assert [p.key for p in plan.collections] == ['treatments']
+    assert plan.collections[0].kind == COLLECTION
+    assert plan.collections[0].target is Treatment
+    assert all(p.kind == COLUMN for p in plan.columns)
+    assert [p.key for p in plan.relations] == ['treatments']
+
+
+def test_model_plan_cached():
+    assert model_plan(Treatment) is model_plan(Treatment)
+    loading._plans.clear()
+    plan = model_plan(Treatment)
+    assert plan is model_plan(Treatment)
+    assert plan.scalars[0].kind == SCALAR
+
+
+def test_loading_key():
+    assert loading.loading_key(Treatment, {'id': 1, 'name': u'test'}) == {'id': 1}
+    assert loading.loading_key(Treatment, {'name': u'test'}) is None
+
+
+def test_collect_primary_keys():
+    keys = loading.collect_primary_keys(Treatment, [
+        {'id': 1, 'status': {'id': 2}},
+        {'name': u'test', 'status': {'id': 1, 'treatments': [{'id': 3}]}},
+        None,
+    ], {})
+    assert keys == {Treatment: set([(1,), (3,)]), Status: set([(1,), (2,)])}
+
+
+def test_identity():
+    assert loading.identity(Treatment, {'id': 1}) == (1,)
+    assert loading.identity(Treatment, {'id': 1, 'name': u'test'}) is None
+    assert loading.identity(Treatment, {'id__lt': 1}) is None
+    assert loading.identity(Treatment, {'name': 1}) is None
+    assert loading.identity(Treatment, {'id': None}) is None
+    assert loading.identity(Treatment, {'id': [1]}) is None
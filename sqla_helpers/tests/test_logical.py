@@ -0,0 +1,213 @@
+from nose.tools import raises
+from sqla_helpers.tests.class_test import Treatment, Status
+from sqla_helpers.logical import Q, AndASTNode, OrASTNode, NotASTNode, \
+        optimize
+
+
+def test_nary_node():
+    ast = OrASTNode(AndASTNode(id=1), AndASTNode(id=2), AndASTNode(id=3))
+    assert len(ast.children) == 3
+    assert ast.lhs.operand == {'id': 1}
+    assert ast.rhs.operand == {'id': 2}
+    assert str(ast(Treatment, [])) == \
+            str((Q(id=1) | Q(id=2) | Q(id=3)).ast(Treatment, []))
+
+
+def test_flatten():
+    ast = optimize((Q(id__lt=1) | Q(name=u'a') | Q(status__name=u'b')).ast,
+                   Treatment)
+    assert isinstance(ast, OrASTNode)
+    assert [child.operand for child in ast.children] == \
+            [{'id__lt': 1}, {'name': u'a'}, {'status__name': u'b'}]
+
+    ast = optimize((Q(id__lt=1) & (Q(name=u'a') & Q(id__gt=3))).ast,
+                   Treatment)
+    assert isinstance(ast, AndASTNode)
+    assert len(ast.children) == 3
+
+
+def test_mixed_not_flattened():
+    ast = optimize(((Q(id__lt=1) | Q(name=u'a')) & Q(id__gt=3)).ast,
+                   Treatment)
+    assert isinstance(ast, AndASTNode)
+    assert isinstance(ast.children[0], OrASTNode)
+    assert len(ast.children[0].children) == 2
+
+
+def test_dedupe():
+    ast = optimize((Q(name=u'a') & Q(name=u'a') & Q(id__lt=2)).ast,
+                   Treatment)
+    assert [child.operand for child in ast.children] == \
+            [{'name': u'a'}, {'id__lt': 2}]
+    ast = optimize((Q(name=u'a') | Q(name=u'a')).ast, Treatment)
+    assert ast.operand == {'name': u'a'}
+
+
+def test_double_not():
+    ast = optimize((~~Q(name=u'a')).ast, Treatment)
+    assert ast.operand == {'name': u'a'}
+    ast = optimize((~~~Q(name=u'a')).ast, Treatment)
+    assert isinstance(ast, NotASTNode)
+    assert ast.lhs.operand == {'name': u'a'}
+
+
+def test_or_to_in():
+    q = Q(id=1)
+    for i in xrange(2, 5001):
+        q = q | Q(id=i)
+    ast = optimize(q.ast, Treatment)
+    assert ast.operand == {'id__in': range(1, 5001)}
+
+    ast = optimize((Q(id=1) | Q(name=u'a') | Q(id__in=[2, 1]) |
+                    Q(status__name=u'b') | Q(status__name=u'c')).ast,
+                   Treatment)
+    assert [child.operand for child in ast.children] == \
+            [{'id__in': [1, 2]}, {'name': u'a'},
+             {'status__name__in': [u'b', u'c']}]
+
+
+def test_or_not_merged():
+    # None, relations, and multi criterions leaves are kept as is
+    status = Status(u'ok')
+    ast = optimize((Q(id=None) | Q(id=1)).ast, Treatment)
+    assert len(ast.children) == 2
+    ast = optimize((Q(status=status) | Q(status=status)).ast, Treatment)
+    assert ast.operand == {'status': status}
+    ast = optimize((Q(id=1, name=u'a') | Q(id=2)).ast, Treatment)
+    assert len(ast.children) == 2
+    ast = optimize((Q(id=1) & Q(id=2)).ast, Treatment)
+    assert len(ast.children) == 2
+
+
+def test_original_untouched():
+    q = Q(id=1) | Q(id=2)
+    ast = q.ast
+    q.optimized(Treatment)
+    assert q.ast is ast
+    assert ast.lhs.operand == {'id': 1}
+    assert ast.rhs.operand == {'id': 2}
+
+
+def test_deep_tree():
+    # Deeper than the recursion limit: built, optimized and evaluated
+    # without recursion
+    q = Q(id__lt=0)
+    for i in xrange(1, 100000):
+        q = q | Q(id__lt=i) if i % 2 else q | Q(name=unicode(i))
+    ast = q.optimized(Treatment)
+    # Equalities on name are merged in a single IN
+    assert len(ast.children) == 50002
+    assert ast.children[2].operand['name__in'][:2] == [u'2', u'4']
+    assert len(q.ast(Treatment, []).clauses) == 2
+    assert len(q(Treatment, []).clauses) == 50002
+
+    q = Q(id=0)
+    for i in xrange(100000):
+        q = ~q
+    assert str(q(Treatment, [])) == str(Treatment.id == 0)
+
+
+def test_any_of():
+    q = Q.any_of(Q(id__lt=i) for i in xrange(100000))
+    assert len(q.ast.children) == 100000
+    assert len(q(Treatment, []).clauses) == 100000
+
+    q = Q.any_of([{'name': u'a'}, Q(name=u'b'), {'id': 1, 'name': u'c'}])
+    ast = q.optimized(Treatment)
+    assert [child.operand for child in ast.children] == \
+            [{'name__in': [u'a', u'b']}, {'id': 1, 'name': u'c'}]
+    assert str(Q.any_of([])(Treatment, [])) == 'false'
+
+
+def test_all_of():
+    q = Q.all_of([{'id__gt': 4}, Q(name=u'b') | Q(name=u'c')])
+    ast = q.optimized(Treatment)
+    assert isinstance(ast, AndASTNode)
+    assert ast.children[0].operand == {'id__gt': 4}
+    assert ast.children[1].operand == {'name__in': [u'b', u'c']}
+
+
+def test_serialize():
+    q = Q(name=u'a') | Q(id__in=[1, 2])
+    assert q.serialize() == '["|",[["&",{"id__in":[1,2]}],["&",{"name":"a"}]]]'
+    assert (Q(id__in=[1, 2]) | Q(name=u'a')).serialize() == q.serialize()
+    assert Q(id=1, name=u'a').serialize() == \
+            (Q(name=u'a') & Q(id=1)).serialize()
+    assert ((Q(id=1) | Q(id=2)) | Q(id=3)).serialize() == \
+            (Q(id=3) | (Q(id=2) | Q(id=1))).serialize()
+    assert (Q(id=1) | Q(id=1)).serialize() == Q(id=1).serialize()
+    assert (Q(id=1) & Q(id=2)).serialize() != (Q(id=1) | Q(id=2)).serialize()
+
+
+def test_serialize_values():
+    import datetime
+    import decimal
+    q = Q(id__in=set([3, 1]), name=None, price=decimal.Decimal('1.50'),
+          day=datetime.date(2014, 2, 21),
+          at=datetime.datetime(2014, 2, 21, 10, 30, 0, 5),
+          flag=True) & ~Q(name=u'\xe9t\xe9')
+    loaded = Q.from_serialized(q.serialize())
+    assert loaded == q
+    leaves = dict(loaded.ast.children[i].operand.items()[0]
+                  for i in xrange(6))
+    assert leaves['id__in'] == [1, 3]
+    assert leaves['price'] == decimal.Decimal('1.50')
+    assert leaves['day'] == datetime.date(2014, 2, 21)
+    assert leaves['at'] == datetime.datetime(2014, 2, 21, 10, 30, 0, 5)
+    assert leaves['name'] is None
+    assert leaves['flag'] is True
+    assert loaded.ast.children[6].lhs.operand == {'name': u'\xe9t\xe9'}
+
+
+def test_serialize_binary():
+    q = Q.any_of(Q(name=unicode(i)) for i in xrange(1000))
+    binary = q.serialize(binary=True)
+    assert len(binary) < len(q.serialize())
+    assert Q.from_serialized(binary) == q
+    assert Q.from_serialized(unicode(q.serialize())) == q
+
+
+@raises(ValueError)
+def test_deserialize_invalid():
+    Q.from_serialized('["?",{"id":1}]')
+
+
+@raises(ValueError)
+def test_deserialize_garbage():
+    Q.from_serialized('plop')
+
+
+@raises(TypeError)
+def test_serialize_object():
+    Q(status=Status(u'ok')).serialize()
+
+
+@raises(TypeError)
+def test_serialize_binary_string():
+    Q(name='\xff').serialize()
+
+
+def test_eq_hash_binary_string():
+    # Not UTF-8: only equal to itself
+    q = Q(name='\xff')
+    assert q == q
+    assert q != Q(name=u'a')
+    assert q != Q(name='\xff')
+    assert q in set([q])
+    assert Q(name='a') == Q(name=u'a')
+
+
+def test_eq_hash():
+    assert Q(id=1) | Q(name=u'a') == Q(name=u'a') | Q(id=1)
+    assert hash(Q(id=1) | Q(name=u'a')) == hash(Q(name=u'a') | Q(id=1))
+    assert Q(id=1) != Q(id=2)
+    assert len(set([Q(id=1), Q(id=1), Q(id=2) & Q(name=u'a'),
+                    Q(name=u'a', id=2)])) == 2
+    assert Q(id=1) != {'id': 1}
+
+    # Not serializable: only equal to itself
+    status = Status(u'ok')
+    q = Q(status=status)
+    assert q == q
+    assert q != Q(status=status)
+    assert q in set([q])
@@ -1,7 +1,10 @@
 from nose.tools import raises
-from sqla_helpers.tests.class_test import  Treatment, Status
+from sqlalchemy import Column, Integer
+from sqlalchemy.orm import configure_mappers
+from sqla_helpers.tests.class_test import  Treatment, Status, DeclarativeModel
 
-from sqla_helpers.process import process_params
+from sqla_helpers.process import process_params, process_path, LookupPlan, \
+        LookupCache, lookup_cache
 
 def test_simple():
     res = process_params(Treatment, [], id=0)
@@ -67,3 +70,85 @@ def test_multiple_relation():
                          status__id=0)
     assert len(joined_class) == 1
     assert Status in joined_class
+
+
+def test_lookup_plan():
+    plan = LookupPlan.compile(Treatment, 'status__name__like')
+    assert plan.classes == (Status,)
+    assert plan.operator == 'like'
+    joined_class = []
+    res = plan('te%', joined_class)
+    assert joined_class == [Status]
+    assert str(Status.name.like('te%')) == str(res)
+
+
+def test_lookup_cache_hit():
+    cache = LookupCache()
+    plan = cache.get(Treatment, 'status__id')
+    assert cache.misses == 1 and cache.hits == 0
+    assert cache.get(Treatment, 'status__id') is plan
+    assert cache.hits == 1
+    # Same key on another class is another plan
+    cache.get(Status, 'id')
+    cache.get(Treatment, 'id')
+    assert cache.misses == 3
+    assert len(cache) == 3
+
+
+def test_lookup_cache_bounded():
+    cache = LookupCache(maxsize=2)
+    cache.get(Treatment, 'id')
+    cache.get(Treatment, 'name')
+    cache.get(Treatment, 'id')
+    cache.get(Treatment, 'status_id')
+    assert len(cache) == 2
+    # 'name' was the least recently used, it has been evicted
+    cache.get(Treatment, 'id')
+    assert cache.hits == 2
+    cache.get(Treatment, 'name')
+    assert cache.misses == 4
+
+
+@raises(AttributeError)
+def test_lookup_cache_unknow_attr():
+    cache = LookupCache()
+    try:
+        cache.get(Treatment, 'status__test')
+    finally:
+        assert len(cache) == 0
+
+
+def test_lookup_cache_invalidation():
+    process_params(Treatment, [], status__name='test')
+    assert len(lookup_cache)
+    configure_mappers()
+    lookup_cache.clear()
+    process_params(Treatment, [], status__name='test')
+    misses = lookup_cache.misses
+    # A new mapper triggers a configuration which empties the cache
+    class Other(DeclarativeModel):
+        __tablename__ = 'other_lookup'
+        id = Column('id', Integer, primary_key=True)
+    configure_mappers()
+    assert len(lookup_cache) == 0
+    process_params(Treatment, [], status__name='test')
+    assert lookup_cache.misses == misses + 1
+
+
+def test_process_path():
+    class_found = []
+    assert process_path(Treatment, class_found, 'name') is Treatment.name
+    assert class_found == []
+    assert process_path(Treatment, class_found, 'status__name') is Status.name
+    assert process_path(Treatment, class_found, 'status__id') is Status.id
+    assert class_found == [Status]
+
+
+@raises(AttributeError)
+def test_process_path_operator():
+    process_path(Treatment, [], 'status__name__like')
+
+
+@raises(AttributeError)
+def test_process_path_relation():
+    process_path(Treatment, [], 'status')
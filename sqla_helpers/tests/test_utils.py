@@ -1,4 +1,5 @@
-from sqla_helpers.utils import call_if_callable
+from nose.tools import raises
+from sqla_helpers.utils import call_if_callable, freeze
 
 def test_simple_nocallable():
     assert u'test' == call_if_callable(u'test')
@@ -46,3 +47,16 @@ def test_callable_else():
         return u'{0}.plop'.format(x)
 
     assert u'test.plop' == call_if_callable(u'test', else_=concat_plop)
+
+
+def test_freeze():
+    assert freeze(1) == 1
+    assert freeze([1, [2, 3]]) == (1, (2, 3))
+    assert freeze(set([1, 2])) == frozenset([1, 2])
+    assert freeze({'b': [1], 'a': 2}) == (('a', 2), ('b', (1,)))
+    assert hash(freeze({'a': [{'b': set([1])}]}))
+
+
+@raises(TypeError)
+def test_freeze_unhashable():
+    freeze([bytearray('plop')])
@@ -5,6 +5,8 @@ Some tools to help development
 
 .. autofunction:: call_if_callable
 
+.. autofunction:: freeze
+
 """
 
 def call_if_callable(maybe_callable, callable_args=None, callable_kwargs=None, else_=lambda x: x):	
@@ -45,3 +47,25 @@ def call_if_callable(maybe_callable, callable_args=None, callable_kwargs=None, e
         res = else_(maybe_callable)
 
     return res
+
+
+def freeze(value):
+    """
+    Returns an hashable equivalent of `value`: lists and tuples become tuples,
+    sets become frozensets and dictionaries become sorted tuples of items.
+
+    .. code-block:: python
+
+        >>> freeze({'id__in': [1, 2], 'name': u'test'})
+        (('id__in', (1, 2)), ('name', u'test'))
+
+    A `TypeError` is raised if a value can't be hashed.
+    """
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    if isinstance(value, (set, frozenset)):
+        return frozenset(freeze(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, freeze(v)) for k, v in value.iteritems()))
+    hash(value)
+    return value